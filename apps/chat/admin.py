@@ -1,6 +1,72 @@
+from datetime import timedelta
+
 from django.contrib import admin
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.html import format_html
+
+from apps.chat.models import ChatRoom, Message
+from apps.common.paginations import EstimatedCountPaginator
+
+
+class RecentMessagesFilter(admin.SimpleListFilter):
+    """Bounded time windows on the indexed timestamp column."""
+
+    title = "sent"
+    parameter_name = "sent_within"
+    windows = {
+        "1h": ("Last hour", timedelta(hours=1)),
+        "24h": ("Last 24 hours", timedelta(days=1)),
+        "7d": ("Last 7 days", timedelta(days=7)),
+    }
+
+    def lookups(self, request, model_admin):
+        return [(key, label) for key, (label, _) in self.windows.items()]
+
+    def queryset(self, request, queryset):
+        if self.value() in self.windows:
+            _, window = self.windows[self.value()]
+            return queryset.filter(timestamp__gte=timezone.now() - window)
+        return queryset
+
+
+@admin.register(ChatRoom)
+class ChatRoomAdmin(admin.ModelAdmin):
+    list_display = ("id", "name", "messages_link")
+    search_fields = ("=id", "^name")
+    ordering = ("-id",)
+    raw_id_fields = ("users", "dm_user_low", "dm_user_high")
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    @admin.display(description="Messages")
+    def messages_link(self, chat_room):
+        url = reverse("admin:chat_message_changelist")
+        return format_html(
+            '<a href="{}?chatroom__id__exact={}">View messages</a>', url, chat_room.pk
+        )
+
+
+@admin.register(Message)
+class MessageAdmin(admin.ModelAdmin):
+    list_display = ("id", "chatroom", "seq", "sender", "timestamp", "content_preview")
+    list_select_related = ("sender", "chatroom")
+    list_filter = (RecentMessagesFilter,)
+    # Exact matches only, so searches hit the unique indexes instead of scanning content
+    search_fields = ("=sender__username", "=sender__email")
+    raw_id_fields = ("chatroom", "sender")
+    # Bodies may be stored compressed, so they are shown decoded and read-only
+    exclude = ("content_text",)
+    readonly_fields = ("content",)
+    ordering = ("-id",)
+    sortable_by = ("id",)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
-from apps.chat.models import Message, ChatRoom
+    def lookup_allowed(self, lookup, value, request=None):
+        # Allows the room filter used by ChatRoomAdmin's "View messages" link
+        return lookup == "chatroom__id__exact" or super().lookup_allowed(lookup, value, request)
 
-admin.site.register(ChatRoom)
-admin.site.register(Message)
+    @admin.display(description="Content")
+    def content_preview(self, message):
+        return message.get_content_preview()
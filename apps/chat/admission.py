@@ -0,0 +1,102 @@
+import asyncio
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from config import settings
+
+# Application close code telling clients to reconnect after the hinted delay
+CLOSE_CODE_RETRY_LATER = 4503
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"retry_after={retry_after:.1f}")
+        self.retry_after = retry_after
+
+
+class HandshakeAdmission:
+    """
+    Bounds how many WebSocket handshakes (token validation, user and room lookups) run
+    at once in this process.
+
+    Handshakes past the limit wait in a queue for at most `queue_timeout` seconds; when
+    the queue is full they are rejected right away. Rejected clients get a jittered
+    retry-after hint that grows with the backlog, so a reconnect storm spreads out
+    instead of hitting the server again all at the same moment.
+    """
+
+    def __init__(self, *, concurrency: int, queue_size: int, queue_timeout: float):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self._semaphore = None
+        self.in_progress = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.max_wait = 0.0
+        self._recent_waits = deque(maxlen=1000)
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    def get_retry_after(self) -> float:
+        minimum, maximum = settings.WS_RETRY_AFTER_SECONDS
+        backlog = min(1.0, self.waiting / max(1, self.queue_size))
+        return minimum + (maximum - minimum) * backlog * random.random() + random.random()
+
+    def reject(self):
+        self.rejected += 1
+        raise AdmissionRejected(retry_after=self.get_retry_after())
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.waiting >= self.queue_size:
+            self.reject()
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.reject()
+        finally:
+            self.waiting -= 1
+        waited = time.monotonic() - started
+        self._recent_waits.append(waited)
+        self.max_wait = max(self.max_wait, waited)
+        self.admitted += 1
+        self.in_progress += 1
+        try:
+            yield
+        finally:
+            self.in_progress -= 1
+            self.semaphore.release()
+
+    def get_stats(self) -> dict:
+        waits = sorted(self._recent_waits)
+
+        def percentile(fraction):
+            return round(waits[int((len(waits) - 1) * fraction)] * 1000, 2) if waits else 0.0
+
+        return {
+            "concurrency": self.concurrency,
+            "in_progress": self.in_progress,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "wait_ms_p50": percentile(0.5),
+            "wait_ms_p99": percentile(0.99),
+            "wait_ms_max": round(self.max_wait * 1000, 2),
+        }
+
+
+handshake_admission = HandshakeAdmission(
+    concurrency=settings.WS_HANDSHAKE_CONCURRENCY,
+    queue_size=settings.WS_HANDSHAKE_QUEUE_SIZE,
+    queue_timeout=settings.WS_HANDSHAKE_QUEUE_TIMEOUT,
+)
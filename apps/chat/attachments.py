@@ -0,0 +1,108 @@
+import hashlib
+import re
+from collections import OrderedDict
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+
+from config import settings
+
+# Bytes moved per read or write, so memory per upload or download stays constant
+BLOCK_SIZE = 64 * 1024
+
+_RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def get_attachment_path(relative_path: str) -> Path:
+    return Path(settings.ATTACHMENT_ROOT) / relative_path
+
+
+def hash_file_prefix(path: Path, length: int):
+    """sha256 of the first `length` bytes of the file, read in blocks."""
+    hasher = hashlib.sha256()
+    with open(path, "rb") as file:
+        remaining = length
+        while remaining:
+            block = file.read(min(BLOCK_SIZE, remaining))
+            if not block:
+                raise ValueError(f"{path} is shorter than {length} bytes")
+            hasher.update(block)
+            remaining -= len(block)
+    return hasher
+
+
+class AttachmentHasherCache:
+    """
+    Running sha256 of in-progress uploads, so each chunk only hashes its own bytes.
+
+    An upload whose next chunk lands on another process, or whose hasher was evicted,
+    has its received prefix re-hashed from disk once and continues from there.
+    """
+
+    def __init__(self, *, max_uploads: int):
+        self.max_uploads = max_uploads
+        self._hashers = OrderedDict()
+
+    def pop(self, attachment_id: int, offset: int):
+        """Takes the hasher of `attachment_id` if it has hashed exactly `offset` bytes."""
+        entry = self._hashers.pop(attachment_id, None)
+        if entry is None or entry[0] != offset:
+            return None
+        return entry[1]
+
+    def put(self, attachment_id: int, offset: int, hasher):
+        self._hashers[attachment_id] = (offset, hasher)
+        self._hashers.move_to_end(attachment_id)
+        if len(self._hashers) > self.max_uploads:
+            self._hashers.popitem(last=False)
+
+
+attachment_hasher_cache = AttachmentHasherCache(max_uploads=settings.ATTACHMENT_HASHER_CACHE_SIZE)
+
+
+def parse_range_header(header: str, size: int) -> tuple[int, int] | None:
+    """
+    (start, end inclusive) of a single-range "bytes=" header, None when the header
+    should be ignored (malformed or multiple ranges). Raises ValueError when the range
+    can't be satisfied.
+    """
+    match = _RANGE_PATTERN.match(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # "bytes=-500" is the last 500 bytes
+        suffix_length = int(last)
+        if not suffix_length:
+            raise ValueError("Empty suffix range")
+        return max(size - suffix_length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+async def aiter_file_range(path: Path, start: int, length: int):
+    """
+    Yields `length` bytes of the file from `start`, one block at a time.
+
+    Asynchronous on purpose: under ASGI Django buffers synchronous streaming responses,
+    FileResponse included, completely in memory before sending them.
+    """
+    file = await sync_to_async(open, thread_sensitive=False)(path, "rb")
+    try:
+        file.seek(start)
+        remaining = length
+        while remaining:
+            block = await sync_to_async(file.read, thread_sensitive=False)(
+                min(BLOCK_SIZE, remaining)
+            )
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+    finally:
+        file.close()
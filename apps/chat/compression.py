@@ -0,0 +1,53 @@
+import zlib
+
+from config import settings
+
+# Preset dictionaries seed the compressor with strings common in pasted logs, stack
+# traces and code, which helps most on bodies just above the threshold. Stored bodies
+# start with the format byte, so a dictionary may be added but never changed once used.
+_DICTIONARY_V1 = b" ".join(
+    [
+        b"DEBUG INFO WARNING WARN ERROR CRITICAL FATAL TRACE",
+        b"Traceback (most recent call last):",
+        b'  File "/usr/local/lib/python3.11/site-packages/',
+        b"line in raise return self. def class import from None True False",
+        b"Exception: Error: TypeError: ValueError: KeyError: AttributeError:",
+        b"at java.lang. at org. at com. Caused by: NullPointerException",
+        b"    at async function const let var => console.log( undefined null",
+        b"SELECT * FROM WHERE AND ORDER BY LIMIT INSERT INTO VALUES UPDATE SET",
+        b"GET POST PUT DELETE HTTP/1.1 200 201 204 301 302 400 401 403 404 500 502 503",
+        b"https:// http://localhost:8000/ 127.0.0.1 Content-Type: application/json",
+        b'{"id": "type": "name": "message": "error": "status": "data": "user": ',
+        b"2024-01-01T00:00:00.000Z 2025- 2026- 00:00:00,000 UTC",
+        b"```python ```js ```json ```bash ``` \n\n    \n        \n\t\t",
+        b"the and for you that this with have what can not but are will just",
+    ]
+)
+
+# Format byte -> preset dictionary
+DICTIONARIES = {1: _DICTIONARY_V1}
+CURRENT_FORMAT = 1
+
+
+def compress_text(text: str) -> bytes | None:
+    """
+    Returns the compressed body, or None when it is below the threshold or doesn't
+    shrink, in which case it is stored as plain text.
+    """
+    raw = text.encode()
+    if len(raw) < settings.CHAT_MESSAGE_COMPRESSION_THRESHOLD:
+        return None
+    compressor = zlib.compressobj(
+        settings.CHAT_MESSAGE_COMPRESSION_LEVEL, zdict=DICTIONARIES[CURRENT_FORMAT]
+    )
+    data = bytes([CURRENT_FORMAT]) + compressor.compress(raw) + compressor.flush()
+    return data if len(data) < len(raw) else None
+
+
+def decompress_text(data: bytes, max_length: int = 0) -> str:
+    """Decodes a compressed body; with `max_length` only that many bytes are inflated."""
+    data = bytes(data)
+    decompressor = zlib.decompressobj(zdict=DICTIONARIES[data[0]])
+    raw = decompressor.decompress(data[1:], max_length)
+    # A truncated prefix may end inside a multi-byte character
+    return raw.decode(errors="ignore" if max_length else "strict")
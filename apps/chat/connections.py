@@ -0,0 +1,85 @@
+import sys
+import time
+import weakref
+from collections import Counter
+
+# Application close code for connections that stopped answering pings
+CLOSE_CODE_IDLE_TIMEOUT = 4408
+
+# Objects shared by every connection, not worth attributing to any one of them
+_SHARED_ATTRIBUTES = {"channel_layer", "channel_receive", "base_send", "heartbeat_task"}
+
+
+def get_approximate_size(obj, seen=None, depth=0) -> int:
+    """
+    Rough deep size of plain Python data (dicts, sequences, strings, model instances).
+    Objects already counted are skipped so shared references are not counted twice.
+    """
+    seen = set() if seen is None else seen
+    if id(obj) in seen or depth > 8:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj, 0)
+    if isinstance(obj, dict):
+        size += sum(
+            get_approximate_size(key, seen, depth + 1) + get_approximate_size(value, seen, depth + 1)
+            for key, value in obj.items()
+        )
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(get_approximate_size(item, seen, depth + 1) for item in obj)
+    elif hasattr(obj, "__dict__") and not isinstance(obj, type):
+        size += get_approximate_size(vars(obj), seen, depth + 1)
+    return size
+
+
+class ConnectionRegistry:
+    """
+    Live WebSocket connections of this process, for idle reaping and introspection.
+    Consumers are held weakly so a missed unregister can't leak them.
+    """
+
+    def __init__(self):
+        self._consumers = weakref.WeakValueDictionary()
+
+    def register(self, consumer):
+        self._consumers[consumer.channel_name] = consumer
+
+    def unregister(self, consumer) -> bool:
+        return self._consumers.pop(consumer.channel_name, None) is not None
+
+    def __len__(self):
+        return len(self._consumers)
+
+    def get_connection_stats(self, consumer) -> dict:
+        state = {
+            key: value for key, value in vars(consumer).items() if key not in _SHARED_ATTRIBUTES
+        }
+        buffered = 0
+        receive_buffer = getattr(consumer.channel_layer, "receive_buffer", None)
+        if receive_buffer is not None and consumer.channel_name in receive_buffer:
+            buffered = receive_buffer[consumer.channel_name].qsize()
+        user = consumer.scope.get("user")
+        return {
+            "channel_name": consumer.channel_name,
+            "user_id": getattr(user, "pk", None),
+            "groups": sorted(consumer.joined_groups),
+            "connected_seconds": round(time.monotonic() - consumer.connected_at, 1),
+            "idle_seconds": round(time.monotonic() - consumer.last_seen_at, 1),
+            "buffered_messages": buffered,
+            "approximate_bytes": get_approximate_size(state),
+        }
+
+    def get_stats(self, *, limit: int) -> dict:
+        consumers = list(self._consumers.values())
+        connections = [self.get_connection_stats(consumer) for consumer in consumers]
+        groups = Counter(group for connection in connections for group in connection["groups"])
+        connections.sort(key=lambda connection: connection["approximate_bytes"], reverse=True)
+        return {
+            "connections": len(connections),
+            "total_approximate_bytes": sum(c["approximate_bytes"] for c in connections),
+            "groups": dict(groups.most_common(limit)),
+            "largest_connections": connections[:limit],
+        }
+
+
+connection_registry = ConnectionRegistry()
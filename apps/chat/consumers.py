@@ -1,16 +1,49 @@
+import asyncio
 import json
+import logging
+import time
 from channels.generic.websocket import AsyncWebsocketConsumer
-from apps.users.models import User  # Import your custom User model
-from apps.chat.models import Message, ChatRoom
-from apps.core.authentication import CustomAuthBackend
+from apps.chat.admission import CLOSE_CODE_RETRY_LATER, AdmissionRejected, handshake_admission
+from apps.chat.connections import CLOSE_CODE_IDLE_TIMEOUT, connection_registry
+from apps.chat.idempotency import client_message_cache
+from apps.chat.inbox import offline_inbox_aggregator
+from apps.chat.mentions import mention_matcher_cache
+from apps.chat.presence import presence
+from apps.chat.reactions import reaction_aggregator
+from apps.chat.models import ChatRoom
+from apps.chat.services import get_room_group_name, message_create, message_reaction_set
+from apps.core.authentication import CachedJWTAuthentication
+from apps.core.exceptions import ApplicationError
+from apps.core.profiling import ProfilingConsumerMixin
+from apps.core.queries import QueryInstrumentationConsumerMixin
+from apps.core.routers import start_pin_scope
 from channels.db import database_sync_to_async
-import jwt  # Assuming you're using PyJWT for decoding tokens
-from apps.users.selectors import get_user_from_id  # Import the selector function
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+
 from config import settings
 
+logger = logging.getLogger(__name__)
+
+
+class ChatConsumer(
+    QueryInstrumentationConsumerMixin, ProfilingConsumerMixin, AsyncWebsocketConsumer
+):
+    async def websocket_connect(self, message):
+        try:
+            async with handshake_admission.slot():
+                await super().websocket_connect(message)
+        except AdmissionRejected as rejection:
+            # Accept only to deliver the close code and the retry-after hint
+            await self.accept()
+            await self.close(code=CLOSE_CODE_RETRY_LATER, reason=str(rejection))
 
-class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
+        # Reads issued for this socket stick to the primary for a while after it writes
+        self.db_pin_state = start_pin_scope()
+        self.connected_at = self.last_seen_at = time.monotonic()
+        self.joined_groups = set()
+        self.heartbeat_task = None
+
         # Get the `authorization` header
         headers = dict(self.scope["headers"])
         auth_header = headers.get(b"authorization", b"").decode("utf-8")
@@ -21,21 +54,13 @@ class ChatConsumer(AsyncWebsocketConsumer):
         else:
             token = auth_header  # No prefix, assume it's just the token
 
-        print(f"Extracted Token: {token}")
-
         # Check if token exists
         if not token:
             await self.close()
             return
 
-        # Decode the JWT token to get the email
-        user_email = await self.decode_token_and_get_email(token)
-        if not user_email:
-            await self.close()
-            return
-
-        # Now, authenticate the user using the email
-        user = await self.get_user_from_email(user_email)
+        # Validate the JWT and load its user through the shared user cache
+        user = await self.get_user_from_token(token)
         if not user:
             await self.close()
             return
@@ -47,90 +72,190 @@ class ChatConsumer(AsyncWebsocketConsumer):
         self.room_name = None
         self.room_group_name = None
         await self.accept()
+        connection_registry.register(self)
+        await database_sync_to_async(presence.connected)(user.pk)
+        self.heartbeat_task = asyncio.create_task(self.heartbeat())
 
     async def disconnect(self, close_code):
-        pass
+        await self.release_connection()
+
+    async def heartbeat(self):
+        """
+        Pings the client every `WS_PING_INTERVAL` seconds and closes the socket once
+        nothing was received for `WS_IDLE_TIMEOUT` seconds. Half-open connections never
+        report a disconnect, so they are taken out of their groups right away.
+        """
+        while True:
+            await asyncio.sleep(settings.WS_PING_INTERVAL)
+            if time.monotonic() - self.last_seen_at >= settings.WS_IDLE_TIMEOUT:
+                await self.close(code=CLOSE_CODE_IDLE_TIMEOUT)
+                await self.release_connection()
+                return
+            await self.send(text_data=json.dumps({"type": "ping"}))
+            await database_sync_to_async(presence.refresh)(self.scope['user'].pk)
+
+    async def release_connection(self):
+        # Runs on idle timeout and again on disconnect, so it must be safe to repeat
+        if not hasattr(self, "joined_groups"):
+            return
+        if connection_registry.unregister(self):
+            await database_sync_to_async(presence.disconnected)(self.scope['user'].pk)
+        if self.heartbeat_task is not None and self.heartbeat_task is not asyncio.current_task():
+            self.heartbeat_task.cancel()
+        for group in self.joined_groups:
+            await self.channel_layer.group_discard(group, self.channel_name)
+        self.joined_groups.clear()
+
+    async def join_group(self, group):
+        if group not in self.joined_groups:
+            await self.channel_layer.group_add(group, self.channel_name)
+            self.joined_groups.add(group)
 
     async def receive(self, text_data):
+        self.last_seen_at = time.monotonic()
         text_data_json = json.loads(text_data)
+        if text_data_json.get("type") == "pong":
+            return
+        if text_data_json.get("type") == "ping":
+            await self.send(text_data=json.dumps({"type": "pong"}))
+            return
+        if text_data_json.get("type") == "reaction":
+            await self.receive_reaction(text_data_json)
+            return
         message = text_data_json.get("message", None)
         room_id = text_data_json.get("room_id", None)
+        client_msg_id = text_data_json.get("client_msg_id", None)
+
+        if client_msg_id is not None and (
+            not isinstance(client_msg_id, str) or not 0 < len(client_msg_id) <= 64
+        ):
+            await self.send(text_data=json.dumps({
+                "type": "error",
+                "message": "client_msg_id must be a string of 1 to 64 characters",
+            }))
+            return
 
         if room_id is not None:
-            self.room_group_name = f"chat_{room_id}"
+            if client_msg_id is not None:
+                # A retry of a message this process already saved costs just a lookup
+                cached = client_message_cache.get(self.scope['user'].pk, client_msg_id)
+                if cached is not None:
+                    await self.send_ack(client_msg_id, *cached)
+                    return
+            self.room_group_name = get_room_group_name(room_id)
             chat_room = await self.get_chat_room(room_id)
             if chat_room:
-                await self.save_message(chat_room, message)
-                await self.send_chat_message_to_room(message)
+                await self.join_group(self.room_group_name)
+                saved = await self.save_message(chat_room, message, client_msg_id)
+                if saved is None:
+                    return
+                saved_message, created = saved
+                if client_msg_id is not None:
+                    client_message_cache.put(
+                        self.scope['user'].pk, client_msg_id, saved_message.pk, saved_message.seq
+                    )
+                if created:
+                    offline_inbox_aggregator.add(chat_room.pk)
+                    await self.send_chat_message_to_room(message, saved_message)
+                await self.send_ack(client_msg_id, saved_message.pk, saved_message.seq)
         else:
             await self.send({
                 'type': 'websocket.close'
             })
 
-    async def send_chat_message_to_room(self, message):
+    async def receive_reaction(self, data):
+        message_id, emoji, active = data.get("message_id"), data.get("emoji"), data.get("active")
+        if (
+            not isinstance(message_id, int)
+            or not isinstance(emoji, str)
+            or not 0 < len(emoji) <= 32
+            or not isinstance(active, bool)
+        ):
+            await self.send(text_data=json.dumps({
+                "type": "error",
+                "message": "A reaction needs an integer message_id, an emoji and a boolean active",
+            }))
+            return
+        try:
+            room_id = await database_sync_to_async(message_reaction_set)(
+                user=self.scope['user'], message_id=message_id, emoji=emoji, active=active
+            )
+        except ApplicationError as error:
+            await self.send(text_data=json.dumps({"type": "error", "message": str(error.detail)}))
+            return
+        if room_id is None:
+            return
+        delta = 1 if active else -1
+        reaction_aggregator.add(message_id, emoji, delta)
+        await self.channel_layer.group_send(
+            get_room_group_name(room_id),
+            {
+                "type": "chat_reaction",
+                "message_id": message_id,
+                "emoji": emoji,
+                "delta": delta,
+                "user_id": self.scope['user'].pk,
+            },
+        )
+
+    async def send_ack(self, client_msg_id, message_id, seq):
+        await self.send(text_data=json.dumps({
+            "type": "ack",
+            "client_msg_id": client_msg_id,
+            "message_id": message_id,
+            "seq": seq,
+        }))
+
+    async def send_chat_message_to_room(self, message, saved_message):
         if self.room_group_name:
             await self.channel_layer.group_send(
                 self.room_group_name,
                 {
                     "type": "chat_message",
                     "message": message,
+                    "message_id": saved_message.pk,
+                    "seq": saved_message.seq,
                 }
             )
 
     async def chat_message(self, event):
         message = event["message"]
         await self.send(text_data=json.dumps({
-            "message": message
+            "message": message,
+            "message_id": event["message_id"],
+            "seq": event["seq"],
+            # Set on messages posted by a completed upload, see AttachmentUploadApi
+            "attachment": event.get("attachment"),
         }))
 
-    async def decode_token_and_get_email(self, token):
-        """
-        Decodes the JWT token and retrieves the email from it.
-        This method assumes you are using JWT with a payload that includes the email.
-        """
-        try:
-            # Decode the token using your secret key (configured in settings)
-            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=['HS256'])
-            # Now wrap the get_user_from_id in database_sync_to_async
-            user = await self.get_user_from_id(payload.get("user_id"))
-
-            if not user:
-                return None
-
-            user_email = user.email
-            print(f"user email : {user_email}")
-            return user_email
-        except jwt.ExpiredSignatureError:
-            print("Token expired.")
-            return None
-        except jwt.InvalidTokenError:
-            print("Invalid token.")
-            return None
+    async def chat_announcement(self, event):
+        await self.send(text_data=json.dumps({
+            "type": "announcement",
+            "message": event["message"],
+            "message_id": event["message_id"],
+            "seq": event["seq"],
+        }))
 
-    @database_sync_to_async
-    def get_user_from_id(self, user_id):
-        """
-        This function is now wrapped with `database_sync_to_async`
-        to allow it to run in an async context.
-        """
-        try:
-            user = User.objects.get(id=user_id)
-            return user
-        except User.DoesNotExist:
-            return None
+    async def chat_reaction(self, event):
+        # Only the change is sent; clients add it to the counts they got with history
+        await self.send(text_data=json.dumps({
+            "type": "reaction",
+            "message_id": event["message_id"],
+            "emoji": event["emoji"],
+            "delta": event["delta"],
+            "user_id": event["user_id"],
+        }))
 
-    async def get_user_from_email(self, email):
+    @database_sync_to_async
+    def get_user_from_token(self, token):
         """
-        Authenticates the user based on the extracted email.
-        This function calls the custom authentication backend to authenticate the user.
+        Validates the access token the same way the HTTP API does and returns its user,
+        or None if the token or the user is not valid.
         """
+        authentication = CachedJWTAuthentication()
         try:
-            # Use your custom authentication backend to get the user
-            custom_auth_backend = CustomAuthBackend()
-            user = custom_auth_backend.authenticate(email=email)
-            return user
-        except Exception as e:
-            print(f"Error in user authentication: {e}")
+            return authentication.get_user(authentication.get_validated_token(token))
+        except (InvalidToken, AuthenticationFailed):
             return None
 
     async def get_chat_room(self, room_id):
@@ -140,15 +265,29 @@ class ChatConsumer(AsyncWebsocketConsumer):
         except ChatRoom.DoesNotExist:
             return None
 
-    async def save_message(self, chat_room, message_text):
+    async def get_mentioned_user_ids(self, chat_room, message_text):
+        # Most messages mention nobody and skip the matcher entirely
+        if not isinstance(message_text, str) or "@" not in message_text:
+            return set()
+        matcher = await database_sync_to_async(mention_matcher_cache.get_matcher)(chat_room.pk)
+        return matcher.find(message_text)
+
+    async def save_message(self, chat_room, message_text, client_msg_id=None):
         try:
-            # Save message in the database
-            message = await database_sync_to_async(Message.objects.create)(
-                chat_room=chat_room,
-                user=self.scope['user'],
-                text=message_text,
+            mentioned_user_ids = await self.get_mentioned_user_ids(chat_room, message_text)
+            # Save message in the database, or find the one this client_msg_id created
+            return await database_sync_to_async(message_create)(
+                chatroom=chat_room,
+                sender=self.scope['user'],
+                content=message_text,
+                client_msg_id=client_msg_id,
+                mentioned_user_ids=mentioned_user_ids,
             )
-            return message
-        except Exception as e:
-            print(f"Error saving message: {e}")
+        except Exception:
+            logger.exception("Could not save a message to room %s", chat_room.pk)
+            await self.send(text_data=json.dumps({
+                "type": "error",
+                "message": "The message could not be saved",
+                "client_msg_id": client_msg_id,
+            }))
             return None
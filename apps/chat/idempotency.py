@@ -0,0 +1,46 @@
+from collections import OrderedDict
+
+from config import settings
+
+
+class ClientMessageCache:
+    """
+    Remembers the server id and seq of recently saved messages by (sender,
+    client_msg_id), so a retried send is acknowledged without touching the database or
+    re-broadcasting.
+
+    Bounded per sender and in the number of senders, both evicting least recently used.
+    Retries that miss this process's cache are still caught by the unique constraint
+    on Message(sender, client_msg_id).
+    """
+
+    def __init__(self, *, max_senders: int, max_per_sender: int):
+        self.max_senders = max_senders
+        self.max_per_sender = max_per_sender
+        self._senders = OrderedDict()
+
+    def get(self, sender_id: int, client_msg_id: str) -> tuple[int, int] | None:
+        messages = self._senders.get(sender_id)
+        if messages is None or client_msg_id not in messages:
+            return None
+        self._senders.move_to_end(sender_id)
+        messages.move_to_end(client_msg_id)
+        return messages[client_msg_id]
+
+    def put(self, sender_id: int, client_msg_id: str, message_id: int, seq: int):
+        messages = self._senders.get(sender_id)
+        if messages is None:
+            messages = self._senders[sender_id] = OrderedDict()
+            if len(self._senders) > self.max_senders:
+                self._senders.popitem(last=False)
+        self._senders.move_to_end(sender_id)
+        messages[client_msg_id] = (message_id, seq)
+        messages.move_to_end(client_msg_id)
+        if len(messages) > self.max_per_sender:
+            messages.popitem(last=False)
+
+
+client_message_cache = ClientMessageCache(
+    max_senders=settings.CHAT_CLIENT_MSG_ID_CACHE_SENDERS,
+    max_per_sender=settings.CHAT_CLIENT_MSG_ID_CACHE_SIZE,
+)
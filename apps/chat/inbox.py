@@ -0,0 +1,45 @@
+from django.utils import timezone
+
+from apps.chat.services import offline_inbox_record
+from apps.common.buffers import WriteBehindBuffer
+from config import settings
+
+
+class OfflineInboxAggregator(WriteBehindBuffer):
+    """
+    Write-behind buffer for OfflineNotification rows.
+
+    Saved messages are only counted per room here; every `interval` seconds the counts
+    are handed to `offline_inbox_record`, which looks up the rooms' offline members once
+    per flush. Work is proportional to the rooms that got messages, whatever their
+    message rate. `pending` maps room ids to [message count, first message at, last
+    message at].
+    """
+
+    def add(self, room_id: int):
+        now = timezone.now()
+        room = self.pending.get(room_id)
+        if room is None:
+            self.pending[room_id] = [1, now, now]
+        else:
+            room[0] += 1
+            room[2] = now
+        self.schedule()
+
+    def merge(self, pending):
+        for room_id, (count, first_at, last_at) in pending.items():
+            room = self.pending.get(room_id)
+            if room is None:
+                self.pending[room_id] = [count, first_at, last_at]
+            else:
+                room[0] += count
+                room[1] = min(room[1], first_at)
+                room[2] = max(room[2], last_at)
+
+    def write(self, pending):
+        offline_inbox_record(rooms=pending)
+
+
+offline_inbox_aggregator = OfflineInboxAggregator(
+    interval=settings.CHAT_OFFLINE_INBOX_FLUSH_SECONDS
+)
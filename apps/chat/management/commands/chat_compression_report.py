@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from apps.chat.compression import decompress_text
+from apps.chat.models import Message
+
+
+class Command(BaseCommand):
+    help = (
+        "Reports how much space compressed message bodies save. Reads every message, "
+        "so run it against a replica or off-peak."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        messages = compressed = 0
+        raw_bytes = stored_bytes = compressed_raw_bytes = compressed_stored_bytes = 0
+        rows = Message.objects.order_by().values_list("content_text", "content_compressed")
+        for content_text, content_compressed in rows.iterator(chunk_size=options["chunk_size"]):
+            messages += 1
+            if content_compressed is None:
+                size = len(content_text.encode())
+                raw_bytes += size
+                stored_bytes += size
+                continue
+            compressed += 1
+            size = len(decompress_text(content_compressed).encode())
+            raw_bytes += size
+            stored_bytes += len(content_compressed)
+            compressed_raw_bytes += size
+            compressed_stored_bytes += len(content_compressed)
+
+        saved = raw_bytes - stored_bytes
+        self.stdout.write(f"Messages: {messages} ({compressed} compressed)")
+        self.stdout.write(f"Body bytes: {raw_bytes} raw, {stored_bytes} stored")
+        if raw_bytes:
+            self.stdout.write(f"Saved: {saved} bytes ({saved / raw_bytes:.1%})")
+        if compressed:
+            self.stdout.write(
+                f"Compressed bodies: {compressed_raw_bytes / compressed:.0f} bytes on average, "
+                f"ratio {compressed_raw_bytes / compressed_stored_bytes:.2f}x"
+            )
@@ -0,0 +1,29 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from apps.chat.services import attachment_purge_stale
+from config import settings
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes attachment uploads that were started but not finished within "
+        "ATTACHMENT_UPLOAD_EXPIRY_HOURS, with their partial files. Safe to run from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--hours", type=float, default=settings.ATTACHMENT_UPLOAD_EXPIRY_HOURS
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        purged = attachment_purge_stale(
+            older_than=timedelta(hours=options["hours"]), batch_size=options["batch_size"]
+        )
+        self.stdout.write(
+            f"Purged {purged} unfinished uploads in {time.perf_counter() - started:.2f}s"
+        )
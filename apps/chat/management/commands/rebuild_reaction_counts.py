@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from apps.chat.models import Reaction
+from apps.chat.services import message_reaction_counts_rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        "Recounts Message.reaction_counts from the reaction rows, for messages that got "
+        "reactions since --since-id (all by default)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--since-id", type=int, default=0, help="Lowest reaction id to look at"
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        message_ids = sorted(
+            Reaction.objects.filter(pk__gte=options["since_id"])
+            .values_list("message_id", flat=True)
+            .distinct()
+        )
+        rebuilt = 0
+        for start in range(0, len(message_ids), options["batch_size"]):
+            rebuilt += message_reaction_counts_rebuild(
+                message_ids=message_ids[start : start + options["batch_size"]]
+            )
+        self.stdout.write(f"Rebuilt reaction counts of {rebuilt} messages")
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.chat.services import announcement_send
+from apps.users.models import User
+
+
+class Command(BaseCommand):
+    help = "Posts a system announcement to the given chat rooms, or to every room."
+
+    def add_arguments(self, parser):
+        parser.add_argument("content", help="Announcement text")
+        parser.add_argument("--sender-email", required=True, help="Staff user posting it")
+        parser.add_argument("--room", type=int, action="append", dest="room_ids", help="Repeatable")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--concurrency", type=int, help="Group sends in flight")
+
+    def handle(self, *args, **options):
+        sender = User.objects.filter(email=options["sender_email"], is_staff=True).first()
+        if sender is None:
+            raise CommandError(f"No staff user with email {options['sender_email']}")
+        result = announcement_send(
+            sender=sender,
+            content=options["content"],
+            room_ids=options["room_ids"],
+            batch_size=options["batch_size"],
+            concurrency=options["concurrency"],
+            on_progress=self.report_progress,
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Announced to {result.created} of {result.rooms} rooms in "
+                f"{result.elapsed:.1f}s ({result.rate:.0f} rooms/s), "
+                f"{result.failed} group sends failed"
+            )
+        )
+
+    def report_progress(self, result):
+        self.stdout.write(
+            f"{result.created}/{result.rooms} messages created, "
+            f"{result.delivered} delivered, {result.rate:.0f} rooms/s"
+        )
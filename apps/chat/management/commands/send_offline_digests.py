@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.chat.services import offline_digest_send_batch
+from config import settings
+
+
+class Command(BaseCommand):
+    help = (
+        "Queues digest emails for users with unread messages from while they were offline, "
+        "once or continuously with --loop. The emails are sent by send_outbox_emails."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=settings.CHAT_DIGEST_BATCH_SIZE)
+        parser.add_argument("--loop", action="store_true", help="Keep polling for due digests")
+        parser.add_argument("--interval", type=float, default=30.0, help="Seconds between polls")
+
+    def handle(self, *args, **options):
+        while True:
+            queued, processed = offline_digest_send_batch(batch_size=options["batch_size"])
+            if processed:
+                self.stdout.write(f"Queued {queued} digests for {processed} users")
+            # Drain back-to-back while there is a backlog, poll otherwise
+            if processed >= options["batch_size"]:
+                continue
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,114 @@
+import time
+from collections import OrderedDict, deque
+
+from django.core.cache import cache
+
+from config import settings
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+class MentionMatcher:
+    """
+    Aho-Corasick automaton over "@username" patterns, finding every mentioned user in a
+    single pass over the text regardless of how many members the room has.
+    """
+
+    def __init__(self, usernames: dict[str, int]):
+        # Parallel per-state tables: transitions, failure link, (length, user id) outputs
+        self._goto = [{}]
+        self._fail = [0]
+        self._outputs = [[]]
+        for username, user_id in usernames.items():
+            self._add(f"@{username.lower()}", user_id)
+        self._link()
+
+    def _add(self, pattern: str, user_id: int):
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._outputs.append([])
+            state = next_state
+        self._outputs[state].append((len(pattern), user_id))
+
+    def _link(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(char, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                self._outputs[next_state] += self._outputs[self._fail[next_state]]
+
+    def find(self, text: str) -> set[int]:
+        text = text.lower()
+        # Longest whole-word match per "@" position, so @anna doesn't also mention @ann
+        longest = {}
+        state = 0
+        for end, char in enumerate(text, start=1):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for length, user_id in self._outputs[state]:
+                start = end - length
+                if start > 0 and _is_word_char(text[start - 1]):
+                    continue
+                if end < len(text) and _is_word_char(text[end]):
+                    continue
+                if length > longest.get(start, (0, None))[0]:
+                    longest[start] = (length, user_id)
+        return {user_id for _, user_id in longest.values()}
+
+
+def get_room_members_version_key(room_id: int) -> str:
+    return f"chat:room:{room_id}:members_version"
+
+
+def room_members_changed(room_id: int):
+    # Lives in the shared cache so every process drops its matcher for the room
+    key = get_room_members_version_key(room_id)
+    if not cache.add(key, 1, timeout=None):
+        cache.incr(key)
+
+
+class MentionMatcherCache:
+    """
+    Per-process LRU of room matchers. An entry is rebuilt when the room's membership
+    version moves, and after `max_age` seconds to pick up renamed users.
+    """
+
+    max_age = 600
+
+    def __init__(self, *, max_rooms: int):
+        self.max_rooms = max_rooms
+        self._rooms = OrderedDict()
+
+    def get_matcher(self, room_id: int) -> MentionMatcher:
+        from apps.chat.models import ChatRoom
+
+        version = cache.get(get_room_members_version_key(room_id), 0)
+        entry = self._rooms.get(room_id)
+        if entry is not None and entry[0] == version and time.monotonic() < entry[1]:
+            self._rooms.move_to_end(room_id)
+            return entry[2]
+        members = ChatRoom.users.through.objects.filter(chatroom_id=room_id)
+        matcher = MentionMatcher(dict(members.values_list("user__username", "user_id")))
+        self._rooms[room_id] = (version, time.monotonic() + self.max_age, matcher)
+        self._rooms.move_to_end(room_id)
+        if len(self._rooms) > self.max_rooms:
+            self._rooms.popitem(last=False)
+        return matcher
+
+
+mention_matcher_cache = MentionMatcherCache(max_rooms=settings.CHAT_MENTION_MATCHER_CACHE_SIZE)
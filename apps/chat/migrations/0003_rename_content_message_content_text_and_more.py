@@ -0,0 +1,28 @@
+# Generated by Django 5.1.4 on 2026-10-19 01:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_alter_message_timestamp'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='message',
+            old_name='content',
+            new_name='content_text',
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='content_text',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='content_compressed',
+            field=models.BinaryField(null=True),
+        ),
+    ]
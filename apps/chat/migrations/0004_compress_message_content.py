@@ -0,0 +1,64 @@
+from django.db import migrations, transaction
+from django.db.models.functions import Length
+
+from apps.chat.compression import compress_text, decompress_text
+from config import settings
+
+BATCH_SIZE = 500
+
+
+def compress_existing_messages(apps, schema_editor):
+    Message = apps.get_model('chat', 'Message')
+    # Character length is a lower bound of the UTF-8 size, so no candidate is missed
+    candidates = (
+        Message.objects.annotate(text_length=Length('content_text'))
+        .filter(text_length__gte=settings.CHAT_MESSAGE_COMPRESSION_THRESHOLD // 4)
+        .order_by('pk')
+        .only('pk', 'content_text')
+    )
+    last_pk = 0
+    while True:
+        batch = list(candidates.filter(pk__gt=last_pk)[:BATCH_SIZE])
+        if not batch:
+            break
+        last_pk = batch[-1].pk
+        changed = []
+        for message in batch:
+            message.content_compressed = compress_text(message.content_text)
+            if message.content_compressed is not None:
+                message.content_text = ''
+                changed.append(message)
+        # Committed batch by batch, so locks are held briefly and an interrupted run
+        # keeps its progress (compressed rows are skipped by the next run)
+        with transaction.atomic():
+            Message.objects.bulk_update(changed, ['content_text', 'content_compressed'])
+
+
+def decompress_messages(apps, schema_editor):
+    Message = apps.get_model('chat', 'Message')
+    compressed = (
+        Message.objects.filter(content_compressed__isnull=False)
+        .order_by('pk')
+        .only('pk', 'content_compressed')
+    )
+    while True:
+        batch = list(compressed[:BATCH_SIZE])
+        if not batch:
+            break
+        for message in batch:
+            message.content_text = decompress_text(message.content_compressed)
+            message.content_compressed = None
+        with transaction.atomic():
+            Message.objects.bulk_update(batch, ['content_text', 'content_compressed'])
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('chat', '0003_rename_content_message_content_text_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(compress_existing_messages, decompress_messages),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.4 on 2026-10-19 01:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_message_client_msg_id_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='seq_allocated',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='seq',
+            field=models.PositiveBigIntegerField(editable=False, null=True),
+        ),
+    ]
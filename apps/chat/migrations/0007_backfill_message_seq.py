@@ -0,0 +1,42 @@
+from django.db import migrations
+from django.db.models import Count, F, OuterRef, Subquery, Window
+from django.db.models.functions import Coalesce, RowNumber
+
+BATCH_SIZE = 1000
+
+
+def backfill_message_seq(apps, schema_editor):
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    Message = apps.get_model('chat', 'Message')
+    # Existing messages are numbered per room in id order
+    messages = Message.objects.annotate(
+        row_number=Window(RowNumber(), partition_by=F('chatroom_id'), order_by=F('id').asc())
+    ).only('pk')
+    batch = []
+    for message in messages.iterator(chunk_size=BATCH_SIZE):
+        message.seq = message.row_number
+        batch.append(message)
+        if len(batch) >= BATCH_SIZE:
+            Message.objects.bulk_update(batch, ['seq'])
+            batch = []
+    Message.objects.bulk_update(batch, ['seq'])
+
+    message_counts = (
+        Message.objects.filter(chatroom_id=OuterRef('pk'))
+        .order_by()
+        .values('chatroom_id')
+        .annotate(count=Count('pk'))
+        .values('count')
+    )
+    ChatRoom.objects.update(seq_allocated=Coalesce(Subquery(message_counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_chatroom_seq_allocated_message_seq'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_message_seq, migrations.RunPython.noop),
+    ]
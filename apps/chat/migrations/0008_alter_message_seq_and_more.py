@@ -0,0 +1,22 @@
+# Generated by Django 5.1.4 on 2026-10-19 01:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_backfill_message_seq'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='seq',
+            field=models.PositiveBigIntegerField(editable=False),
+        ),
+        migrations.AddConstraint(
+            model_name='message',
+            constraint=models.UniqueConstraint(fields=('chatroom', 'seq'), name='unique_message_chatroom_seq'),
+        ),
+    ]
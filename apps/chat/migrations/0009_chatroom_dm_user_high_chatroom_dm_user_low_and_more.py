@@ -0,0 +1,34 @@
+# Generated by Django 5.1.4 on 2026-10-19 01:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_alter_message_seq_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='dm_user_high',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='dm_user_low',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='chatroom',
+            constraint=models.UniqueConstraint(fields=('dm_user_low', 'dm_user_high'), name='unique_chatroom_dm_pair'),
+        ),
+        migrations.AddConstraint(
+            model_name='chatroom',
+            constraint=models.CheckConstraint(condition=models.Q(('dm_user_low__lt', models.F('dm_user_high')), models.Q(('dm_user_high__isnull', True), ('dm_user_low__isnull', True)), _connector='OR'), name='chatroom_dm_pair_ordered'),
+        ),
+    ]
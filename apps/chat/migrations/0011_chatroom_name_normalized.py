@@ -0,0 +1,36 @@
+# Generated by Django 5.1.4 on 2026-10-19 02:05
+
+from django.db import migrations, models
+
+from apps.common.autocomplete import normalize_text
+
+BATCH_SIZE = 1000
+
+
+def fill_name_normalized(apps, schema_editor):
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    batch = []
+    for room in ChatRoom.objects.only('pk', 'name').iterator(chunk_size=BATCH_SIZE):
+        room.name_normalized = normalize_text(room.name)
+        batch.append(room)
+        if len(batch) >= BATCH_SIZE:
+            ChatRoom.objects.bulk_update(batch, ['name_normalized'])
+            batch = []
+    ChatRoom.objects.bulk_update(batch, ['name_normalized'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_mention'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='name_normalized',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_name_normalized, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.4 on 2026-10-19 01:57
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0012_message_reaction_counts_reaction'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OfflineNotification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('first_message_at', models.DateTimeField(db_index=True)),
+                ('last_message_at', models.DateTimeField()),
+                ('chatroom', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='chat.chatroom')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'chatroom'), name='unique_offlinenotification_user_chatroom')],
+            },
+        ),
+    ]
@@ -1,12 +1,179 @@
-from django.db import models
+from django.db import models, transaction
+from apps.common.autocomplete import normalize_text
+from apps.chat.compression import compress_text, decompress_text
+from apps.chat.sequences import room_seq_allocate
 from apps.users.models import User
 
 class ChatRoom(models.Model):
     name = models.CharField(max_length=255)
+    # Lowercased, accent-free name for indexed prefix search, kept in sync on save
+    name_normalized = models.CharField(max_length=255, db_index=True, editable=False)
     users = models.ManyToManyField(User, related_name='chatrooms')
+    # Highest message sequence number handed out so far, see room_seq_allocate
+    seq_allocated = models.PositiveBigIntegerField(default=0, editable=False)
+    # Set only on direct-message rooms: the two members, lower user id first
+    dm_user_low = models.ForeignKey(
+        User, null=True, blank=True, related_name='+', on_delete=models.CASCADE
+    )
+    dm_user_high = models.ForeignKey(
+        User, null=True, blank=True, related_name='+', on_delete=models.CASCADE
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["dm_user_low", "dm_user_high"], name="unique_chatroom_dm_pair"
+            ),
+            models.CheckConstraint(
+                condition=models.Q(dm_user_low__lt=models.F("dm_user_high"))
+                | models.Q(dm_user_low__isnull=True, dm_user_high__isnull=True),
+                name="chatroom_dm_pair_ordered",
+            ),
+        ]
+
+    @property
+    def is_direct(self) -> bool:
+        return self.dm_user_low_id is not None
+
+    def save(self, *args, **kwargs):
+        self.name_normalized = normalize_text(self.name)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "name" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "name_normalized"}
+        super().save(*args, **kwargs)
 
 class Message(models.Model):
     chatroom = models.ForeignKey(ChatRoom, related_name='messages', on_delete=models.CASCADE)
     sender = models.ForeignKey(User, on_delete=models.CASCADE)
-    content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    # Per-room sequence number, assigned on first save
+    seq = models.PositiveBigIntegerField(editable=False)
+    # Bodies above CHAT_MESSAGE_COMPRESSION_THRESHOLD bytes are kept in content_compressed
+    # and content_text is left empty. Read and write them through `content`.
+    content_text = models.TextField(blank=True)
+    content_compressed = models.BinaryField(null=True)
+    # Client-generated id that makes retried sends idempotent
+    client_msg_id = models.CharField(max_length=64, null=True, blank=True)
+    # Emoji -> number of reactions, maintained in batches by ReactionCounterAggregator
+    reaction_counts = models.JSONField(default=dict, blank=True)
+    timestamp = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["sender", "client_msg_id"], name="unique_message_sender_client_msg_id"
+            ),
+            models.UniqueConstraint(fields=["chatroom", "seq"], name="unique_message_chatroom_seq"),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.seq is not None:
+            return super().save(*args, **kwargs)
+        # The number is taken in the inserting transaction, see room_seq_allocate
+        with transaction.atomic(savepoint=False):
+            self.seq = room_seq_allocate(self.chatroom_id)
+            try:
+                super().save(*args, **kwargs)
+            except Exception:
+                self.seq = None
+                raise
+
+    @property
+    def content(self) -> str:
+        # Decompressed on first access only, so listings that don't render bodies skip it
+        if self.content_compressed is None:
+            return self.content_text
+        if getattr(self, "_content", None) is None:
+            self._content = decompress_text(self.content_compressed)
+        return self._content
+
+    @content.setter
+    def content(self, value: str):
+        self.content_compressed = compress_text(value)
+        self.content_text = "" if self.content_compressed is not None else value
+        self._content = None
+
+    def get_content_preview(self, length: int = 80) -> str:
+        if self.content_compressed is None:
+            return self.content_text[:length]
+        # Inflate just enough bytes for `length` characters of UTF-8
+        return decompress_text(self.content_compressed, max_length=length * 4)[:length]
+
+
+class Mention(models.Model):
+    """A user mentioned in a message, written alongside the message."""
+
+    user = models.ForeignKey(User, related_name='mentions', on_delete=models.CASCADE)
+    message = models.ForeignKey(Message, related_name='mentions', on_delete=models.CASCADE)
+    chatroom = models.ForeignKey(ChatRoom, related_name='+', on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            # Also the index behind the keyset-paginated "my mentions" listing
+            models.UniqueConstraint(fields=["user", "message"], name="unique_mention_user_message"),
+        ]
+
+
+class Reaction(models.Model):
+    """One user's reaction to a message; the counts shown are in Message.reaction_counts."""
+
+    message = models.ForeignKey(Message, related_name='reactions', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    emoji = models.CharField(max_length=32)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["message", "user", "emoji"], name="unique_reaction_message_user_emoji"
+            ),
+        ]
+
+
+class OfflineNotification(models.Model):
+    """
+    "`count` new messages in `chatroom` since `first_message_at`" for a user who was
+    offline. Rows only exist until the user's next digest, so the table stays as small
+    as the set of users with something pending.
+    """
+
+    user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    chatroom = models.ForeignKey(ChatRoom, related_name='+', on_delete=models.CASCADE)
+    count = models.PositiveIntegerField(default=0)
+    first_message_at = models.DateTimeField(db_index=True)
+    last_message_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "chatroom"], name="unique_offlinenotification_user_chatroom"
+            ),
+        ]
+
+
+class Attachment(models.Model):
+    """
+    A file uploaded to a room in chunks. `received` is the resume offset; once it reaches
+    `size` the upload is complete and posted to the room as `message`.
+    """
+
+    uploader = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    chatroom = models.ForeignKey(ChatRoom, related_name='attachments', on_delete=models.CASCADE)
+    message = models.OneToOneField(
+        Message, null=True, blank=True, related_name='attachment', on_delete=models.CASCADE
+    )
+    file_name = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    received = models.PositiveBigIntegerField(default=0)
+    # Expected hex digest if the client sent one, the computed one once complete
+    sha256 = models.CharField(max_length=64, blank=True)
+    # Relative to ATTACHMENT_ROOT, which is not served publicly
+    path = models.CharField(max_length=255, unique=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.file_name
+
+    @property
+    def is_complete(self) -> bool:
+        return self.completed_at is not None
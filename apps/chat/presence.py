@@ -0,0 +1,61 @@
+from collections import Counter
+
+from django.core.cache import cache
+
+from config import settings
+
+
+def get_presence_key(user_id: int) -> str:
+    return f"chat:presence:{user_id}"
+
+
+class Presence:
+    """
+    Tracks which users have an open chat socket, in the shared cache so every process
+    sees it. The key holds the user's open connections across all processes and is
+    kept alive by each connection's heartbeat; it expires on its own if the processes
+    holding them die. A process that dies with connections open leaves the count too
+    high, and heartbeats can't correct it (no process knows the others' connections),
+    so the user stays online until the key expires, up to `timeout` after their last
+    connection closed.
+    """
+
+    def __init__(self, *, timeout: float):
+        self.timeout = timeout
+        # user id -> open connections in this process
+        self._connections = Counter()
+
+    def refresh(self, user_id: int):
+        key = get_presence_key(user_id)
+        if not cache.touch(key, self.timeout):
+            cache.add(key, self._connections[user_id] or 1, self.timeout)
+
+    def connected(self, user_id: int):
+        self._connections[user_id] += 1
+        key = get_presence_key(user_id)
+        if not cache.add(key, 1, self.timeout):
+            try:
+                cache.incr(key)
+            except ValueError:
+                # Expired in between
+                cache.add(key, 1, self.timeout)
+        cache.touch(key, self.timeout)
+
+    def disconnected(self, user_id: int):
+        self._connections[user_id] -= 1
+        if self._connections[user_id] <= 0:
+            del self._connections[user_id]
+        key = get_presence_key(user_id)
+        try:
+            if cache.decr(key) <= 0:
+                cache.delete(key)
+        except ValueError:
+            pass
+
+    @staticmethod
+    def get_online_user_ids(user_ids) -> set[int]:
+        keys = {get_presence_key(user_id): user_id for user_id in user_ids}
+        return {keys[key] for key in cache.get_many(keys)}
+
+
+presence = Presence(timeout=settings.WS_PING_INTERVAL * 3)
@@ -0,0 +1,43 @@
+from collections import Counter, defaultdict
+
+from apps.chat.services import message_reaction_counts_apply
+from apps.common.buffers import WriteBehindBuffer
+from config import settings
+
+
+class ReactionCounterAggregator(WriteBehindBuffer):
+    """
+    Write-behind buffer for Message.reaction_counts.
+
+    Reaction rows are written right away; the counter maps they feed are updated by a
+    flush every `interval` seconds that applies all buffered deltas in one transaction,
+    so a burst of reactions on a popular message costs one UPDATE instead of hundreds.
+    Deltas lost with a crashed process are recounted from the reaction rows by
+    `manage.py rebuild_reaction_counts`.
+    """
+
+    def empty(self):
+        return defaultdict(Counter)
+
+    def add(self, message_id: int, emoji: str, delta: int):
+        self.pending[message_id][emoji] += delta
+        self.schedule()
+
+    def merge(self, pending):
+        for message_id, counter in pending.items():
+            self.pending[message_id].update(counter)
+
+    def write(self, pending):
+        # An add and a remove within one interval cancel out
+        deltas = {}
+        for message_id, counter in pending.items():
+            changed = {emoji: delta for emoji, delta in counter.items() if delta}
+            if changed:
+                deltas[message_id] = changed
+        if deltas:
+            message_reaction_counts_apply(deltas=deltas)
+
+
+reaction_aggregator = ReactionCounterAggregator(
+    interval=settings.CHAT_REACTION_FLUSH_MILLISECONDS / 1000
+)
@@ -0,0 +1,44 @@
+from django.db.models import QuerySet
+
+from apps.chat.models import Attachment, ChatRoom, Mention
+from apps.common.autocomplete import normalize_text
+from apps.users.models import User
+
+
+def get_user_mentions(*, user: User, before: int | None = None, limit: int) -> QuerySet[Mention]:
+    """
+    Newest mentions of `user` first. `before` is the message id of the last mention on
+    the previous page, so every page is a range read of the (user, message) index.
+    """
+    mentions = Mention.objects.filter(user=user)
+    if before is not None:
+        mentions = mentions.filter(message_id__lt=before)
+    return mentions.select_related("message__sender").order_by("-message_id")[:limit]
+
+
+def search_rooms(*, user: User, prefix: str, limit: int) -> list[tuple[int, str]]:
+    """
+    (id, name) of the group rooms `user` belongs to whose name starts with `prefix`.
+    A user is in few rooms, so this reads their memberships joined to the rooms rather
+    than searching every room name.
+    """
+    rooms = ChatRoom.objects.filter(
+        users=user, dm_user_low__isnull=True, name_normalized__startswith=normalize_text(prefix)
+    ).order_by("name_normalized", "pk")
+    return list(rooms.values_list("pk", "name")[:limit])
+
+
+def get_upload_attachment(*, user: User, attachment_id: int) -> Attachment | None:
+    """An attachment `user` is uploading, or None."""
+    attachments = Attachment.objects.filter(pk=attachment_id, uploader=user)
+    attachment = attachments.select_related("chatroom").first()
+    if attachment is not None:
+        attachment.uploader = user
+    return attachment
+
+
+def get_downloadable_attachment(*, user: User, attachment_id: int) -> Attachment | None:
+    """A completed attachment in one of `user`'s rooms, or None."""
+    return Attachment.objects.filter(
+        pk=attachment_id, completed_at__isnull=False, chatroom__users=user
+    ).first()
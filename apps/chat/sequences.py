@@ -0,0 +1,71 @@
+from django.db import connections, router, transaction
+
+
+def _get_write_connection():
+    from apps.chat.models import ChatRoom
+
+    connection = connections[router.db_for_write(ChatRoom)]
+    if not connection.in_atomic_block:
+        raise transaction.TransactionManagementError(
+            "Sequence numbers must be allocated inside the inserting transaction"
+        )
+    return connection
+
+
+def _increment_sql(connection, where: str) -> str:
+    from apps.chat.models import ChatRoom
+
+    quote = connection.ops.quote_name
+    table = quote(ChatRoom._meta.db_table)
+    pk = quote(ChatRoom._meta.pk.column)
+    seq = quote(ChatRoom._meta.get_field("seq_allocated").column)
+    return f"UPDATE {table} SET {seq} = {seq} + 1 WHERE {pk} {where} RETURNING {pk}, {seq}"
+
+
+def room_seq_allocate(room_id: int) -> int:
+    """
+    Takes the next message sequence number of a room from `ChatRoom.seq_allocated`, with
+    a single UPDATE ... RETURNING.
+
+    Must run in the transaction that inserts the message: the UPDATE locks the room row
+    until that transaction ends, so numbers of one room are handed out in commit order
+    and a rolled back insert gives its number back. Clients resuming with `after_seq`
+    and looking for gaps rely on both. Take the number right before the insert, the lock
+    is held from here to the commit.
+    """
+    from apps.chat.models import ChatRoom
+
+    connection = _get_write_connection()
+    with connection.cursor() as cursor:
+        cursor.execute(_increment_sql(connection, "= %s"), [room_id])
+        row = cursor.fetchone()
+    if row is None:
+        raise ChatRoom.DoesNotExist(f"Chat room {room_id} does not exist")
+    return row[1]
+
+
+def room_seq_allocate_one_each(room_ids: list[int]) -> dict[int, int]:
+    """
+    One number for each room. Used for bulk inserts that touch many rooms once; the same
+    in-transaction rule as room_seq_allocate applies.
+
+    The rows are locked in primary key order before the UPDATE, whose own lock order is
+    up to the database, so two of these calls over overlapping rooms can't deadlock.
+    """
+    from apps.chat.models import ChatRoom
+
+    connection = _get_write_connection()
+    room_ids = sorted(set(room_ids))
+    if not room_ids:
+        return {}
+    list(
+        ChatRoom.objects.using(connection.alias)
+        .select_for_update()
+        .filter(pk__in=room_ids)
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+    placeholders = ", ".join(["%s"] * len(room_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(_increment_sql(connection, f"IN ({placeholders})"), room_ids)
+        return dict(cursor.fetchall())
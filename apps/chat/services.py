@@ -0,0 +1,519 @@
+import asyncio
+import hashlib
+import logging
+import uuid
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Callable, Iterable
+
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Min
+from django.utils import timezone
+
+from apps.chat.attachments import (
+    BLOCK_SIZE,
+    attachment_hasher_cache,
+    get_attachment_path,
+    hash_file_prefix,
+)
+from apps.chat.models import Attachment, ChatRoom, Mention, Message, OfflineNotification, Reaction
+from apps.chat.presence import presence
+from apps.chat.utils import get_email_content_for_offline_digest
+from apps.chat.sequences import room_seq_allocate_one_each
+from apps.core.exceptions import ApplicationError
+from apps.users.models import EmailOutbox, User
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def get_room_group_name(room_id: int) -> str:
+    return f"chat_{room_id}"
+
+
+def message_create(
+    *,
+    chatroom: ChatRoom,
+    sender: User,
+    content: str,
+    client_msg_id: str | None = None,
+    mentioned_user_ids: Iterable[int] = (),
+) -> tuple[Message, bool]:
+    """
+    Returns the message and whether it was created. A `client_msg_id` the sender
+    already used returns the existing message instead of inserting a duplicate.
+    """
+    try:
+        with transaction.atomic():
+            message = Message.objects.create(
+                chatroom=chatroom,
+                sender=sender,
+                content=content,
+                client_msg_id=client_msg_id,
+            )
+            Mention.objects.bulk_create(
+                Mention(user_id=user_id, message=message, chatroom=chatroom)
+                for user_id in mentioned_user_ids
+                if user_id != sender.pk
+            )
+    except IntegrityError:
+        if client_msg_id is None:
+            raise
+        existing = Message.objects.filter(sender=sender, client_msg_id=client_msg_id).first()
+        # Without an earlier message for this client_msg_id another constraint failed
+        if existing is None:
+            raise
+        return existing, False
+    return message, True
+
+
+def direct_room_get_or_create(*, user: User, other_user: User) -> tuple[ChatRoom, bool]:
+    """
+    Returns the direct-message room of the two users, creating it if needed. The pair
+    is stored in a canonical order, so lookups are a single read of its unique index.
+    """
+    if user.pk == other_user.pk:
+        raise ApplicationError("Cannot open a direct message room with yourself")
+    low, high = sorted((user.pk, other_user.pk))
+    room = ChatRoom.objects.filter(dm_user_low_id=low, dm_user_high_id=high).first()
+    if room is not None:
+        return room, False
+    with transaction.atomic():
+        # Concurrent creators of the same pair meet at the unique constraint, and the
+        # loser reads the winner's room
+        room, created = ChatRoom.objects.get_or_create(
+            dm_user_low_id=low, dm_user_high_id=high, defaults={"name": f"dm_{low}_{high}"}
+        )
+        if created:
+            room.users.add(low, high)
+    return room, created
+
+
+def message_reaction_set(*, user: User, message_id: int, emoji: str, active: bool) -> int | None:
+    """
+    Adds (`active`) or removes the user's `emoji` reaction. Returns the message's room id
+    when something changed, None when the reaction was already in that state. The
+    message's counter map is updated separately, in batches.
+    """
+    # Messages in rooms the user isn't in are reported as missing, not as forbidden
+    messages = Message.objects.filter(pk=message_id, chatroom__users=user)
+    room_id = messages.values_list("chatroom_id", flat=True).first()
+    if room_id is None:
+        raise ApplicationError("Message does not exist")
+    if active:
+        try:
+            with transaction.atomic():
+                Reaction.objects.create(message_id=message_id, user=user, emoji=emoji)
+        except IntegrityError:
+            return None
+    else:
+        deleted, _ = Reaction.objects.filter(
+            message_id=message_id, user=user, emoji=emoji
+        ).delete()
+        if not deleted:
+            return None
+    return room_id
+
+
+def message_reaction_counts_apply(*, deltas: dict[int, dict[str, int]]):
+    """Adds per-message, per-emoji deltas to the messages' reaction counter maps."""
+    with transaction.atomic():
+        messages = list(
+            Message.objects.select_for_update().filter(pk__in=deltas).only("pk", "reaction_counts")
+        )
+        for message in messages:
+            counts = message.reaction_counts
+            for emoji, delta in deltas[message.pk].items():
+                counts[emoji] = counts.get(emoji, 0) + delta
+                if counts[emoji] <= 0:
+                    del counts[emoji]
+        Message.objects.bulk_update(messages, ["reaction_counts"])
+
+
+def message_reaction_counts_rebuild(*, message_ids: Iterable[int]) -> int:
+    """
+    Recounts reactions from Reaction rows, e.g. after deltas were lost in a crash. Holds
+    the same row locks as message_reaction_counts_apply, so a flush can't interleave.
+    """
+    with transaction.atomic():
+        messages = list(
+            Message.objects.select_for_update()
+            .filter(pk__in=list(message_ids))
+            .only("pk", "reaction_counts")
+        )
+        counts = {message.pk: {} for message in messages}
+        rows = (
+            Reaction.objects.filter(message_id__in=counts)
+            .values_list("message_id", "emoji")
+            .annotate(count=Count("pk"))
+            .order_by()
+        )
+        for message_id, emoji, count in rows:
+            counts[message_id][emoji] = count
+        for message in messages:
+            message.reaction_counts = counts[message.pk]
+        Message.objects.bulk_update(messages, ["reaction_counts"])
+    return len(messages)
+
+
+def offline_inbox_record(*, rooms: dict[int, tuple[int, datetime, datetime]]):
+    """
+    Adds (count, first message at, last message at) of new messages per room to the
+    inbox of every room member who is not connected.
+    """
+    members = list(
+        ChatRoom.users.through.objects.filter(chatroom_id__in=rooms).values_list(
+            "chatroom_id", "user_id"
+        )
+    )
+    online = presence.get_online_user_ids({user_id for _, user_id in members})
+    offline_by_room = defaultdict(list)
+    for room_id, user_id in members:
+        if user_id not in online:
+            offline_by_room[room_id].append(user_id)
+
+    with transaction.atomic():
+        for room_id, user_ids in offline_by_room.items():
+            count, _, last_message_at = rooms[room_id]
+            OfflineNotification.objects.filter(chatroom_id=room_id, user_id__in=user_ids).update(
+                count=F("count") + count, last_message_at=last_message_at
+            )
+        # Pairs updated above already exist and are skipped here
+        OfflineNotification.objects.bulk_create(
+            [
+                OfflineNotification(
+                    user_id=user_id,
+                    chatroom_id=room_id,
+                    count=rooms[room_id][0],
+                    first_message_at=rooms[room_id][1],
+                    last_message_at=rooms[room_id][2],
+                )
+                for room_id, user_ids in offline_by_room.items()
+                for user_id in user_ids
+            ],
+            ignore_conflicts=True,
+            batch_size=1000,
+        )
+
+
+def offline_digest_send_batch(*, batch_size: int) -> tuple[int, int]:
+    """
+    Queues one digest email for each of up to `batch_size` users whose oldest pending
+    notification is older than `CHAT_DIGEST_INTERVAL_SECONDS`, and clears their inbox.
+    Users who are connected again are cleared without an email. Returns (emails queued,
+    users processed).
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.CHAT_DIGEST_INTERVAL_SECONDS)
+    with transaction.atomic():
+        # Only users with pending rows are looked at, never the whole user table
+        user_ids = list(
+            OfflineNotification.objects.values("user_id")
+            .annotate(oldest=Min("first_message_at"))
+            .filter(oldest__lte=cutoff)
+            .order_by("oldest")
+            .values_list("user_id", flat=True)[:batch_size]
+        )
+        notifications = list(
+            OfflineNotification.objects.select_for_update(skip_locked=True, of=("self",))
+            .filter(user_id__in=user_ids)
+            .select_related("user", "chatroom")
+            .order_by("user_id", "-last_message_at")
+        )
+        by_user = defaultdict(list)
+        for notification in notifications:
+            by_user[notification.user].append(notification)
+        online = presence.get_online_user_ids(user.pk for user in by_user)
+
+        emails = []
+        for user, user_notifications in by_user.items():
+            if user.pk in online or not user.is_active:
+                continue
+            subject, message = get_email_content_for_offline_digest(
+                user=user, notifications=user_notifications
+            )
+            emails.append(
+                EmailOutbox(
+                    user=user,
+                    kind=EmailOutbox.KindChoices.CHAT_DIGEST,
+                    to=user.email,
+                    subject=subject,
+                    message=message,
+                )
+            )
+        EmailOutbox.objects.bulk_create(emails, batch_size=500)
+        OfflineNotification.objects.filter(
+            pk__in=[notification.pk for notification in notifications]
+        ).delete()
+    return len(emails), len(by_user)
+
+
+def attachment_create(
+    *,
+    uploader: User,
+    chatroom_id: int,
+    file_name: str,
+    content_type: str,
+    size: int,
+    sha256: str = "",
+) -> Attachment:
+    """Starts a chunked upload to a room the uploader is a member of."""
+    if not ChatRoom.users.through.objects.filter(
+        chatroom_id=chatroom_id, user_id=uploader.pk
+    ).exists():
+        raise ApplicationError("You are not a member of this room")
+    relative_path = f"{chatroom_id}/{uuid.uuid4().hex}"
+    path = get_attachment_path(relative_path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.touch(exist_ok=False)
+    return Attachment.objects.create(
+        uploader=uploader,
+        chatroom_id=chatroom_id,
+        file_name=file_name,
+        content_type=content_type,
+        size=size,
+        sha256=sha256.lower(),
+        path=relative_path,
+    )
+
+
+def attachment_chunk_write(
+    *, attachment: Attachment, offset: int, stream, length: int, chunk_sha256: str = ""
+) -> Attachment:
+    """
+    Writes `length` bytes read from `stream` at `offset`, which must be the upload's
+    current `received`, and completes the upload when that was the last chunk.
+
+    The chunk is streamed to disk block by block and the file's checksum is updated as
+    it goes, so memory use doesn't depend on chunk or file size. The offset is claimed
+    before writing, in the transaction that also completes the upload: a concurrent
+    write of the same offset fails instead of overwriting the chunk, and a chunk that
+    fails its `chunk_sha256` gives the offset back and can simply be sent again.
+    """
+    if attachment.is_complete:
+        raise ApplicationError("The upload is already complete")
+    if offset != attachment.received:
+        raise ApplicationError(f"The upload continues at offset {attachment.received}")
+    if offset + length > attachment.size:
+        raise ApplicationError("The chunk goes past the end of the file")
+
+    received = offset + length
+    with transaction.atomic():
+        # Holds the row lock until commit, so a second writer waits and then misses
+        if not Attachment.objects.filter(
+            pk=attachment.pk, received=offset, completed_at__isnull=True
+        ).update(received=received):
+            raise ApplicationError("The upload was continued by another request")
+        hasher = _attachment_file_write(
+            attachment=attachment,
+            offset=offset,
+            stream=stream,
+            length=length,
+            chunk_sha256=chunk_sha256,
+        )
+        attachment.received = received
+        if received == attachment.size:
+            _attachment_complete(attachment=attachment, sha256=hasher.hexdigest())
+    if received < attachment.size:
+        attachment_hasher_cache.put(attachment.pk, received, hasher)
+    elif not attachment.is_complete:
+        raise ApplicationError("The file does not match its checksum, upload it again")
+    return attachment
+
+
+def _attachment_file_write(
+    *, attachment: Attachment, offset: int, stream, length: int, chunk_sha256: str
+):
+    path = get_attachment_path(attachment.path)
+    hasher = attachment_hasher_cache.pop(attachment.pk, offset) or hash_file_prefix(path, offset)
+    chunk_hasher = hashlib.sha256()
+    with open(path, "r+b") as file:
+        file.seek(offset)
+        remaining = length
+        while remaining:
+            block = stream.read(min(BLOCK_SIZE, remaining))
+            if not block:
+                raise ApplicationError("The request body is shorter than its Content-Length")
+            file.write(block)
+            hasher.update(block)
+            chunk_hasher.update(block)
+            remaining -= len(block)
+    if chunk_sha256 and chunk_hasher.hexdigest() != chunk_sha256.lower():
+        raise ApplicationError("The chunk does not match its checksum")
+    return hasher
+
+
+def _attachment_complete(*, attachment: Attachment, sha256: str):
+    if attachment.sha256 and attachment.sha256 != sha256:
+        # The file is corrupt somewhere; restart rather than keep a bad copy
+        Attachment.objects.filter(pk=attachment.pk).update(received=0)
+        attachment.received = 0
+        return
+    message, _ = message_create(
+        chatroom=attachment.chatroom, sender=attachment.uploader, content=attachment.file_name
+    )
+    attachment.message = message
+    attachment.sha256 = sha256
+    attachment.completed_at = timezone.now()
+    attachment.save(update_fields=["message", "sha256", "completed_at"])
+    event = {
+        "type": "chat_message",
+        "message": message.content,
+        "message_id": message.pk,
+        "seq": message.seq,
+        "attachment": {
+            "id": attachment.pk,
+            "file_name": attachment.file_name,
+            "content_type": attachment.content_type,
+            "size": attachment.size,
+        },
+    }
+    # Members only hear of the file once it can be downloaded
+    transaction.on_commit(
+        lambda: async_to_sync(get_channel_layer().group_send)(
+            get_room_group_name(attachment.chatroom_id), event
+        )
+    )
+    # Recorded straight away, the inbox buffer flushes on the event loop and this runs
+    # in a request thread
+    rooms = {attachment.chatroom_id: [1, message.timestamp, message.timestamp]}
+    transaction.on_commit(lambda: offline_inbox_record(rooms=rooms))
+
+
+def attachment_purge_stale(*, older_than: timedelta, batch_size: int) -> int:
+    """Deletes uploads started before `older_than` ago and never finished, with their files."""
+    stale = Attachment.objects.filter(
+        completed_at__isnull=True, created_at__lt=timezone.now() - older_than
+    )
+    purged = 0
+    while True:
+        batch = list(stale.values_list("pk", "path")[:batch_size])
+        if not batch:
+            return purged
+        for _, relative_path in batch:
+            get_attachment_path(relative_path).unlink(missing_ok=True)
+        Attachment.objects.filter(pk__in=[pk for pk, _ in batch]).delete()
+        purged += len(batch)
+
+
+@dataclass
+class AnnouncementResult:
+    rooms: int = 0
+    created: int = 0
+    delivered: int = 0
+    failed: int = 0
+    started_at: float = field(default_factory=time.perf_counter)
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    @property
+    def rate(self) -> float:
+        return self.created / self.elapsed if self.elapsed else 0.0
+
+
+def _announcement_create_batch(*, template: Message, room_ids: list[int]) -> list[Message]:
+    with transaction.atomic():
+        seqs = room_seq_allocate_one_each(room_ids)
+        # The body is compressed once in `template` and copied to every room's message
+        messages = [
+            Message(
+                chatroom_id=room_id,
+                sender_id=template.sender_id,
+                seq=seq,
+                content_text=template.content_text,
+                content_compressed=template.content_compressed,
+            )
+            for room_id, seq in seqs.items()
+        ]
+        messages = Message.objects.bulk_create(messages)
+    # A batch is already what the inbox buffer would collect, and this runs in a worker
+    # thread, away from the event loop the buffer flushes on
+    offline_inbox_record(
+        rooms={
+            message.chatroom_id: [1, message.timestamp, message.timestamp]
+            for message in messages
+        }
+    )
+    return messages
+
+
+async def _announcement_fan_out(*, messages, content, semaphore, result):
+    channel_layer = get_channel_layer()
+
+    async def send(message):
+        async with semaphore:
+            try:
+                await channel_layer.group_send(
+                    get_room_group_name(message.chatroom_id),
+                    {
+                        "type": "chat_announcement",
+                        "message": content,
+                        "message_id": message.pk,
+                        "seq": message.seq,
+                    },
+                )
+            except Exception:
+                logger.exception("Announcement to room %s failed", message.chatroom_id)
+                result.failed += 1
+            else:
+                result.delivered += 1
+
+    await asyncio.gather(*(send(message) for message in messages))
+
+
+async def _announcement_send(*, template, content, room_ids, batch_size, concurrency, on_progress):
+    result = AnnouncementResult(rooms=len(room_ids))
+    semaphore = asyncio.Semaphore(concurrency)
+    create_batch = sync_to_async(_announcement_create_batch)
+    batches = [room_ids[i : i + batch_size] for i in range(0, len(room_ids), batch_size)]
+
+    # The next batch is inserted while the previous one is being fanned out
+    messages = await create_batch(template=template, room_ids=batches[0]) if batches else []
+    for next_room_ids in [*batches[1:], None]:
+        result.created += len(messages)
+        fan_out = _announcement_fan_out(
+            messages=messages, content=content, semaphore=semaphore, result=result
+        )
+        if next_room_ids is None:
+            await fan_out
+        else:
+            _, messages = await asyncio.gather(
+                fan_out, create_batch(template=template, room_ids=next_room_ids)
+            )
+        if on_progress is not None:
+            on_progress(result)
+    return result
+
+
+def announcement_send(
+    *,
+    sender: User,
+    content: str,
+    room_ids: list[int] | None = None,
+    batch_size: int = 1000,
+    concurrency: int | None = None,
+    on_progress: Callable[[AnnouncementResult], None] | None = None,
+) -> AnnouncementResult:
+    """
+    Posts `content` from `sender` to every room in `room_ids` (all rooms when None).
+
+    Messages are bulk-inserted `batch_size` rooms at a time and pushed to the rooms'
+    groups with at most `concurrency` group sends in flight.
+    """
+    rooms = ChatRoom.objects.order_by("pk")
+    if room_ids is not None:
+        rooms = rooms.filter(pk__in=room_ids)
+    template = Message(sender=sender, content=content)
+    return async_to_sync(_announcement_send)(
+        template=template,
+        content=content,
+        room_ids=list(rooms.values_list("pk", flat=True)),
+        batch_size=batch_size,
+        concurrency=concurrency or settings.CHAT_ANNOUNCEMENT_CONCURRENCY,
+        on_progress=on_progress,
+    )
@@ -0,0 +1,20 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+
+from apps.chat.mentions import room_members_changed
+from apps.chat.models import ChatRoom
+
+
+@receiver(m2m_changed, sender=ChatRoom.users.through)
+def invalidate_mention_matchers(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if not reverse:
+        room_ids = [instance.pk]
+    elif pk_set is not None:
+        room_ids = list(pk_set)
+    else:
+        # user.chatrooms.clear() doesn't say which rooms, read them before they go
+        room_ids = list(instance.chatrooms.values_list("pk", flat=True))
+    transaction.on_commit(lambda: [room_members_changed(room_id) for room_id in room_ids])
@@ -1,3 +1,644 @@
-from django.test import TestCase
+import hashlib
+import io
+import json
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from apps.chat.attachments import attachment_hasher_cache, parse_range_header
+from apps.chat.compression import compress_text, decompress_text
+from apps.chat.mentions import MentionMatcher
+from apps.chat.consumers import ChatConsumer
+from apps.chat.models import Attachment, ChatRoom, Message, OfflineNotification
+from apps.chat.presence import Presence
+from apps.chat.reactions import ReactionCounterAggregator
+from apps.chat.sequences import room_seq_allocate, room_seq_allocate_one_each
+from apps.chat.services import (
+    announcement_send,
+    attachment_chunk_write,
+    attachment_create,
+    message_create,
+    message_reaction_counts_apply,
+    message_reaction_counts_rebuild,
+    message_reaction_set,
+)
+from apps.common.buffers import flush_all
+from apps.core.exceptions import ApplicationError
+from apps.core.queries import assert_max_queries
+from apps.users.models import EmailOutbox, User
+from apps.users.selectors import get_tokens_for_user
+from config import settings
+
+# Tests run without a Redis server
+IN_MEMORY_CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+LOCAL_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+# A pasted traceback, the kind of body compression is meant for
+LONG_TEXT = "".join(
+    f'  File "/srv/app/module{number}.py", line {number}, in handler\n'
+    f"    raise ValueError('bad value: ünïcödé {number}')\n"
+    for number in range(40)
+)
+
+
+def get_auth_header(user):
+    return f"Bearer {get_tokens_for_user(user=user)['access']}"
+
+
+# Query budgets measured on the current code. A change that makes one of these
+# endpoints run more queries per request has to raise its budget here, on purpose.
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"],
+)
+class ChatApiQueryBudgetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(
+                f"user{number}@example.com", "password", username=f"user{number}"
+            )
+            for number in range(10)
+        ]
+        cls.user = cls.users[0]
+        cls.room = ChatRoom.objects.create(name="General")
+        cls.room.users.set(cls.users)
+        for user in cls.users:
+            for _ in range(3):
+                message_create(
+                    chatroom=cls.room,
+                    sender=user,
+                    content=f"hello @{cls.user.username}",
+                    mentioned_user_ids=[cls.user.pk],
+                )
+
+    def setUp(self):
+        cache.clear()
+        self.client.defaults["HTTP_AUTHORIZATION"] = get_auth_header(self.user)
+
+    def test_message_history(self):
+        with assert_max_queries(2, "message history"):
+            response = self.client.get(reverse("history", args=[self.room.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 30)
+
+    def test_mentions(self):
+        with assert_max_queries(2, "mentions"):
+            response = self.client.get(reverse("chat-mentions"))
+        self.assertEqual(response.status_code, 200)
+
+    def test_direct_room(self):
+        other_user = self.users[1]
+        with assert_max_queries(11, "direct room create"):
+            response = self.client.post(reverse("chat-direct-room"), {"user_id": other_user.pk})
+        self.assertEqual(response.status_code, 201)
+        with assert_max_queries(1, "direct room lookup"):
+            response = self.client.post(reverse("chat-direct-room"), {"user_id": other_user.pk})
+        self.assertEqual(response.status_code, 200)
+
+    def test_room_autocomplete(self):
+        with assert_max_queries(2, "room autocomplete"):
+            response = self.client.get(reverse("chat-room-autocomplete"), {"q": "gen"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["description"], [{"id": self.room.pk, "name": "General"}])
+
+    def test_room_autocomplete_only_finds_own_rooms(self):
+        ChatRoom.objects.create(name="Generic secrets")
+        response = self.client.get(reverse("chat-room-autocomplete"), {"q": "gen"})
+        self.assertEqual(
+            [room["name"] for room in response.json()["description"]], ["General"]
+        )
+
+    def test_message_create_reuses_client_msg_id(self):
+        message, created = message_create(
+            chatroom=self.room, sender=self.user, content="hi", client_msg_id="c1"
+        )
+        self.assertTrue(created)
+        retried, created = message_create(
+            chatroom=self.room, sender=self.user, content="hi", client_msg_id="c1"
+        )
+        self.assertFalse(created)
+        self.assertEqual(retried.pk, message.pk)
+
+    def test_message_create_reraises_other_integrity_errors(self):
+        # A duplicate mention breaks a constraint unrelated to client_msg_id
+        with self.assertRaises(IntegrityError):
+            message_create(
+                chatroom=self.room,
+                sender=self.user,
+                content="hi",
+                client_msg_id="c2",
+                mentioned_user_ids=[self.users[1].pk, self.users[1].pk],
+            )
+
+    def test_reacting_needs_room_membership(self):
+        message = Message.objects.filter(chatroom=self.room).first()
+        outsider = User.objects.create_user("eve@example.com", "password", username="eve")
+        with self.assertRaisesMessage(ApplicationError, "Message does not exist"):
+            message_reaction_set(user=outsider, message_id=message.pk, emoji="+1", active=True)
+        room_id = message_reaction_set(
+            user=self.user, message_id=message.pk, emoji="+1", active=True
+        )
+        self.assertEqual(room_id, self.room.pk)
+
+    def test_repeated_queries_fail_the_budget(self):
+        with self.assertRaisesMessage(AssertionError, "repeats"):
+            with assert_max_queries(100, "senders without select_related"):
+                [message.sender.username for message in Message.objects.all()]
+
+    def test_query_count_header(self):
+        response = self.client.get(reverse("history", args=[self.room.pk]))
+        self.assertIn("X-Query-Count", response)
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS,
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"],
+)
+class ChatConsumerQueryBudgetTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("sender@example.com", "password", username="sender")
+        self.room = ChatRoom.objects.create(name="General")
+        self.room.users.add(self.user)
+        self.message, _ = message_create(chatroom=self.room, sender=self.user, content="hello")
+        self.auth_header = get_auth_header(self.user)
+
+    async def connect(self):
+        communicator = WebsocketCommunicator(
+            ChatConsumer.as_asgi(),
+            "/ws/chat/",
+            headers=[(b"authorization", self.auth_header.encode())],
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def send(self, communicator, data):
+        await communicator.send_to(text_data=json.dumps(data))
+        while True:
+            response = json.loads(await communicator.receive_from())
+            if response.get("type") in ("ack", "reaction", "error"):
+                return response
+
+    async def test_send_message(self):
+        communicator = await self.connect()
+        # Joins the room group
+        await self.send(communicator, {"room_id": self.room.pk, "message": "first"})
+        # BEGIN, room counter UPDATE ... RETURNING, INSERT, plus the room lookup
+        with assert_max_queries(4, "send message"):
+            ack = await self.send(
+                communicator,
+                {"room_id": self.room.pk, "message": "hello", "client_msg_id": "a1"},
+            )
+        self.assertEqual(ack["type"], "ack")
+        await communicator.disconnect()
+
+    async def test_send_reaction(self):
+        communicator = await self.connect()
+        # Joins the room group, which the reaction is broadcast to
+        await self.send(communicator, {"room_id": self.room.pk, "message": "first"})
+        with assert_max_queries(3, "reaction"):
+            response = await self.send(
+                communicator,
+                {"type": "reaction", "message_id": self.message.pk, "emoji": "+1", "active": True},
+            )
+        self.assertEqual(response["type"], "reaction")
+        await communicator.disconnect()
+
+
+class CompressionTests(SimpleTestCase):
+    def test_round_trip(self):
+        data = compress_text(LONG_TEXT)
+        self.assertIsNotNone(data)
+        self.assertLess(len(data), len(LONG_TEXT.encode()))
+        self.assertEqual(decompress_text(data), LONG_TEXT)
+
+    def test_short_text_is_stored_plain(self):
+        self.assertIsNone(compress_text("hello"))
+
+    def test_truncated_decompression_drops_partial_characters(self):
+        data = compress_text(LONG_TEXT)
+        prefix = decompress_text(data, max_length=45)
+        self.assertTrue(LONG_TEXT.startswith(prefix))
+        self.assertLessEqual(len(prefix.encode()), 45)
+
+    def test_message_content_round_trip(self):
+        message = Message(content=LONG_TEXT)
+        self.assertIsNotNone(message.content_compressed)
+        self.assertEqual(message.content_text, "")
+        self.assertEqual(message.content, LONG_TEXT)
+        self.assertEqual(message.get_content_preview(30), LONG_TEXT[:30])
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class MessageSequenceTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("anna@example.com", "password", username="anna")
+        cls.other_user = User.objects.create_user("bob@example.com", "password", username="bob")
+        cls.room = ChatRoom.objects.create(name="General")
+        cls.other_room = ChatRoom.objects.create(name="Random")
+
+    def send(self, room, **kwargs):
+        message, _ = message_create(chatroom=room, sender=self.user, content="hi", **kwargs)
+        return message.seq
+
+    def test_numbers_count_up_per_room(self):
+        self.assertEqual([self.send(self.room) for _ in range(3)], [1, 2, 3])
+        self.assertEqual(self.send(self.other_room), 1)
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.seq_allocated, 3)
+
+    def test_failed_insert_leaves_no_gap(self):
+        self.send(self.room)
+        with self.assertRaises(IntegrityError):
+            self.send(self.room, mentioned_user_ids=[self.other_user.pk, self.other_user.pk])
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.send(self.room)
+            raise RuntimeError
+        self.assertEqual(self.send(self.room), 2)
+
+    def test_retried_client_msg_id_takes_no_number(self):
+        self.assertEqual(self.send(self.room, client_msg_id="c1"), 1)
+        self.assertEqual(self.send(self.room, client_msg_id="c1"), 1)
+        self.assertEqual(self.send(self.room), 2)
+
+    def test_one_number_each(self):
+        self.send(self.room)
+        with transaction.atomic():
+            seqs = room_seq_allocate_one_each([self.room.pk, self.other_room.pk])
+        self.assertEqual(seqs, {self.room.pk: 2, self.other_room.pk: 1})
+
+    def test_number_is_taken_with_one_query(self):
+        with transaction.atomic(), self.assertNumQueries(1):
+            self.assertEqual(room_seq_allocate(self.room.pk), 1)
+        with self.assertRaises(ChatRoom.DoesNotExist), transaction.atomic():
+            room_seq_allocate(0)
+
+
+class MessageSequenceTransactionTests(SimpleTestCase):
+    def test_allocating_outside_a_transaction_fails(self):
+        with self.assertRaises(transaction.TransactionManagementError):
+            room_seq_allocate(1)
+
+
+class MentionMatcherTests(SimpleTestCase):
+    def setUp(self):
+        self.matcher = MentionMatcher({"ann": 1, "anna": 2, "Bob_Smith": 3, "nna": 4})
+
+    def test_finds_every_mentioned_user(self):
+        self.assertEqual(self.matcher.find("hi @ann and @bob_smith"), {1, 3})
+
+    def test_is_case_insensitive(self):
+        self.assertEqual(self.matcher.find("@ANNA, @Bob_SMITH!"), {2, 3})
+
+    def test_longest_name_wins(self):
+        # @anna contains @ann, and its suffix "nna" is only reachable via a failure link
+        self.assertEqual(self.matcher.find("@anna"), {2})
+
+    def test_needs_whole_words(self):
+        self.assertEqual(self.matcher.find("@annabel mail@ann @ann_"), set())
+        self.assertEqual(self.matcher.find("(@ann)"), {1})
+
+    def test_overlapping_mentions(self):
+        # The second "@" follows a word character, like an e-mail address
+        self.assertEqual(self.matcher.find("@ann@anna"), {1})
+        self.assertEqual(self.matcher.find("@ann @anna @nna"), {1, 2, 4})
+
+    def test_no_members(self):
+        self.assertEqual(MentionMatcher({}).find("@ann"), set())
+
+
+class OfflineDigestPresenceTests(TestCase):
+    """The digest job runs in another process than the sockets, sharing only the cache."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.caches = {
+            "default": {
+                "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                "LOCATION": directory.name,
+            }
+        }
+        self.enterContext(override_settings(CACHES=self.caches))
+        self.user = User.objects.create_user("anna@example.com", "password", username="anna")
+        room = ChatRoom.objects.create(name="General")
+        first_message_at = timezone.now() - timedelta(days=1)
+        OfflineNotification.objects.create(
+            user=self.user,
+            chatroom=room,
+            count=3,
+            first_message_at=first_message_at,
+            last_message_at=first_message_at,
+        )
+        self.presence = Presence(timeout=60)
+
+    def send_digests_from_another_process(self):
+        # Fresh cache connections: nothing this process holds in memory is visible
+        with override_settings(CACHES=self.caches):
+            call_command("send_offline_digests", stdout=io.StringIO())
+
+    def test_connected_user_gets_no_digest(self):
+        self.presence.connected(self.user.pk)
+        self.send_digests_from_another_process()
+        self.assertFalse(EmailOutbox.objects.exists())
+
+    def test_disconnected_user_gets_a_digest(self):
+        self.presence.connected(self.user.pk)
+        self.presence.connected(self.user.pk)
+        self.presence.disconnected(self.user.pk)
+        self.presence.disconnected(self.user.pk)
+        self.send_digests_from_another_process()
+        self.assertEqual(EmailOutbox.objects.filter(to=self.user.email).count(), 1)
+
+    def test_user_still_connected_in_another_process_gets_no_digest(self):
+        other_process = Presence(timeout=60)
+        other_process.connected(self.user.pk)
+        self.presence.connected(self.user.pk)
+        self.presence.disconnected(self.user.pk)
+        self.send_digests_from_another_process()
+        self.assertFalse(EmailOutbox.objects.exists())
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS,
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"],
+)
+class ChatReactionTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("anna@example.com", "password", username="anna")
+        self.other_user = User.objects.create_user("bob@example.com", "password", username="bob")
+        self.room = ChatRoom.objects.create(name="General")
+        self.room.users.add(self.user, self.other_user)
+        self.message, _ = message_create(chatroom=self.room, sender=self.user, content="hello")
+        self.auth_headers = {user: get_auth_header(user) for user in (self.user, self.other_user)}
+        # A long interval: the test decides when the deltas are written
+        self.aggregator = ReactionCounterAggregator(interval=3600)
+        self.enterContext(mock.patch("apps.chat.consumers.reaction_aggregator", self.aggregator))
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(
+            ChatConsumer.as_asgi(),
+            "/ws/chat/",
+            headers=[(b"authorization", self.auth_headers[user].encode())],
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        # Sending a message joins the room group
+        await communicator.send_to(text_data=json.dumps({"room_id": self.room.pk, "message": "hi"}))
+        return communicator
+
+    async def receive(self, communicator, message_type):
+        while True:
+            response = json.loads(await communicator.receive_from())
+            if response.get("type") == message_type:
+                return response
+
+    async def react(self, communicator, active, emoji="+1"):
+        await communicator.send_to(text_data=json.dumps({
+            "type": "reaction", "message_id": self.message.pk, "emoji": emoji, "active": active
+        }))
+
+    async def test_deltas_are_sent_to_the_room(self):
+        communicator = await self.connect(self.user)
+        other_communicator = await self.connect(self.other_user)
+        await self.react(communicator, True)
+        received = await self.receive(other_communicator, "reaction")
+        self.assertEqual(
+            received,
+            {
+                "type": "reaction",
+                "message_id": self.message.pk,
+                "emoji": "+1",
+                "delta": 1,
+                "user_id": self.user.pk,
+            },
+        )
+        await self.react(communicator, False)
+        self.assertEqual((await self.receive(other_communicator, "reaction"))["delta"], -1)
+        # Removing it again changes nothing, so nothing is sent
+        await self.react(communicator, False)
+        await self.react(communicator, True, emoji="heart")
+        self.assertEqual((await self.receive(other_communicator, "reaction"))["emoji"], "heart")
+        await communicator.disconnect()
+        await other_communicator.disconnect()
+
+    async def test_add_and_remove_within_an_interval_cancel_out(self):
+        communicator = await self.connect(self.user)
+        await self.react(communicator, True)
+        await self.receive(communicator, "reaction")
+        await self.react(communicator, False)
+        await self.receive(communicator, "reaction")
+        await self.react(communicator, True, emoji="heart")
+        await self.receive(communicator, "reaction")
+        with mock.patch(
+            "apps.chat.reactions.message_reaction_counts_apply",
+            wraps=message_reaction_counts_apply,
+        ) as apply:
+            await self.aggregator.flush()
+        apply.assert_called_once_with(deltas={self.message.pk: {"heart": 1}})
+        await self.message.arefresh_from_db()
+        self.assertEqual(self.message.reaction_counts, {"heart": 1})
+        await communicator.disconnect()
+
+    def test_rebuild_recounts_from_reaction_rows(self):
+        for emoji in ("+1", "heart"):
+            message_reaction_set(
+                user=self.user, message_id=self.message.pk, emoji=emoji, active=True
+            )
+        message_reaction_set(
+            user=self.other_user, message_id=self.message.pk, emoji="+1", active=True
+        )
+        # Deltas lost with a crashed process
+        Message.objects.filter(pk=self.message.pk).update(reaction_counts={"+1": 7})
+        self.assertEqual(message_reaction_counts_rebuild(message_ids=[self.message.pk, 0]), 1)
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.reaction_counts, {"+1": 2, "heart": 1})
+
+
+@override_settings(CACHES=LOCAL_CACHES, CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class AnnouncementTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.sender = User.objects.create_user("admin@example.com", "password", username="admin")
+        cls.user = User.objects.create_user("anna@example.com", "password", username="anna")
+        cls.rooms = [ChatRoom.objects.create(name=f"Room {number}") for number in range(3)]
+        for room in cls.rooms:
+            room.users.add(cls.user)
+
+    def test_offline_members_get_the_announcement_in_their_inbox(self):
+        result = announcement_send(sender=self.sender, content="Maintenance at 10", batch_size=2)
+        self.assertEqual((result.created, result.delivered), (3, 3))
+        notifications = OfflineNotification.objects.filter(user=self.user)
+        self.assertEqual(
+            sorted(notifications.values_list("chatroom_id", "count")),
+            [(room.pk, 1) for room in self.rooms],
+        )
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class WriteBehindBufferTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("anna@example.com", "password", username="anna")
+        cls.room = ChatRoom.objects.create(name="General")
+        cls.message, _ = message_create(chatroom=cls.room, sender=cls.user, content="hello")
+
+    async def test_flush_all_writes_pending_deltas(self):
+        # A long interval: only flush_all, as run by a draining worker, writes the deltas
+        aggregator = ReactionCounterAggregator(interval=3600)
+        aggregator.add(self.message.pk, "+1", 1)
+        aggregator.add(self.message.pk, "+1", 1)
+        aggregator.add(self.message.pk, "heart", 1)
+        aggregator.add(self.message.pk, "heart", -1)
+        await flush_all()
+        await self.message.arefresh_from_db()
+        self.assertEqual(self.message.reaction_counts, {"+1": 2})
+        self.assertFalse(aggregator.pending)
+
+    async def test_failed_write_is_retried_with_later_deltas(self):
+        aggregator = ReactionCounterAggregator(interval=3600)
+        aggregator.add(self.message.pk, "+1", 1)
+        with mock.patch(
+            "apps.chat.reactions.message_reaction_counts_apply", side_effect=RuntimeError
+        ), self.assertLogs("apps.common.buffers", "ERROR"):
+            await aggregator.flush()
+        self.assertEqual(aggregator.pending, {self.message.pk: {"+1": 1}})
+        aggregator.add(self.message.pk, "+1", 1)
+        await aggregator.flush()
+        await self.message.arefresh_from_db()
+        self.assertEqual(self.message.reaction_counts, {"+1": 2})
+
+    async def test_batch_is_dropped_after_max_failures(self):
+        aggregator = ReactionCounterAggregator(interval=3600)
+        aggregator.add(self.message.pk, "+1", 1)
+        with mock.patch(
+            "apps.chat.reactions.message_reaction_counts_apply", side_effect=RuntimeError
+        ), self.assertLogs("apps.common.buffers", "ERROR") as logs:
+            for _ in range(aggregator.max_failures):
+                await aggregator.flush()
+        self.assertIn("dropped 1 pending entries", logs.output[-1])
+        self.assertFalse(aggregator.pending)
+
+
+class RangeHeaderTests(SimpleTestCase):
+    def test_ranges(self):
+        self.assertEqual(parse_range_header("bytes=0-99", 1000), (0, 99))
+        self.assertEqual(parse_range_header("bytes=900-", 1000), (900, 999))
+        self.assertEqual(parse_range_header("bytes=-100", 1000), (900, 999))
+        # Past the end is cut to the file, a suffix longer than the file is all of it
+        self.assertEqual(parse_range_header("bytes=990-2000", 1000), (990, 999))
+        self.assertEqual(parse_range_header("bytes=-5000", 1000), (0, 999))
+
+    def test_ignored_headers(self):
+        for header in ("", "bytes=-", "items=0-1", "bytes=0-1,5-6", "bytes=a-b"):
+            with self.subTest(header=header):
+                self.assertIsNone(parse_range_header(header, 1000))
+
+    def test_unsatisfiable_ranges(self):
+        for header in ("bytes=1000-", "bytes=5-4", "bytes=-0"):
+            with self.subTest(header=header):
+                with self.assertRaises(ValueError):
+                    parse_range_header(header, 1000)
+
+
+@override_settings(CACHES=LOCAL_CACHES, CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class AttachmentUploadTests(TestCase):
+    data = bytes(range(256)) * 1000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("anna@example.com", "password", username="anna")
+        cls.room = ChatRoom.objects.create(name="General")
+        cls.room.users.add(cls.user)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(mock.patch.object(settings, "ATTACHMENT_ROOT", directory.name))
+
+    def create(self, **kwargs):
+        return attachment_create(
+            uploader=self.user,
+            chatroom_id=self.room.pk,
+            file_name="data.bin",
+            content_type="application/octet-stream",
+            size=len(self.data),
+            **kwargs,
+        )
+
+    def write(self, attachment, start, end, **kwargs):
+        chunk = self.data[start:end]
+        return attachment_chunk_write(
+            attachment=attachment,
+            offset=start,
+            stream=io.BytesIO(chunk),
+            length=len(chunk),
+            **kwargs,
+        )
+
+    def test_upload_resumes_in_another_process(self):
+        attachment = self.create(sha256=hashlib.sha256(self.data).hexdigest())
+        self.write(attachment, 0, 100_000)
+        # The next chunk lands where the running checksum isn't cached
+        attachment_hasher_cache.pop(attachment.pk, 100_000)
+        attachment = Attachment.objects.select_related("chatroom", "uploader").get(
+            pk=attachment.pk
+        )
+        self.assertEqual(attachment.received, 100_000)
+        offline_user = User.objects.create_user("bob@example.com", "password", username="bob")
+        self.room.users.add(offline_user)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.write(attachment, 100_000, len(self.data))
+        # The room broadcast and the offline members' inbox
+        self.assertEqual(len(callbacks), 2)
+        self.assertEqual(
+            OfflineNotification.objects.get(user=offline_user, chatroom=self.room).count, 1
+        )
+        attachment.refresh_from_db()
+        self.assertTrue(attachment.is_complete)
+        self.assertEqual(attachment.message.content, "data.bin")
+        with open(f"{settings.ATTACHMENT_ROOT}/{attachment.path}", "rb") as file:
+            self.assertEqual(file.read(), self.data)
+
+    def test_failed_chunk_gives_the_offset_back(self):
+        attachment = self.create()
+        with self.assertRaisesMessage(ApplicationError, "checksum"):
+            self.write(attachment, 0, 1000, chunk_sha256="0" * 64)
+        attachment.refresh_from_db()
+        self.assertEqual(attachment.received, 0)
+        self.write(attachment, 0, 1000)
+        attachment.refresh_from_db()
+        self.assertEqual(attachment.received, 1000)
+
+    def test_concurrent_write_of_the_same_offset_fails(self):
+        attachment = self.create()
+        stale = Attachment.objects.get(pk=attachment.pk)
+        self.write(attachment, 0, 1000)
+        with self.assertRaisesMessage(ApplicationError, "continued by another request"):
+            self.write(stale, 0, 1000)
+
+    def test_corrupt_file_restarts_the_upload(self):
+        attachment = self.create(sha256="0" * 64)
+        with self.captureOnCommitCallbacks() as callbacks:
+            with self.assertRaisesMessage(ApplicationError, "upload it again"):
+                self.write(attachment, 0, len(self.data))
+        self.assertEqual(callbacks, [])
+        attachment.refresh_from_db()
+        self.assertEqual(attachment.received, 0)
+        self.assertFalse(attachment.is_complete)
+        self.assertFalse(Message.objects.exists())
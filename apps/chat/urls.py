@@ -1,8 +1,33 @@
-from django.contrib import admin
-from django.urls import path,include
+from django.urls import path
 
-from apps.chat.views import get_message_history
+from apps.chat.views import (
+    AnnouncementCreateApi,
+    AttachmentCreateApi,
+    AttachmentDownloadApi,
+    AttachmentUploadApi,
+    ConnectionStatsApi,
+    DirectRoomApi,
+    MentionListApi,
+    RoomAutocompleteApi,
+    get_message_history,
+)
 
 urlpatterns = [
-    path('history/', get_message_history(), name='history'),
-]
\ No newline at end of file
+    path('history/<int:room_id>/', get_message_history, name='history'),
+    path('announcements/', AnnouncementCreateApi.as_view(), name='chat-announcements'),
+    path('direct/', DirectRoomApi.as_view(), name='chat-direct-room'),
+    path('mentions/', MentionListApi.as_view(), name='chat-mentions'),
+    path('rooms/autocomplete/', RoomAutocompleteApi.as_view(), name='chat-room-autocomplete'),
+    path('attachments/', AttachmentCreateApi.as_view(), name='chat-attachments'),
+    path(
+        'attachments/<int:attachment_id>/',
+        AttachmentUploadApi.as_view(),
+        name='chat-attachment-upload',
+    ),
+    path(
+        'attachments/<int:attachment_id>/download/',
+        AttachmentDownloadApi.as_view(),
+        name='chat-attachment-download',
+    ),
+    path('connections/', ConnectionStatsApi.as_view(), name='chat-connections'),
+]
@@ -0,0 +1,23 @@
+from apps.users.models import User
+from config import settings
+
+
+def get_email_content_for_offline_digest(*, user: User, notifications) -> tuple[str, str]:
+    total = sum(notification.count for notification in notifications)
+    subject = f"You have {total} new message{'s' if total != 1 else ''}"
+    lines = []
+    for notification in notifications:
+        room = notification.chatroom
+        name = "A direct message" if room.is_direct else room.name
+        lines.append(
+            f"- {name}: {notification.count} new since "
+            f"{notification.first_message_at:%Y-%m-%d %H:%M} UTC"
+        )
+    message = (
+        f"Dear {user.username},\n\n"
+        f"While you were away:\n"
+        + "\n".join(lines)
+        + f"\n\nOpen the chat to catch up: {settings.BASE_FRONTEND_URL}\n\n"
+        f"Thank you,\n\nOperations Team."
+    )
+    return subject, message
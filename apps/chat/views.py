@@ -1,9 +1,367 @@
+import os
+
+from django.http import Http404, StreamingHttpResponse
+from django.utils.http import content_disposition_header
+from django.utils.cache import patch_cache_control
+from rest_framework import serializers, status
 from rest_framework.decorators import api_view
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
+
+from apps.chat.admission import handshake_admission
+from apps.chat.attachments import aiter_file_range, get_attachment_path, parse_range_header
+from apps.chat.connections import connection_registry
+from apps.chat.selectors import (
+    get_downloadable_attachment,
+    get_upload_attachment,
+    get_user_mentions,
+    search_rooms,
+)
+from apps.chat.services import (
+    announcement_send,
+    attachment_chunk_write,
+    attachment_create,
+    direct_room_get_or_create,
+)
+from apps.common.views import BaseApiView
+from apps.users.selectors import get_cached_user
+from config import settings
 from .models import Message
 
+def get_attachment_summary(attachment):
+    if attachment is None:
+        return None
+    return {
+        'id': attachment.pk,
+        'file_name': attachment.file_name,
+        'content_type': attachment.content_type,
+        'size': attachment.size,
+    }
+
+
 @api_view(['GET'])
 def get_message_history(request, room_id):
-    messages = Message.objects.filter(chatroom_id=room_id)
-    data = [{'sender': msg.sender.username, 'content': msg.content, 'timestamp': msg.timestamp} for msg in messages]
-    return Response(data)
\ No newline at end of file
+    # Clients resume from the last seq they have; a jump in seq marks missing messages
+    after_seq = request.query_params.get('after_seq', '0')
+    if not after_seq.isdigit():
+        raise ValidationError({'after_seq': 'Must be a non-negative integer.'})
+    messages = (
+        Message.objects.filter(chatroom_id=room_id, seq__gt=int(after_seq))
+        .select_related('sender', 'attachment')
+        .order_by('seq')
+    )
+    data = [
+        {
+            'id': msg.pk,
+            'seq': msg.seq,
+            'sender': msg.sender.username,
+            'content': msg.content,
+            'reactions': msg.reaction_counts,
+            'attachment': get_attachment_summary(getattr(msg, 'attachment', None)),
+            'timestamp': msg.timestamp,
+        }
+        for msg in messages
+    ]
+    return Response(data)
+
+
+class ConnectionStatsApi(BaseApiView):
+    """
+    Live WebSocket connections of the process that serves the request. With several
+    workers each call reports one of them, identified by `pid`.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    class FilterSerializer(serializers.Serializer):
+        limit = serializers.IntegerField(min_value=1, max_value=1000, default=50)
+
+    def get(self, request):
+        serializer = self.FilterSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        stats = connection_registry.get_stats(limit=serializer.validated_data["limit"])
+        return self.send_response(
+            success=True,
+            code="200",
+            message="Connection stats retrieved successfully",
+            description={"pid": os.getpid(), **stats, "handshakes": handshake_admission.get_stats()},
+            status_code=status.HTTP_200_OK,
+        )
+
+
+class AnnouncementCreateApi(BaseApiView):
+    permission_classes = [IsAdminUser]
+
+    class InputSerializer(serializers.Serializer):
+        content = serializers.CharField(required=True, allow_blank=False)
+        room_ids = serializers.ListField(
+            child=serializers.IntegerField(min_value=1), required=False, allow_empty=False
+        )
+        all_rooms = serializers.BooleanField(default=False)
+
+        def validate(self, attrs):
+            if attrs["all_rooms"] == ("room_ids" in attrs):
+                raise serializers.ValidationError("Provide either room_ids or all_rooms.")
+            return attrs
+
+    def post(self, request):
+        serializer = self.InputSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        result = announcement_send(
+            sender=request.user,
+            content=serializer.validated_data["content"],
+            room_ids=serializer.validated_data.get("room_ids"),
+        )
+        return self.send_response(
+            success=True,
+            code="201",
+            message="Announcement sent",
+            description={
+                "rooms": result.rooms,
+                "created": result.created,
+                "delivered": result.delivered,
+                "failed": result.failed,
+                "elapsed": round(result.elapsed, 3),
+            },
+            status_code=status.HTTP_201_CREATED,
+        )
+
+
+class DirectRoomApi(BaseApiView):
+    permission_classes = [IsAuthenticated]
+
+    class InputSerializer(serializers.Serializer):
+        user_id = serializers.IntegerField(min_value=1)
+
+    def post(self, request):
+        serializer = self.InputSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        other_user = get_cached_user(user_id=serializer.validated_data["user_id"])
+        if other_user is None or not other_user.is_active:
+            raise Http404("No user with this id exists")
+        room, created = direct_room_get_or_create(user=request.user, other_user=other_user)
+        return self.send_response(
+            success=True,
+            code="201" if created else "200",
+            message="Direct message room created" if created else "Direct message room retrieved",
+            description={"room_id": room.pk, "name": room.name},
+            status_code=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+        )
+
+
+class MentionListApi(BaseApiView):
+    permission_classes = [IsAuthenticated]
+
+    class FilterSerializer(serializers.Serializer):
+        before = serializers.IntegerField(min_value=1, required=False)
+        limit = serializers.IntegerField(min_value=1, max_value=100, default=50)
+
+    class OutputSerializer(serializers.Serializer):
+        message_id = serializers.IntegerField()
+        room_id = serializers.IntegerField(source="chatroom_id")
+        seq = serializers.IntegerField(source="message.seq")
+        sender = serializers.CharField(source="message.sender.username")
+        preview = serializers.CharField(source="message.get_content_preview")
+        timestamp = serializers.DateTimeField(source="message.timestamp")
+
+    def get(self, request):
+        filters = self.FilterSerializer(data=request.query_params)
+        filters.is_valid(raise_exception=True)
+        limit = filters.validated_data["limit"]
+        mentions = list(get_user_mentions(user=request.user, **filters.validated_data))
+        # A full page may have more behind it; the client passes `next` back as `before`
+        next_before = mentions[-1].message_id if len(mentions) == limit else None
+        return self.send_response(
+            success=True,
+            code="200",
+            message="Mentions retrieved successfully",
+            description={
+                "results": self.OutputSerializer(mentions, many=True).data,
+                "next": next_before,
+            },
+            status_code=status.HTTP_200_OK,
+        )
+
+
+class RoomAutocompleteApi(BaseApiView):
+    permission_classes = [IsAuthenticated]
+
+    class FilterSerializer(serializers.Serializer):
+        q = serializers.CharField(min_length=1, max_length=255, trim_whitespace=True)
+        limit = serializers.IntegerField(min_value=1, max_value=50, default=10)
+
+    def get(self, request):
+        serializer = self.FilterSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        rooms = search_rooms(
+            user=request.user,
+            prefix=serializer.validated_data["q"],
+            limit=serializer.validated_data["limit"],
+        )
+        response = self.send_response(
+            success=True,
+            code="200",
+            message="Rooms retrieved successfully",
+            description=[{"id": pk, "name": name} for pk, name in rooms],
+            status_code=status.HTTP_200_OK,
+        )
+        # Lets clients reuse results when the user types back over a prefix
+        patch_cache_control(response, private=True, max_age=30)
+        return response
+
+
+class AttachmentCreateApi(BaseApiView):
+    """
+    Starts a resumable upload. The file is then sent in order, in chunks of at most
+    `max_chunk_size` bytes, with PATCH requests to AttachmentUploadApi.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    class InputSerializer(serializers.Serializer):
+        room_id = serializers.IntegerField(min_value=1)
+        file_name = serializers.CharField(max_length=255)
+        content_type = serializers.CharField(max_length=255, default="application/octet-stream")
+        size = serializers.IntegerField(min_value=1, max_value=settings.ATTACHMENT_MAX_SIZE)
+        sha256 = serializers.RegexField(r"^[0-9a-fA-F]{64}$", required=False, default="")
+
+    def post(self, request):
+        serializer = self.InputSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        attachment = attachment_create(
+            uploader=request.user,
+            chatroom_id=data["room_id"],
+            file_name=data["file_name"],
+            content_type=data["content_type"],
+            size=data["size"],
+            sha256=data["sha256"],
+        )
+        return self.send_response(
+            success=True,
+            code="201",
+            message="Upload started",
+            description={
+                "id": attachment.pk,
+                "offset": 0,
+                "max_chunk_size": settings.ATTACHMENT_MAX_CHUNK_SIZE,
+            },
+            status_code=status.HTTP_201_CREATED,
+        )
+
+
+class AttachmentUploadApi(BaseApiView):
+    """
+    GET returns the offset to resume an interrupted upload from. PATCH appends a chunk:
+    the raw bytes as the body, their position in an `Upload-Offset` header and optionally
+    an `Upload-Checksum: sha256 <hex digest>` header. The chunk completing the file posts
+    it to the room.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get_attachment(self, request, attachment_id):
+        attachment = get_upload_attachment(user=request.user, attachment_id=attachment_id)
+        if attachment is None:
+            raise Http404("No upload with this id exists")
+        return attachment
+
+    @staticmethod
+    def get_description(attachment):
+        return {
+            "id": attachment.pk,
+            "size": attachment.size,
+            "offset": attachment.received,
+            "complete": attachment.is_complete,
+            "message_id": attachment.message_id,
+        }
+
+    def get(self, request, attachment_id):
+        attachment = self.get_attachment(request, attachment_id)
+        return self.send_response(
+            success=True,
+            code="200",
+            message="Upload retrieved successfully",
+            description=self.get_description(attachment),
+            status_code=status.HTTP_200_OK,
+        )
+
+    def patch(self, request, attachment_id):
+        attachment = self.get_attachment(request, attachment_id)
+        offset = request.headers.get("Upload-Offset", "")
+        length = request.headers.get("Content-Length", "")
+        if not offset.isdigit() or not length.isdigit():
+            raise ValidationError("Upload-Offset and Content-Length headers are required")
+        if int(length) > settings.ATTACHMENT_MAX_CHUNK_SIZE:
+            raise ValidationError(
+                f"Chunks can be at most {settings.ATTACHMENT_MAX_CHUNK_SIZE} bytes"
+            )
+        if int(offset) != attachment.received:
+            # Tells a client that lost track (e.g. a lost response) where to resume
+            return self.send_response(
+                success=False,
+                code="409",
+                message="Offset mismatch",
+                description=self.get_description(attachment),
+                status_code=status.HTTP_409_CONFLICT,
+            )
+        algorithm, _, chunk_sha256 = request.headers.get("Upload-Checksum", "").partition(" ")
+        if algorithm and algorithm.lower() != "sha256":
+            raise ValidationError("Only sha256 chunk checksums are supported")
+        attachment_chunk_write(
+            attachment=attachment,
+            offset=int(offset),
+            stream=request.stream,
+            length=int(length),
+            chunk_sha256=chunk_sha256.strip(),
+        )
+        return self.send_response(
+            success=True,
+            code="200",
+            message="Upload complete" if attachment.is_complete else "Chunk received",
+            description=self.get_description(attachment),
+            status_code=status.HTTP_200_OK,
+        )
+
+
+class AttachmentDownloadApi(BaseApiView):
+    """Streams a completed attachment to room members, honouring single byte ranges."""
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, attachment_id):
+        attachment = get_downloadable_attachment(user=request.user, attachment_id=attachment_id)
+        if attachment is None:
+            raise Http404("No attachment with this id exists")
+        etag = f'"{attachment.sha256}"'
+        start, end = 0, attachment.size - 1
+        range_header = request.headers.get("Range")
+        # A client resuming with a stale copy (If-Range mismatch) gets the whole file
+        if range_header and request.headers.get("If-Range", etag) == etag:
+            try:
+                byte_range = parse_range_header(range_header, attachment.size)
+            except ValueError:
+                response = StreamingHttpResponse(
+                    [], status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+                )
+                response["Content-Range"] = f"bytes */{attachment.size}"
+                return response
+            if byte_range is not None:
+                start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(
+            aiter_file_range(get_attachment_path(attachment.path), start, length),
+            content_type=attachment.content_type,
+        )
+        if length < attachment.size:
+            response.status_code = status.HTTP_206_PARTIAL_CONTENT
+            response["Content-Range"] = f"bytes {start}-{end}/{attachment.size}"
+        response["Content-Length"] = str(length)
+        response["Accept-Ranges"] = "bytes"
+        response["ETag"] = etag
+        response["Content-Disposition"] = content_disposition_header(
+            as_attachment=True, filename=attachment.file_name
+        )
+        patch_cache_control(response, private=True, max_age=3600)
+        return response
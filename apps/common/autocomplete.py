@@ -0,0 +1,202 @@
+import bisect
+import logging
+import threading
+import time
+import unicodedata
+from typing import Callable, Iterable
+
+from django.core.cache import cache
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """Case- and accent-insensitive form used for prefix matching ("Zoë" -> "zoe")."""
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+
+class PrefixIndex:
+    """
+    In-memory sorted array of normalized names for search-as-you-type.
+
+    Loaded on first search. Rows saved in this process are applied immediately; rows
+    inserted elsewhere are pulled by primary key every `sync_seconds`. Renames and
+    deletions call `changed(pk)`, which appends the pk to a change log in the shared
+    cache; every process reloads just those rows on its next sync. Every
+    `reload_seconds`, or when the log can't be replayed, the index is rebuilt in a
+    background thread to pick up changes made without signals (bulk updates, raw SQL, a
+    lost cache entry) while searches keep using the current arrays. When there are more
+    than `max_entries` rows the index stays unloaded and `search` returns None, telling
+    the caller to query the normalized database column instead.
+    """
+
+    sync_seconds = 5
+    reload_seconds = 600
+    # More changes than this since the last sync are cheaper to pick up with a reload
+    max_replayed_changes = 1000
+
+    def __init__(
+        self,
+        *,
+        name: str,
+        load_rows: Callable[[int], Iterable[tuple[int, str]]],
+        load_changed: Callable[[list[int]], Iterable[tuple[int, str]]],
+        count_rows: Callable[[], int],
+        max_entries: int,
+    ):
+        self.name = name
+        self.version_key = f"autocomplete:{name}:version"
+        self.load_rows = load_rows
+        self.load_changed = load_changed
+        self.count_rows = count_rows
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # "<normalized>\0<pk>" keys, sorted; pk -> (key, original text)
+        self._keys = None
+        self._entries = {}
+        self._last_pk = 0
+        # Last change log entry applied, and one found missing on the previous sync
+        self._version = 0
+        self._missing_version = None
+        self._synced_at = 0.0
+        self._reloaded_at = 0.0
+        self._reload_thread = None
+
+    @staticmethod
+    def _make_key(pk: int, text: str) -> str:
+        return f"{normalize_text(text)}\0{pk:020d}"
+
+    def _get_change_key(self, version: int) -> str:
+        return f"autocomplete:{self.name}:change:{version}"
+
+    def _insert(self, pk: int, text: str):
+        self._delete(pk)
+        key = self._make_key(pk, text)
+        bisect.insort(self._keys, key)
+        self._entries[pk] = (key, text)
+        self._last_pk = max(self._last_pk, pk)
+
+    def _delete(self, pk: int):
+        entry = self._entries.pop(pk, None)
+        if entry is not None:
+            position = bisect.bisect_left(self._keys, entry[0])
+            del self._keys[position]
+
+    def _build(self):
+        # Changes logged while the rows load are replayed after the swap
+        version = cache.get(self.version_key, 0)
+        if self.count_rows() > self.max_entries:
+            return version, None, {}, 0
+        entries = {pk: (self._make_key(pk, text), text) for pk, text in self.load_rows(0)}
+        keys = sorted(key for key, _ in entries.values())
+        return version, keys, entries, max(entries, default=0)
+
+    def _swap(self, version, keys, entries, last_pk):
+        self._version, self._keys, self._entries, self._last_pk = version, keys, entries, last_pk
+        self._missing_version = None
+        self._reloaded_at = time.monotonic()
+
+    def reload(self):
+        """Rebuilds the index without blocking searches, which see it once it's swapped in."""
+        built = self._build()
+        with self._lock:
+            self._swap(*built)
+
+    def _reload_in_thread(self):
+        try:
+            self.reload()
+        except Exception:
+            logger.exception("Could not reload the %s autocomplete index", self.name)
+        finally:
+            # The thread's own connections, nothing else would close them
+            connections.close_all()
+
+    def _start_reload(self):
+        if self._reload_thread is None or not self._reload_thread.is_alive():
+            self._reload_thread = threading.Thread(
+                target=self._reload_in_thread,
+                name=f"autocomplete-{self.name}-reload",
+                daemon=True,
+            )
+            self._reload_thread.start()
+
+    def _apply_changes(self, version: int):
+        if not self._version < version <= self._version + self.max_replayed_changes:
+            # Too far behind, or the version key was lost
+            self._start_reload()
+            return
+        versions = range(self._version + 1, version + 1)
+        logged = cache.get_many([self._get_change_key(number) for number in versions])
+        pks = []
+        for number in versions:
+            pk = logged.get(self._get_change_key(number))
+            if pk is None:
+                # `changed` bumps the version before it writes the entry, so it may just
+                # not be there yet; still missing on the next sync, it is lost
+                if self._missing_version == number:
+                    self._start_reload()
+                self._missing_version = number
+                break
+            pks.append(pk)
+            self._version = number
+        if pks:
+            current = dict(self.load_changed(pks))
+            for pk in pks:
+                if pk in current:
+                    self._insert(pk, current[pk])
+                else:
+                    self._delete(pk)
+
+    def _sync(self):
+        self._synced_at = time.monotonic()
+        if not self._reloaded_at:
+            self._swap(*self._build())
+            return
+        if self._synced_at - self._reloaded_at >= self.reload_seconds:
+            self._start_reload()
+        if self._keys is None:
+            return
+        version = cache.get(self.version_key, 0)
+        if version != self._version:
+            self._apply_changes(version)
+        for pk, text in self.load_rows(self._last_pk):
+            self._insert(pk, text)
+
+    def search(self, prefix: str, limit: int) -> list[tuple[int, str]] | None:
+        with self._lock:
+            if time.monotonic() - self._synced_at >= self.sync_seconds:
+                self._sync()
+            if self._keys is None:
+                return None
+            prefix = normalize_text(prefix)
+            results = []
+            position = bisect.bisect_left(self._keys, prefix)
+            while len(results) < limit and position < len(self._keys):
+                key = self._keys[position]
+                if not key.startswith(prefix):
+                    break
+                pk = int(key.rsplit("\0", 1)[1])
+                results.append((pk, self._entries[pk][1]))
+                position += 1
+            return results
+
+    def add(self, pk: int, text: str):
+        with self._lock:
+            if self._keys is not None:
+                self._insert(pk, text)
+
+    def remove(self, pk: int):
+        with self._lock:
+            if self._keys is not None:
+                self._delete(pk)
+
+    def changed(self, pk: int):
+        """Logs a renamed or removed row, which every process reloads on its next sync."""
+        if cache.add(self.version_key, 1, timeout=None):
+            version = 1
+        else:
+            version = cache.incr(self.version_key)
+        # Kept long enough for any process that syncs at all to see it
+        cache.set(self._get_change_key(version), pk, timeout=self.reload_seconds * 2)
@@ -0,0 +1,92 @@
+import abc
+import asyncio
+import logging
+
+from channels.db import database_sync_to_async
+
+logger = logging.getLogger(__name__)
+
+# Every buffer of the process, flushed together when a worker drains
+_buffers = []
+
+
+class WriteBehindBuffer(abc.ABC):
+    """
+    Per-process buffer of pending database writes, applied in one batch every
+    `interval` seconds after the first `add` instead of once per event.
+
+    Subclasses keep their pending data in `self.pending`, starting from `empty()`, call
+    `schedule()` after changing it, and implement `write(pending)`, which runs in a
+    worker thread, and `merge(pending)`, which folds a batch whose write failed back into
+    `self.pending` for the next round. After `max_failures` failed rounds in a row the
+    buffered data is dropped, so a batch that can never be written doesn't hold up the
+    rest forever. Whatever is still buffered when the process dies is lost, so
+    `flush_all()` is awaited before a worker stops.
+    """
+
+    max_failures = 5
+
+    def __init__(self, *, interval: float):
+        self.interval = interval
+        self.pending = self.empty()
+        self._failures = 0
+        self._flush_task = None
+        self._flush_lock = None
+        _buffers.append(self)
+
+    def empty(self):
+        return {}
+
+    @abc.abstractmethod
+    def write(self, pending):
+        """Writes a batch to the database, in a worker thread."""
+
+    @abc.abstractmethod
+    def merge(self, pending):
+        """Adds a batch that couldn't be written to `self.pending`."""
+
+    def schedule(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self):
+        # Data added while a flush is running is picked up by the next round
+        while self.pending:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def flush(self):
+        # A flush already writing is waited for, so `flush_all` returns after it
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            pending, self.pending = self.pending, self.empty()
+            if not pending:
+                return
+            try:
+                await database_sync_to_async(self.write)(pending)
+            except Exception:
+                self._failures += 1
+                if self._failures >= self.max_failures:
+                    logger.exception(
+                        "%s dropped %s pending entries after %s failed writes",
+                        type(self).__name__,
+                        len(pending),
+                        self._failures,
+                    )
+                    self._failures = 0
+                    return
+                logger.exception(
+                    "%s could not write %s pending entries, retrying",
+                    type(self).__name__,
+                    len(pending),
+                )
+                self.merge(pending)
+                self.schedule()
+            else:
+                self._failures = 0
+
+
+async def flush_all():
+    """Writes out every buffer of the process, e.g. before a worker stops."""
+    await asyncio.gather(*(buffer.flush() for buffer in _buffers))
@@ -1,5 +1,8 @@
 from abc import ABC, abstractmethod
 
+from django.core.paginator import Paginator
+from django.db import connections, router
+from django.utils.functional import cached_property
 from rest_framework import pagination
 
 
@@ -10,3 +13,47 @@ class CustomLimitOffsetPagination(ABC, pagination.LimitOffsetPagination):
     @abstractmethod
     def get_paginated_response(self, data):
         pass
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Admin paginator for very large tables. Unfiltered listings use the database's row
+    estimate instead of an exact COUNT(*), which would scan the whole table.
+    """
+
+    # Below this size an exact count is cheap and less surprising
+    exact_count_threshold = 10_000
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, "query", None)
+        if query is None or query.where:
+            return super().count
+        estimate = self.estimate_rows(self.object_list.model)
+        if estimate is None or estimate < self.exact_count_threshold:
+            return super().count
+        return estimate
+
+    @staticmethod
+    def estimate_rows(model):
+        table = model._meta.db_table
+        with connections[router.db_for_read(model)].cursor() as cursor:
+            vendor = cursor.db.vendor
+            if vendor == "postgresql":
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table]
+                )
+            elif vendor == "mysql":
+                cursor.execute(
+                    "SELECT table_rows FROM information_schema.tables "
+                    "WHERE table_schema = DATABASE() AND table_name = %s",
+                    [table],
+                )
+            else:
+                # Ids are rarely deleted, so the highest one is a good upper estimate
+                quote_name = cursor.db.ops.quote_name
+                cursor.execute(
+                    f"SELECT MAX({quote_name(model._meta.pk.column)}) FROM {quote_name(table)}"
+                )
+            row = cursor.fetchone()
+        return int(row[0]) if row and row[0] is not None else None
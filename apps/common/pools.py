@@ -0,0 +1,81 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from apps.core.exceptions import ServiceUnavailableError
+
+
+def _setup_django():
+    # Workers come from a forkserver, so they start with a clean interpreter.
+    import django
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+    django.setup(set_prefix=False)
+
+
+class BoundedProcessPool:
+    """
+    Process pool for CPU-bound work (password hashing, image resizing, ...) that keeps
+    the event loop and the thread pool free.
+
+    At most `max_pending` jobs may be running or queued at once. Past that `submit`
+    raises `ServiceUnavailableError` straight away, so a burst is shed with a 503
+    instead of piling up requests that would time out anyway.
+    The pool is created lazily, so every server worker process gets its own.
+    """
+
+    def __init__(self, *, max_workers: int, max_pending: int):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("forkserver"),
+                    initializer=_setup_django,
+                )
+            return self._executor
+
+    def _acquire(self):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                raise ServiceUnavailableError("Server is busy, Please try again shortly")
+            self.pending += 1
+
+    def _release(self, *args):
+        with self._lock:
+            self.pending -= 1
+
+    def submit(self, fn, *args):
+        self._acquire()
+        try:
+            future = self.executor.submit(fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    async def run(self, fn, *args):
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def map(self, fn, iterable, chunksize=1):
+        """
+        Blocking bulk helper for batch jobs (imports, backfills). It bypasses the pending
+        limit since the caller is not serving traffic.
+        """
+        return self.executor.map(fn, iterable, chunksize=chunksize)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
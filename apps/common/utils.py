@@ -26,3 +26,17 @@ def remove_extra_fields_from_validated_data(request_data: dict, serializer_data:
 def get_image_url_if_exists(image_field) -> str:
     # Check if the image exists, return URL if it does, otherwise return an empty string
     return BASE_BACKEND_URL + image_field.url if image_field else ""
+
+
+def delete_in_batches(queryset, batch_size: int = 1000) -> int:
+    """
+    Deletes the rows matched by `queryset` a batch of primary keys at a time, so each
+    DELETE holds its locks only briefly. Returns the number of rows deleted.
+    """
+    deleted = 0
+    while True:
+        pks = list(queryset.order_by().values_list("pk", flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        # Keeps the filter, so a row that stopped matching since the select is left alone
+        deleted += queryset.filter(pk__in=pks).delete()[1].get(queryset.model._meta.label, 0)
@@ -1,7 +1,16 @@
+import json
+
+from django.http import JsonResponse
+from django.utils.decorators import classonlymethod
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework import status
+from rest_framework.exceptions import ParseError
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from apps.core.exception_handlers import custom_exception_handler
+
 
 # Create your views here.
 class BaseApiView(APIView):
@@ -18,3 +27,57 @@ class BaseApiView(APIView):
             {"success": success, "code": code, "message": message, "description": description},
             status=status_code,
         )
+
+
+class BaseAsyncApiView(View):
+    """
+    Async counterpart of BaseApiView for endpoints that must not hold a worker thread.
+
+    DRF views can't be async, so this is a plain Django view: the request body is parsed
+    into `self.data` and errors go through the DRF exception handler, keeping the
+    response format identical to BaseApiView.
+    """
+
+    @classonlymethod
+    def as_view(cls, **initkwargs):
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            self.data = self.parse_request_data(request)
+            return await super().dispatch(request, *args, **kwargs)
+        except Exception as exc:
+            response = custom_exception_handler(exc, {"request": request, "view": self})
+            if response is None:
+                raise
+            headers = {
+                key: value
+                for key, value in response.headers.items()
+                if key.lower() != "content-type"
+            }
+            return JsonResponse(response.data, status=response.status_code, headers=headers)
+
+    @staticmethod
+    def parse_request_data(request) -> dict:
+        if request.content_type != "application/json":
+            return request.POST.dict()
+        if not request.body:
+            return {}
+        try:
+            return json.loads(request.body)
+        except ValueError as exc:
+            raise ParseError(f"JSON parse error - {exc}")
+
+    @classmethod
+    def send_response(
+        cls,
+        success=False,
+        code="",
+        message="",
+        description="",
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+    ):
+        return JsonResponse(
+            {"success": success, "code": code, "message": message, "description": description},
+            status=status_code,
+        )
@@ -1,7 +1,13 @@
 from channels.db import database_sync_to_async
 from django.contrib.auth.backends import ModelBackend
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
 
 from apps.users.models import User
+from apps.users.selectors import get_cached_user
 
 
 class CustomAuthBackend(ModelBackend):
@@ -24,9 +30,37 @@ class CustomAuthBackend(ModelBackend):
 
     def get_user(self, user_id):
         """
-        Overrides the get_user method to allow users to log in using their email address.
+        Overrides the get_user method to serve users from the shared user cache.
         """
+        user = get_cached_user(user_id=user_id)
+        return user if self.user_can_authenticate(user) else None
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    simplejwt's JWTAuthentication, with the user served from the shared user cache
+    instead of a query per request.
+    """
+
+    def get_user(self, validated_token):
         try:
-            return User.objects.get(pk=user_id)
-        except User.DoesNotExist:
-            return None
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        user = get_cached_user(user_id=user_id)
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(
+                user.password
+            ):
+                raise AuthenticationFailed(
+                    _("The user's password has been changed."), code="password_changed"
+                )
+
+        return user
@@ -6,7 +6,7 @@ from rest_framework import exceptions
 from rest_framework.serializers import as_serializer_error
 from rest_framework.views import exception_handler
 
-from apps.core.exceptions import ApplicationError, CustomIntegrityError
+from apps.core.exceptions import ApplicationError, CustomIntegrityError, ServiceUnavailableError
 
 
 def custom_exception_handler(exc, ctx):
@@ -55,6 +55,8 @@ def custom_exception_handler(exc, ctx):
         response.data["message"] = "Integrity Error"
     elif isinstance(exc, ApplicationError):
         response.data["message"] = "Application Error"
+    elif isinstance(exc, ServiceUnavailableError):
+        response.data["message"] = "Service Unavailable"
     else:
         response.data["message"] = "Other exception"
 
@@ -35,3 +35,12 @@ class CustomIntegrityError(APIException):
         if match:
             return match.group(2)
         return 'non_field_error'
+
+
+class ServiceUnavailableError(APIException):
+    def __init__(self, message, wait=1):
+        super().__init__(message)
+        # Picked up by DRF's exception handler as the Retry-After header
+        self.wait = wait
+
+    status_code = 503
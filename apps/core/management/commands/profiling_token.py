@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from apps.core.profiling import PROFILE_HEADER, create_profiling_token
+from config import settings
+
+
+class Command(BaseCommand):
+    help = "Prints a token that turns on profiling for the requests and sockets sending it."
+
+    def handle(self, *args, **options):
+        token = create_profiling_token()
+        self.stdout.write(token)
+        self.stderr.write(
+            f"Send it as the {PROFILE_HEADER} header or the _profile query parameter within "
+            f"{settings.PROFILING_TOKEN_MAX_AGE} seconds. Traces are written to "
+            f"{settings.PROFILING_DIR}."
+        )
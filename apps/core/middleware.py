@@ -0,0 +1,152 @@
+import logging
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from apps.core.profiling import PROFILE_HEADER, PROFILE_QUERY_PARAMETER, Trace, get_profile_reason
+from apps.core.queries import record_queries, report_queries
+from apps.core.routers import start_pin_scope
+
+DATABASE_PIN_COOKIE = "db_pin"
+
+logger = logging.getLogger(__name__)
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Records the queries of every request when QUERY_INSTRUMENTATION is on, logging the
+    count and total time, flagging repeated queries and reporting the count in an
+    X-Query-Count response header.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.QUERY_INSTRUMENTATION:
+            return self.get_response(request)
+        with record_queries(f"{request.method} {request.path}") as recorder:
+            response = self.get_response(request)
+        return self.finish(response, recorder)
+
+    async def __acall__(self, request):
+        if not settings.QUERY_INSTRUMENTATION:
+            return await self.get_response(request)
+        with record_queries(f"{request.method} {request.path}") as recorder:
+            response = await self.get_response(request)
+        return self.finish(response, recorder)
+
+    @staticmethod
+    def finish(response, recorder):
+        report_queries(recorder)
+        response["X-Query-Count"] = str(len(recorder))
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Profiles requests carrying a valid profiling token in the X-Profile header or the
+    `_profile` query parameter, and a random PROFILING_SAMPLE_RATE share of the rest.
+    Sync requests get a cProfile trace; async ones a stack-sampling trace, since their
+    work is spread over the event loop and worker threads. Requested traces are named
+    in an X-Profile-Trace response header.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    @staticmethod
+    def get_reason(request):
+        token = request.headers.get(PROFILE_HEADER) or request.GET.get(PROFILE_QUERY_PARAMETER)
+        return get_profile_reason(token)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        reason = self.get_reason(request)
+        if reason is None:
+            return self.get_response(request)
+        trace = Trace(f"{request.method} {request.path}", reason=reason)
+        with trace:
+            response = self.get_response(request)
+        try:
+            trace.save()
+        except OSError:
+            logger.exception("Could not save the profile of %s", trace.label)
+        return self.finish(response, trace)
+
+    async def __acall__(self, request):
+        reason = self.get_reason(request)
+        if reason is None:
+            return await self.get_response(request)
+        trace = Trace(f"{request.method} {request.path}", reason=reason, sampling=True)
+        with trace:
+            response = await self.get_response(request)
+        try:
+            await trace.asave()
+        except OSError:
+            logger.exception("Could not save the profile of %s", trace.label)
+        return self.finish(response, trace)
+
+    @staticmethod
+    def finish(response, trace):
+        if trace.reason == "requested" and trace.file_name:
+            response["X-Profile-Trace"] = trace.file_name
+        return response
+
+
+class DatabasePinningMiddleware:
+    """
+    Opens a read-your-writes scope for every request.
+
+    A request that writes gets a short-lived cookie back, so the client's follow-up
+    requests (e.g. reloading history right after sending) also read from the primary
+    until the replicas have caught up.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = start_pin_scope(pinned=DATABASE_PIN_COOKIE in request.COOKIES)
+        pinned_until = state.pinned_until
+        response = self.get_response(request)
+        self.set_pin_cookie(response, state, pinned_until)
+        return response
+
+    async def __acall__(self, request):
+        state = start_pin_scope(pinned=DATABASE_PIN_COOKIE in request.COOKIES)
+        pinned_until = state.pinned_until
+        response = await self.get_response(request)
+        self.set_pin_cookie(response, state, pinned_until)
+        return response
+
+    @staticmethod
+    def set_pin_cookie(response, state, pinned_until):
+        if state.pinned_until > pinned_until:
+            response.set_cookie(
+                DATABASE_PIN_COOKIE,
+                "1",
+                max_age=settings.DATABASE_PIN_SECONDS,
+                httponly=True,
+                samesite="Lax",
+            )
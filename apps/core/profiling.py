@@ -0,0 +1,230 @@
+import cProfile
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.utils.text import slugify
+
+logger = logging.getLogger("apps.core.profiling")
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_QUERY_PARAMETER = "_profile"
+INDEX_FILE_NAME = "index.jsonl"
+
+_SIGNING_SALT = "apps.core.profiling"
+# Innermost frames of threads waiting for work, left out of stack samples
+_IDLE_FRAMES = {
+    ("_worker", os.path.join("concurrent", "futures", "thread.py")),
+    ("wait", "threading.py"),
+}
+# cProfile can't nest and samplers are costly, so a process runs one trace at a time
+_trace_lock = threading.Lock()
+
+
+def create_profiling_token() -> str:
+    return signing.dumps("profile", salt=_SIGNING_SALT)
+
+
+def is_profiling_token_valid(token: str) -> bool:
+    try:
+        signing.loads(token, salt=_SIGNING_SALT, max_age=settings.PROFILING_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def get_profile_reason(token: str | None) -> str | None:
+    """
+    "requested" for a valid profiling token, "sampled" for the random PROFILING_SAMPLE_RATE
+    share of the rest, None (the common case, costing one comparison) otherwise.
+    """
+    if token and is_profiling_token_valid(token):
+        return "requested"
+    if settings.PROFILING_SAMPLE_RATE and random.random() < settings.PROFILING_SAMPLE_RATE:
+        return "sampled"
+    return None
+
+
+def get_scope_profiling_token(scope) -> str | None:
+    for name, value in scope.get("headers", ()):
+        if name == PROFILE_HEADER.lower().encode():
+            return value.decode("latin-1")
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    values = query.get(PROFILE_QUERY_PARAMETER)
+    return values[0] if values else None
+
+
+class StackSampler:
+    """
+    Samples the stacks of every other thread each `interval` seconds, for code that
+    spreads over the event loop and sync_to_async worker threads where cProfile, which
+    only sees the thread that enabled it, would miss most of the work. Which thread works
+    for which request can't be told, so the samples include whatever else the process
+    was doing meanwhile; the index entry says so with "threads": "all".
+    """
+
+    def __init__(self, *, interval: float):
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiling-sampler", daemon=True)
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        while not self._stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or self.is_idle(frame):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if thread_id not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    @staticmethod
+    def is_idle(frame) -> bool:
+        code = frame.f_code
+        return any(
+            code.co_name == name and code.co_filename.endswith(path) for name, path in _IDLE_FRAMES
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def dump_stats(self, path: Path):
+        # Collapsed stacks, the input format of flamegraph.pl and speedscope
+        with open(path, "w") as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{stack} {count}\n")
+
+
+class Trace:
+    """
+    Profiles the `with` block: with cProfile by default, or with a StackSampler when
+    `sampling` is set (async code). When another trace is already running in the process
+    the block runs unprofiled and `save` does nothing.
+    """
+
+    def __init__(self, label: str, *, reason: str, sampling: bool = False):
+        self.label = label
+        self.reason = reason
+        self.sampling = sampling
+        self.active = False
+        self.file_name = None
+        self._profiler = None
+
+    def __enter__(self):
+        self.active = _trace_lock.acquire(blocking=False)
+        if not self.active:
+            return self
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        if self.sampling:
+            self._profiler = StackSampler(interval=settings.PROFILING_SAMPLING_INTERVAL)
+            self._profiler.start()
+        else:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        if not self.active:
+            return
+        try:
+            if self.sampling:
+                self._profiler.stop()
+            else:
+                self._profiler.disable()
+            self.duration = time.perf_counter() - self._started
+        finally:
+            _trace_lock.release()
+
+    def save(self):
+        """Writes the trace to PROFILING_DIR, adds it to the index and rotates old ones."""
+        if not self.active:
+            return
+        directory = Path(settings.PROFILING_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime(self.started_at))
+        milliseconds = int(self.started_at * 1000) % 1000
+        extension = "txt" if self.sampling else "prof"
+        self.file_name = (
+            f"{stamp}.{milliseconds:03d}-{os.getpid()}-{slugify(self.label)[:60]}.{extension}"
+        )
+        self._profiler.dump_stats(directory / self.file_name)
+        entry = {
+            "file": self.file_name,
+            "label": self.label,
+            "reason": self.reason,
+            "format": "collapsed-stacks" if self.sampling else "pstats",
+            # Sampled traces also hold the other requests and events of the process
+            "threads": "all" if self.sampling else "current",
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 2),
+            "pid": os.getpid(),
+        }
+        # Short appends to an O_APPEND file don't interleave between processes
+        with open(directory / INDEX_FILE_NAME, "a") as index:
+            index.write(json.dumps(entry) + "\n")
+        rotate_traces(directory, keep=settings.PROFILING_MAX_FILES)
+
+    async def asave(self):
+        await sync_to_async(self.save, thread_sensitive=False)()
+
+
+def rotate_traces(directory: Path, *, keep: int):
+    # File names start with the UTC start time, so name order is age order
+    traces = sorted(path for path in directory.iterdir() if path.suffix in (".prof", ".txt"))
+    if len(traces) <= keep:
+        return
+    for path in traces[:-keep]:
+        path.unlink(missing_ok=True)
+    kept = {path.name for path in traces[-keep:]}
+    index_path = directory / INDEX_FILE_NAME
+    with open(index_path) as index:
+        lines = [line for line in index if json.loads(line)["file"] in kept]
+    temporary_path = index_path.with_suffix(f".{os.getpid()}.tmp")
+    with open(temporary_path, "w") as index:
+        index.writelines(lines)
+    os.replace(temporary_path, index_path)
+
+
+class ProfilingConsumerMixin:
+    """
+    Profiles consumer events: every event of a connection whose handshake carried a
+    valid profiling token, and a PROFILING_SAMPLE_RATE share of all others.
+    """
+
+    async def dispatch(self, message):
+        if not hasattr(self, "profiling_requested"):
+            token = get_scope_profiling_token(self.scope)
+            self.profiling_requested = bool(token) and is_profiling_token_valid(token)
+        reason = "requested" if self.profiling_requested else get_profile_reason(None)
+        if reason is None:
+            return await super().dispatch(message)
+        trace = Trace(f"{type(self).__name__} {message['type']}", reason=reason, sampling=True)
+        with trace:
+            await super().dispatch(message)
+        try:
+            await trace.asave()
+        except OSError:
+            logger.exception("Could not save the profile of %s", trace.label)
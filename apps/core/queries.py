@@ -0,0 +1,193 @@
+import logging
+import os
+import re
+import time
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from django.conf import settings
+
+logger = logging.getLogger("apps.core.queries")
+
+_current_recorder = ContextVar("query_recorder", default=None)
+# Recorders that see every query of the process, whichever task or thread runs it
+_process_recorders = []
+
+_THIS_FILE = os.path.abspath(__file__)
+
+# Literals and IN (...) lists are replaced so queries differing only in values match
+_FINGERPRINT_PATTERNS = [
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"\bIN \((?:\s*(?:\?|%s)\s*,?)+\)", re.IGNORECASE), "IN (...)"),
+    (re.compile(r"%s"), "?"),
+]
+
+
+def get_query_fingerprint(sql: str) -> str:
+    for pattern, replacement in _FINGERPRINT_PATTERNS:
+        sql = pattern.sub(replacement, sql)
+    return sql
+
+
+def get_call_site() -> str:
+    """The innermost stack frame in project code, outside Django and libraries."""
+    base_dir = str(settings.BASE_DIR)
+    for frame in reversed(traceback.extract_stack()):
+        filename = os.path.abspath(frame.filename)
+        if filename == _THIS_FILE or not filename.startswith(base_dir):
+            continue
+        if f"{os.sep}site-packages{os.sep}" in filename:
+            continue
+        return f"{os.path.relpath(filename, base_dir)}:{frame.lineno} in {frame.name}"
+    return "<unknown>"
+
+
+@dataclass
+class RecordedQuery:
+    alias: str
+    sql: str
+    duration: float
+    call_site: str
+
+    @property
+    def fingerprint(self) -> str:
+        return get_query_fingerprint(self.sql)
+
+
+@dataclass
+class QueryRecorder:
+    """Queries run while the recorder is active, from any thread working on its behalf."""
+
+    label: str
+    queries: list[RecordedQuery] = field(default_factory=list)
+    # Recorder active around this one, e.g. a test's around the request middleware's
+    parent: "QueryRecorder | None" = None
+    # Tasks started inside the block inherit the recorder but stop counting when it ends
+    closed: bool = False
+
+    def __len__(self):
+        return len(self.queries)
+
+    @property
+    def duration(self) -> float:
+        return sum(query.duration for query in self.queries)
+
+    def get_repeated_queries(self, threshold: int) -> list[tuple[str, str, int]]:
+        """(call site, fingerprint, count) of queries repeated at least `threshold` times."""
+        counts = Counter((query.call_site, query.fingerprint) for query in self.queries)
+        return [
+            (call_site, fingerprint, count)
+            for (call_site, fingerprint), count in counts.most_common()
+            if count >= threshold
+        ]
+
+    def format(self) -> str:
+        lines = [f"{len(self)} queries in {self.duration * 1000:.1f}ms for {self.label}"]
+        for number, query in enumerate(self.queries, start=1):
+            lines.append(
+                f"{number}. [{query.alias}] {query.duration * 1000:.2f}ms "
+                f"{query.call_site}\n   {query.sql}"
+            )
+        return "\n".join(lines)
+
+
+def _record_execution(execute, sql, params, many, context):
+    recorder = _current_recorder.get()
+    if (recorder is None or recorder.closed) and not _process_recorders:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        query = RecordedQuery(
+            alias=context["connection"].alias,
+            sql=sql,
+            duration=time.perf_counter() - started,
+            call_site=get_call_site(),
+        )
+        while recorder is not None and not recorder.closed:
+            recorder.queries.append(query)
+            recorder = recorder.parent
+        for recorder in _process_recorders:
+            recorder.queries.append(query)
+
+
+def install_query_recording(sender, connection, **kwargs):
+    """
+    `connection_created` receiver. The wrapper stays on the connection and only records
+    while a recorder is active in the calling context, which sync_to_async carries over
+    into worker threads; otherwise it costs one context variable lookup per query.
+    """
+    if _record_execution not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_execution)
+
+
+@contextmanager
+def record_queries(label: str):
+    recorder = QueryRecorder(label=label, parent=_current_recorder.get())
+    token = _current_recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        recorder.closed = True
+        _current_recorder.reset(token)
+
+
+def report_queries(recorder: QueryRecorder):
+    """Logs the query count of a request or event and flags likely N+1 patterns."""
+    logger.debug(
+        "%s queries in %.1fms for %s", len(recorder), recorder.duration * 1000, recorder.label
+    )
+    repeated = recorder.get_repeated_queries(settings.QUERY_REPEAT_THRESHOLD)
+    for call_site, fingerprint, count in repeated:
+        logger.warning(
+            "Possible N+1 in %s: %s runs the same query %s times: %s",
+            recorder.label,
+            call_site,
+            count,
+            fingerprint,
+        )
+
+
+@contextmanager
+def assert_max_queries(max_queries: int, label: str = "block"):
+    """
+    Test helper failing when the block runs more than `max_queries` queries or repeats a
+    query `QUERY_REPEAT_THRESHOLD` times from one call site. Unlike assertNumQueries it
+    counts the queries of every connection, thread and task while the block runs, e.g.
+    those of a consumer driven by a WebsocketCommunicator.
+    """
+    recorder = QueryRecorder(label=label)
+    _process_recorders.append(recorder)
+    try:
+        yield recorder
+    finally:
+        _process_recorders.remove(recorder)
+        recorder.closed = True
+    problems = []
+    if len(recorder) > max_queries:
+        problems.append(f"expected at most {max_queries} queries, got {len(recorder)}")
+    for call_site, fingerprint, count in recorder.get_repeated_queries(
+        settings.QUERY_REPEAT_THRESHOLD
+    ):
+        problems.append(f"{call_site} repeats {fingerprint!r} {count} times")
+    if problems:
+        raise AssertionError("; ".join(problems) + "\n" + recorder.format())
+
+
+class QueryInstrumentationConsumerMixin:
+    """
+    Channels consumer counterpart of QueryInstrumentationMiddleware: records and reports
+    the queries of each handled event (connect, receive, group message) separately.
+    """
+
+    async def dispatch(self, message):
+        if not settings.QUERY_INSTRUMENTATION:
+            return await super().dispatch(message)
+        with record_queries(f"{type(self).__name__} {message['type']}") as recorder:
+            await super().dispatch(message)
+        report_queries(recorder)
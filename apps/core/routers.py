@@ -0,0 +1,81 @@
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+
+PRIMARY_DATABASE = "default"
+
+_pin_state = ContextVar("db_pin_state", default=None)
+
+
+class PinState:
+    """
+    Read-your-writes state shared by everything running for one HTTP request or one
+    WebSocket connection.
+
+    The object is mutable on purpose: `database_sync_to_async` copies the context into a
+    worker thread, so a write done there has to be visible to the caller afterwards.
+    """
+
+    __slots__ = ("pinned_until",)
+
+    def __init__(self, pinned=False):
+        self.pinned_until = 0.0
+        if pinned:
+            self.pin()
+
+    def pin(self):
+        self.pinned_until = max(
+            self.pinned_until, time.monotonic() + settings.DATABASE_PIN_SECONDS
+        )
+
+    @property
+    def is_pinned(self) -> bool:
+        return time.monotonic() < self.pinned_until
+
+
+def start_pin_scope(*, pinned: bool = False) -> PinState:
+    """
+    Starts a new pinning scope in the current context and returns its state.
+    Call it once at the start of a request or a socket connection.
+    """
+    state = PinState(pinned=pinned)
+    _pin_state.set(state)
+    return state
+
+
+class PrimaryReplicaRouter:
+    """
+    Sends reads of the models listed in `DATABASE_REPLICA_MODELS` (chat history, room
+    lists, search and exports) to one of `DATABASE_REPLICAS`, everything else to the
+    primary.
+
+    Once the current request or socket has written anything, its reads stay on the
+    primary for `DATABASE_PIN_SECONDS` so users always see their own writes.
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if not replicas or model._meta.label_lower not in settings.DATABASE_REPLICA_MODELS:
+            return PRIMARY_DATABASE
+        state = _pin_state.get()
+        if state is not None and state.is_pinned:
+            return PRIMARY_DATABASE
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        state = _pin_state.get()
+        if state is not None:
+            state.pin()
+        return PRIMARY_DATABASE
+
+    def allow_relation(self, obj1, obj2, **hints):
+        pool = {PRIMARY_DATABASE, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive schema changes from the primary, never directly.
+        return db not in settings.DATABASE_REPLICAS
@@ -0,0 +1,218 @@
+import copy
+import json
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from apps.chat.models import ChatRoom
+from apps.core.middleware import DATABASE_PIN_COOKIE
+from apps.core.profiling import (
+    INDEX_FILE_NAME,
+    PROFILE_HEADER,
+    Trace,
+    create_profiling_token,
+    get_profile_reason,
+    is_profiling_token_valid,
+    rotate_traces,
+)
+from apps.core.routers import start_pin_scope
+from apps.users.models import User
+from apps.users.selectors import get_tokens_for_user
+
+# Tests run without a Redis server
+LOCAL_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+REPLICA = "replica"
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    DATABASE_REPLICAS=[REPLICA],
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"],
+)
+class PrimaryReplicaRouterTests(TestCase):
+    """
+    Runs against a second SQLite file standing in for a replica that hasn't caught up:
+    its chat rooms differ from the primary's.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        # Added here rather than in DATABASES, so the test runner leaves the alias alone
+        cls.databases = {"default", REPLICA}
+        cls.replica_directory = tempfile.TemporaryDirectory()
+        connections.settings[REPLICA] = {
+            **connections.settings["default"],
+            "NAME": str(Path(cls.replica_directory.name) / "replica.sqlite3"),
+        }
+        with connections[REPLICA].schema_editor() as editor:
+            editor.create_model(User)
+            editor.create_model(ChatRoom)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections[REPLICA].close()
+        del connections[REPLICA]
+        del connections.settings[REPLICA]
+        cls.replica_directory.cleanup()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("anna@example.com", "password", username="anna")
+        cls.other_user = User.objects.create_user("bob@example.com", "password", username="bob")
+        primary_room = ChatRoom.objects.using("default").create(name="General primary")
+        primary_room.users.add(cls.user)
+        for user in (cls.user, cls.other_user):
+            copy.copy(user).save(using=REPLICA, force_insert=True)
+        replica_room = ChatRoom.objects.using(REPLICA).create(name="General replica")
+        ChatRoom.users.through.objects.using(REPLICA).create(
+            chatroom_id=replica_room.pk, user_id=cls.user.pk
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def get_room_names(self):
+        return set(ChatRoom.objects.values_list("name", flat=True))
+
+    def test_reads_go_to_the_replica(self):
+        start_pin_scope()
+        self.assertEqual(self.get_room_names(), {"General replica"})
+        # Models not listed in DATABASE_REPLICA_MODELS stay on the primary
+        self.assertEqual(User.objects.count(), 2)
+
+    def test_writes_go_to_the_primary_and_pin_reads(self):
+        state = start_pin_scope()
+        ChatRoom.objects.create(name="Random")
+        self.assertTrue(ChatRoom.objects.using("default").filter(name="Random").exists())
+        self.assertFalse(ChatRoom.objects.using(REPLICA).filter(name="Random").exists())
+        self.assertEqual(self.get_room_names(), {"General primary", "Random"})
+        # Back on the replica once DATABASE_PIN_SECONDS have passed
+        with mock.patch("apps.core.routers.time.monotonic", return_value=state.pinned_until):
+            self.assertEqual(self.get_room_names(), {"General replica"})
+
+    async def test_socket_scope_sees_writes_made_in_worker_threads(self):
+        # What a consumer does: one scope per connection, queries run through sync_to_async
+        # (database_sync_to_async would also close the replica's connection mid-test)
+        start_pin_scope()
+        self.assertEqual(await sync_to_async(self.get_room_names)(), {"General replica"})
+        await sync_to_async(ChatRoom.objects.create)(name="Random")
+        self.assertEqual(
+            await sync_to_async(self.get_room_names)(), {"General primary", "Random"}
+        )
+
+    @staticmethod
+    def get_response_names(response):
+        return [room["name"] for room in response.json()["description"]]
+
+    def test_pin_cookie_carries_over_to_later_requests(self):
+        self.client.defaults["HTTP_AUTHORIZATION"] = (
+            f"Bearer {get_tokens_for_user(user=self.user)['access']}"
+        )
+        url = reverse("chat-room-autocomplete")
+        response = self.client.get(url, {"q": "gen"})
+        self.assertEqual(self.get_response_names(response), ["General replica"])
+        self.assertNotIn(DATABASE_PIN_COOKIE, response.cookies)
+
+        response = self.client.post(reverse("chat-direct-room"), {"user_id": self.other_user.pk})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            response.cookies[DATABASE_PIN_COOKIE]["max-age"], settings.DATABASE_PIN_SECONDS
+        )
+
+        # The test client sends the cookie back
+        response = self.client.get(url, {"q": "gen"})
+        self.assertEqual(self.get_response_names(response), ["General primary"])
+
+
+class ProfilingTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.enterContext(override_settings(PROFILING_DIR=self.directory))
+
+    def read_index(self):
+        with open(self.directory / INDEX_FILE_NAME) as index:
+            return [json.loads(line) for line in index]
+
+    def test_token_validation(self):
+        token = create_profiling_token()
+        self.assertTrue(is_profiling_token_valid(token))
+        self.assertFalse(is_profiling_token_valid(token[:-1]))
+        self.assertFalse(is_profiling_token_valid("profile"))
+        expired_at = time.time() + settings.PROFILING_TOKEN_MAX_AGE + 1
+        with mock.patch("django.core.signing.time.time", return_value=expired_at):
+            self.assertFalse(is_profiling_token_valid(token))
+
+    def test_sample_rate_gate(self):
+        self.assertEqual(get_profile_reason(create_profiling_token()), "requested")
+        with override_settings(PROFILING_SAMPLE_RATE=0):
+            self.assertIsNone(get_profile_reason(None))
+            self.assertIsNone(get_profile_reason("not a token"))
+        with override_settings(PROFILING_SAMPLE_RATE=0.5):
+            with mock.patch("apps.core.profiling.random.random", return_value=0.4):
+                self.assertEqual(get_profile_reason("not a token"), "sampled")
+            with mock.patch("apps.core.profiling.random.random", return_value=0.6):
+                self.assertIsNone(get_profile_reason(None))
+
+    def test_save_writes_the_trace_and_indexes_it(self):
+        with Trace("GET /api/users/", reason="requested") as trace:
+            sum(range(1000))
+        trace.save()
+        self.assertTrue(trace.file_name.endswith("-get-apiusers.prof"))
+        self.assertTrue((self.directory / trace.file_name).exists())
+        (entry,) = self.read_index()
+        self.assertEqual(entry["file"], trace.file_name)
+        self.assertEqual(
+            (entry["reason"], entry["format"], entry["threads"]),
+            ("requested", "pstats", "current"),
+        )
+
+    def test_sampled_trace_is_marked_as_covering_all_threads(self):
+        with Trace("ChatConsumer websocket.receive", reason="sampled", sampling=True) as trace:
+            time.sleep(0.01)
+        trace.save()
+        (entry,) = self.read_index()
+        self.assertEqual((entry["format"], entry["threads"]), ("collapsed-stacks", "all"))
+        self.assertTrue((self.directory / trace.file_name).exists())
+
+    def test_nested_trace_runs_unprofiled(self):
+        with Trace("outer", reason="requested") as outer:
+            with Trace("inner", reason="requested") as inner:
+                pass
+        self.assertTrue(outer.active)
+        self.assertFalse(inner.active)
+        inner.save()
+        self.assertFalse((self.directory / INDEX_FILE_NAME).exists())
+
+    def test_rotate_keeps_the_newest_traces(self):
+        names = [f"20260101T00000{second}.000-1-get.prof" for second in range(5)]
+        with open(self.directory / INDEX_FILE_NAME, "w") as index:
+            for name in names:
+                (self.directory / name).touch()
+                index.write(json.dumps({"file": name}) + "\n")
+        rotate_traces(self.directory, keep=2)
+        self.assertEqual(
+            sorted(path.name for path in self.directory.iterdir()), [*names[3:], INDEX_FILE_NAME]
+        )
+        self.assertEqual([entry["file"] for entry in self.read_index()], names[3:])
+
+    @override_settings(PROFILING_SAMPLE_RATE=0)
+    def test_requested_request_names_its_trace(self):
+        response = self.client.get("/admin/login/", headers={PROFILE_HEADER: "not a token"})
+        self.assertNotIn("X-Profile-Trace", response)
+        response = self.client.get(
+            "/admin/login/", headers={PROFILE_HEADER: create_profiling_token()}
+        )
+        self.assertTrue((self.directory / response["X-Profile-Trace"]).exists())
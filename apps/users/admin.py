@@ -1,8 +1,17 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import Group
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
 
-from apps.users.models import Profile, ResetPassword, User
+from apps.users.models import EmailOutbox, Profile, ResetPassword, User, UserImport
+from apps.users.services import user_import_queue
+
+
+class UserImportForm(forms.Form):
+    csv_file = forms.FileField(help_text="Columns: email, username, password")
 
 
 # Register your models here.
@@ -10,6 +19,7 @@ class CustomUserAdmin(UserAdmin):
     list_display = ("email",)
     search_fields = ("email",)
     ordering = ("-id",)
+    change_list_template = "admin/users/user/change_list.html"
 
     # fields defined in fieldset are shown in update user form
     fieldsets = (
@@ -50,9 +60,67 @@ class CustomUserAdmin(UserAdmin):
         ),
     )
 
+    def get_urls(self):
+        urls = [
+            path(
+                "import-csv/",
+                self.admin_site.admin_view(self.import_csv_view),
+                name="users_user_import_csv",
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def import_csv_view(self, request):
+        if not self.has_add_permission(request):
+            return redirect("admin:users_user_changelist")
+        form = UserImportForm(request.POST or None, request.FILES or None)
+        if request.method == "POST" and form.is_valid():
+            # Imported by `manage.py import_users --queued`, the progress shows on the import
+            user_import = user_import_queue(
+                csv_file=form.cleaned_data["csv_file"], requested_by=request.user
+            )
+            self.message_user(
+                request, f"{user_import.file_name} was queued for import", messages.SUCCESS
+            )
+            return redirect("admin:users_userimport_change", user_import.pk)
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "title": "Import users from CSV",
+            "form": form,
+        }
+        return TemplateResponse(request, "admin/users/user/import_csv.html", context)
+
 
 admin.site.unregister(Group)
 
 admin.site.register(User, CustomUserAdmin)
 admin.site.register(Profile)
 admin.site.register(ResetPassword)
+admin.site.register(EmailOutbox)
+
+
+@admin.register(UserImport)
+class UserImportAdmin(admin.ModelAdmin):
+    list_display = ("file_name", "status", "processed", "created", "conflict_count", "created_at")
+    list_filter = ("status",)
+    readonly_fields = (
+        "requested_by",
+        "file_name",
+        "processed",
+        "created",
+        "conflict_count",
+        "conflicts",
+        "error",
+        "created_at",
+        "updated_at",
+    )
+    fields = ("status", *readonly_fields)
+
+    def has_add_permission(self, request):
+        # Files are uploaded through the user import form
+        return False
+
+    @admin.display(description="conflicts")
+    def conflict_count(self, user_import):
+        return len(user_import.conflicts)
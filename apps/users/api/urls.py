@@ -2,6 +2,7 @@ from django.urls import path
 from rest_framework_simplejwt.views import TokenRefreshView
 
 from apps.users.api.views import (
+    UserAutocompleteApi,
     UserCreateApi,
     UserForgotPasswordApi,
     UserLoginApi,
@@ -27,4 +28,5 @@ urlpatterns = [
     # TODO: added profile url for testing to be refactored later
     path("profile/", UserProfileApi.as_view(), name="user-profile"),
     path("update-role/", UserRoleUpdateApi.as_view(), name="user-role-update"),
+    path("users/autocomplete/", UserAutocompleteApi.as_view(), name="user-autocomplete"),
 ]
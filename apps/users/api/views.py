@@ -1,27 +1,38 @@
+from asgiref.sync import sync_to_async
 from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
 from rest_framework import serializers, status
 from rest_framework.permissions import IsAuthenticated
 
 from apps.common.utils import get_unique_identifier_stamp
 from apps.common.validators import PasswordRegexValidator
-from apps.common.views import BaseApiView
-from apps.core.authentication import CustomAuthBackend
-from apps.users.models import Profile
-from apps.users.selectors import get_reset_password, get_tokens_for_user, get_user
+from apps.common.views import BaseApiView, BaseAsyncApiView
+from apps.users.models import EmailOutbox, Profile
+from apps.users.passwords import make_password_async
+from apps.users.selectors import (
+    aget_user,
+    get_profile_response_cache,
+    get_reset_password,
+    get_tokens_for_user,
+    get_user,
+    search_users,
+)
 from apps.users.services import (
+    RESET_PASSWORD_LINK_LIFETIME,
+    email_outbox_enqueue,
     user_blacklist_refresh_token,
-    user_check_password,
-    user_create,
-    user_profile_create,
+    user_check_password_async,
+    user_register,
     user_reset_password_create_or_update,
     user_reset_password_validation,
     user_update_profile_role,
 )
+from apps.users.thumbnails import get_thumbnail_urls
 from apps.users.utils import get_email_content_for_forgot_password
 from config import settings
 
 
-class UserCreateApi(BaseApiView):
+class UserCreateApi(BaseAsyncApiView):
     class InputSerializer(serializers.Serializer):
         email = serializers.EmailField(required=True, allow_blank=False, allow_null=False)
         password = serializers.CharField(
@@ -33,12 +44,13 @@ class UserCreateApi(BaseApiView):
         )
         username = serializers.CharField(required=True,allow_null=False, allow_blank=False)
 
-    def post(self, request):
-        serializer = self.InputSerializer(data=request.data)
+    async def post(self, request):
+        serializer = self.InputSerializer(data=self.data)
         serializer.is_valid(raise_exception=True)
-        with transaction.atomic():
-            user = user_create(**serializer.validated_data)
-            user_profile_create(user=user)
+        password_hash = await make_password_async(serializer.validated_data.pop("password"))
+        await sync_to_async(user_register)(
+            password_hash=password_hash, **serializer.validated_data
+        )
         return self.send_response(
             success=True,
             code="201",
@@ -47,20 +59,19 @@ class UserCreateApi(BaseApiView):
         )
 
 
-class UserLoginApi(BaseApiView):
-    custom_auth_backend = CustomAuthBackend
-
+class UserLoginApi(BaseAsyncApiView):
     class InputSerializer(serializers.Serializer):
         email = serializers.EmailField(required=True, allow_blank=False, allow_null=False)
         password = serializers.CharField(required=True, allow_blank=False, allow_null=False)
 
-    def post(self, request):
-        serializer = self.InputSerializer(data=request.data)
+    async def post(self, request):
+        serializer = self.InputSerializer(data=self.data)
         serializer.is_valid(raise_exception=True)
-        user = get_user(email=serializer.validated_data.get("email"))
-        user_check_password(user=user, password=serializer.validated_data.get("password"))
-        self.custom_auth_backend().authenticate(**serializer.validated_data)
-        tokens = get_tokens_for_user(user=user)
+        user = await aget_user(email=serializer.validated_data.get("email"))
+        await user_check_password_async(
+            user=user, password=serializer.validated_data.get("password")
+        )
+        tokens = await sync_to_async(get_tokens_for_user)(user=user)
         return self.send_response(
             success=True,
             code="200",
@@ -94,12 +105,19 @@ class UserForgotPasswordApi(BaseApiView):
         serializer.is_valid(raise_exception=True)
         user = get_user(email=serializer.validated_data.get("email"))
         unique_identifier = get_unique_identifier_stamp()
-        user_reset_password_create_or_update(unique_identifier=unique_identifier, user=user)
         reset_password_link = f"{settings.BASE_FRONTEND_URL}/reset-password/{unique_identifier}/"
         subject, message = get_email_content_for_forgot_password(
             user=user, reset_password_link=reset_password_link
         )
-        send_email(to=user.email, subject=subject, message=message)
+        with transaction.atomic():
+            user_reset_password_create_or_update(unique_identifier=unique_identifier, user=user)
+            email_outbox_enqueue(
+                user=user,
+                kind=EmailOutbox.KindChoices.RESET_PASSWORD,
+                subject=subject,
+                message=message,
+                dedup_window=RESET_PASSWORD_LINK_LIFETIME,
+            )
         return self.send_response(
             success=True,
             code="201",
@@ -151,20 +169,33 @@ class UserProfileApi(BaseApiView):
     permission_classes = [IsAuthenticated]
 
     class OutputSerializer(serializers.ModelSerializer):
+        thumbnails = serializers.SerializerMethodField()
+
         class Meta:
             model = Profile
             fields = "__all__"
 
+        def get_thumbnails(self, profile):
+            return get_thumbnail_urls(profile)
+
     def get(self, request):
-        user = request.user
-        serializer = self.OutputSerializer(user.profile)
-        return self.send_response(
-            success=True,
-            code="200",
-            message="Profile retrieved successfully",
-            description=serializer.data,
-            status_code=status.HTTP_200_OK,
+        profile = get_profile_response_cache(
+            user=request.user, serializer_class=self.OutputSerializer
         )
+        response = get_conditional_response(request, etag=profile["etag"])
+        if response is None:
+            response = self.send_response(
+                success=True,
+                code="200",
+                message="Profile retrieved successfully",
+                description=profile["data"],
+                status_code=status.HTTP_200_OK,
+            )
+        response["ETag"] = profile["etag"]
+        # Clients may keep the profile but must revalidate it on every launch
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ("Authorization",))
+        return response
 
 
 class UserRoleUpdateApi(BaseApiView):
@@ -184,3 +215,28 @@ class UserRoleUpdateApi(BaseApiView):
             description="Role updated successfully",
             status_code=status.HTTP_202_ACCEPTED,
         )
+
+
+class UserAutocompleteApi(BaseApiView):
+    permission_classes = [IsAuthenticated]
+
+    class FilterSerializer(serializers.Serializer):
+        q = serializers.CharField(min_length=1, max_length=255, trim_whitespace=True)
+        limit = serializers.IntegerField(min_value=1, max_value=50, default=10)
+
+    def get(self, request):
+        serializer = self.FilterSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        users = search_users(
+            prefix=serializer.validated_data["q"], limit=serializer.validated_data["limit"]
+        )
+        response = self.send_response(
+            success=True,
+            code="200",
+            message="Users retrieved successfully",
+            description=[{"id": pk, "username": username} for pk, username in users],
+            status_code=status.HTTP_200_OK,
+        )
+        # Lets clients reuse results when the user types back over a prefix
+        patch_cache_control(response, private=True, max_age=30)
+        return response
@@ -0,0 +1,130 @@
+import hashlib
+import math
+import threading
+import time
+
+from django.core.cache import cache
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+from config import settings
+
+
+class BloomFilter:
+    """
+    Fixed-size bloom filter over strings. Membership answers are either "definitely not
+    present" or "maybe present".
+    """
+
+    def __init__(self, *, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray(math.ceil(self.size / 8))
+        self.count = 0
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hash_count):
+            yield (first + i * second) % self.size
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key)
+        )
+
+
+class BlacklistFilter:
+    """
+    In-process front for `BlacklistedToken` lookups.
+
+    A bloom filter of blacklisted JTIs, built on first use, answers misses from memory;
+    hits are confirmed with a query. Tokens blacklisted in this process are added right
+    away, and `changed()` bumps a version in the shared cache for the others. The
+    version is read at most every `sync_seconds`; when it moved, or `max_age` seconds
+    after the last sync, the rows blacklisted since are pulled with a range read of the
+    primary key. One thread runs that read while other checks carry on with the filter
+    as it is.
+    """
+
+    min_capacity = 10_000
+    max_age = 60
+    version_key = "users:blacklist:version"
+
+    def __init__(self, *, sync_seconds: float):
+        self.sync_seconds = sync_seconds
+        # Serializes syncs; checks never wait on it once the filter is built
+        self._lock = threading.Lock()
+        self._bloom = None
+        self._last_id = 0
+        self._version = None
+        self._checked_at = 0.0
+        self._synced_at = 0.0
+
+    def _rebuild(self):
+        count = BlacklistedToken.objects.count()
+        bloom = BloomFilter(
+            capacity=max(self.min_capacity, count * 2),
+            error_rate=settings.BLACKLIST_FILTER_ERROR_RATE,
+        )
+        last_id = 0
+        rows = BlacklistedToken.objects.order_by().values_list("id", "token__jti")
+        for pk, jti in rows.iterator(chunk_size=5000):
+            bloom.add(jti)
+            last_id = max(last_id, pk)
+        self._bloom, self._last_id = bloom, last_id
+
+    def _sync(self, now: float):
+        self._checked_at = now
+        # Read before the rows, so rows committed before a bump are always pulled
+        version = cache.get(self.version_key, 0)
+        if self._bloom is not None and version == self._version:
+            if now - self._synced_at < self.max_age:
+                return
+        self._version, self._synced_at = version, now
+        if self._bloom is None or self._bloom.count >= self._bloom.capacity:
+            self._rebuild()
+            return
+        rows = BlacklistedToken.objects.filter(id__gt=self._last_id).values_list(
+            "id", "token__jti"
+        )
+        for pk, jti in rows:
+            self._bloom.add(jti)
+            self._last_id = max(self._last_id, pk)
+
+    def might_contain(self, jti: str) -> bool:
+        now = time.monotonic()
+        if self._bloom is None:
+            with self._lock:
+                if self._bloom is None:
+                    self._sync(now)
+        elif now - self._checked_at >= self.sync_seconds and self._lock.acquire(blocking=False):
+            try:
+                self._sync(now)
+            finally:
+                self._lock.release()
+        return jti in self._bloom
+
+    def add(self, jti: str):
+        bloom = self._bloom
+        if bloom is not None:
+            bloom.add(jti)
+
+    def changed(self):
+        """Makes every process pull new blacklist rows on its next version check."""
+        if not cache.add(self.version_key, 1, timeout=None):
+            cache.incr(self.version_key)
+
+    def is_blacklisted(self, jti: str) -> bool:
+        if not self.might_contain(jti):
+            return False
+        return BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+
+blacklist_filter = BlacklistFilter(sync_seconds=settings.BLACKLIST_FILTER_SYNC_SECONDS)
@@ -0,0 +1,76 @@
+import asyncio
+import statistics
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient
+from django.urls import reverse
+
+from apps.users.models import User
+from apps.users.services import user_create, user_profile_create
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures login throughput by firing concurrent requests at the login API "
+        "in-process. Creates a throwaway user and deletes it afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=32)
+
+    def handle(self, *args, **options):
+        email = f"benchmark-{uuid.uuid4().hex[:12]}@example.com"
+        password = "Benchmark123"
+        user = user_create(username=email, email=email, password=password)
+        user_profile_create(user=user)
+        try:
+            results = asyncio.run(
+                self.run_benchmark(
+                    email=email,
+                    password=password,
+                    total=options["requests"],
+                    concurrency=options["concurrency"],
+                )
+            )
+        finally:
+            User.objects.filter(pk=user.pk).delete()
+        self.report(results)
+
+    async def run_benchmark(self, *, email, password, total, concurrency):
+        client = AsyncClient()
+        url = reverse("user-login")
+        semaphore = asyncio.Semaphore(concurrency)
+        payload = {"email": email, "password": password}
+
+        async def login():
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post(url, payload, content_type="application/json")
+                return response.status_code, time.perf_counter() - started
+
+        # Warm the hasher pool so process start-up isn't part of the measurement
+        await login()
+        started = time.perf_counter()
+        responses = await asyncio.gather(*(login() for _ in range(total)))
+        elapsed = time.perf_counter() - started
+        return responses, elapsed
+
+    def report(self, results):
+        responses, elapsed = results
+        latencies = sorted(latency for code, latency in responses if code == 200)
+        shed = sum(1 for code, _ in responses if code == 503)
+        failed = len(responses) - len(latencies) - shed
+        self.stdout.write(f"requests:   {len(responses)} in {elapsed:.2f}s")
+        self.stdout.write(f"throughput: {len(latencies) / elapsed:.1f} logins/s")
+        if latencies:
+            p95 = latencies[int(len(latencies) * 0.95) - 1]
+            self.stdout.write(
+                f"latency:    p50 {statistics.median(latencies) * 1000:.1f}ms, "
+                f"p95 {p95 * 1000:.1f}ms"
+            )
+        self.stdout.write(f"shed (503): {shed}")
+        if failed:
+            self.stdout.write(self.style.WARNING(f"failed:     {failed}"))
@@ -0,0 +1,72 @@
+import csv
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.users.services import user_bulk_import, user_import_run_next
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk-creates users and profiles from a CSV file with email, username and "
+        "password columns, or with --queued from the files uploaded in the admin. "
+        "Conflicting rows are reported and skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("csv_file", nargs="?", help="Path to the CSV file")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--workers", type=int, help="Hashing processes, defaults to all cores")
+        parser.add_argument(
+            "--queued", action="store_true", help="Import the files queued in the admin"
+        )
+        parser.add_argument("--loop", action="store_true", help="Keep polling for new files")
+        parser.add_argument("--interval", type=float, default=5.0, help="Seconds between polls")
+
+    def handle(self, *args, **options):
+        if options["queued"]:
+            self.import_queued(options)
+        elif options["csv_file"]:
+            self.import_file(options)
+        else:
+            raise CommandError("Pass a CSV file or --queued")
+
+    def import_file(self, options):
+        with open(options["csv_file"], newline="", encoding="utf-8") as file:
+            result = user_bulk_import(
+                rows=csv.DictReader(file),
+                batch_size=options["batch_size"],
+                workers=options["workers"],
+                on_progress=self.report_progress,
+            )
+        for line, reason in result.conflicts:
+            self.stdout.write(self.style.WARNING(f"line {line}: {reason}"))
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {result.created} of {result.processed} rows in "
+                f"{result.elapsed:.1f}s ({result.rate:.0f} rows/s), "
+                f"{len(result.conflicts)} conflicts"
+            )
+        )
+
+    def import_queued(self, options):
+        while True:
+            user_import = user_import_run_next(
+                batch_size=options["batch_size"], workers=options["workers"]
+            )
+            if user_import is not None:
+                self.stdout.write(
+                    f"{user_import.file_name}: {user_import.status}, imported "
+                    f"{user_import.created} of {user_import.processed} rows, "
+                    f"{len(user_import.conflicts)} conflicts"
+                )
+                continue
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
+
+    def report_progress(self, result):
+        self.stdout.write(
+            f"{result.processed} rows processed, {result.created} created, "
+            f"{len(result.conflicts)} conflicts, {result.rate:.0f} rows/s"
+        )
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from apps.common.utils import delete_in_batches
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes expired outstanding and blacklisted refresh tokens in small batches. "
+        "Safe to run periodically (e.g. from cron)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        now = timezone.now()
+        blacklisted = delete_in_batches(
+            BlacklistedToken.objects.filter(token__expires_at__lte=now),
+            batch_size=options["batch_size"],
+        )
+        outstanding = delete_in_batches(
+            OutstandingToken.objects.filter(expires_at__lte=now),
+            batch_size=options["batch_size"],
+        )
+        self.stdout.write(
+            f"Purged {outstanding} outstanding and {blacklisted} blacklisted tokens "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
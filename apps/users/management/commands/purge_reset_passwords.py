@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.common.utils import delete_in_batches
+from apps.users.models import ResetPassword
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes expired and already used password-reset tokens in small batches. "
+        "Safe to run periodically (e.g. from cron)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        purged = delete_in_batches(
+            ResetPassword.objects.filter(expires_at__lte=timezone.now()),
+            batch_size=options["batch_size"],
+        )
+        # Only unexpired rows are left at this point, so this scan stays small
+        purged += delete_in_batches(
+            ResetPassword.objects.filter(is_blacklisted=True),
+            batch_size=options["batch_size"],
+        )
+        self.stdout.write(
+            f"Purged {purged} reset password tokens in {time.perf_counter() - started:.2f}s"
+        )
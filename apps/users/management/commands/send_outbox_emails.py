@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.users.services import email_outbox_send_batch
+from config import settings
+
+
+class Command(BaseCommand):
+    help = "Delivers pending emails from the outbox, once or continuously with --loop."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=settings.EMAIL_OUTBOX_BATCH_SIZE)
+        parser.add_argument("--loop", action="store_true", help="Keep polling for new emails")
+        parser.add_argument("--interval", type=float, default=2.0, help="Seconds between polls")
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = email_outbox_send_batch(batch_size=options["batch_size"])
+            if sent or failed:
+                self.stdout.write(f"Sent {sent} emails, {failed} failed")
+            # Drain back-to-back while there is a backlog, poll otherwise
+            if sent + failed >= options["batch_size"]:
+                continue
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
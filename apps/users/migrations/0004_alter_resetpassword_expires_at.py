@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-19 01:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_emailoutbox'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='resetpassword',
+            name='expires_at',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
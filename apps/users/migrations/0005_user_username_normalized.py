@@ -0,0 +1,36 @@
+# Generated by Django 5.1.4 on 2026-10-19 02:05
+
+from django.db import migrations, models
+
+from apps.common.autocomplete import normalize_text
+
+BATCH_SIZE = 1000
+
+
+def fill_username_normalized(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    batch = []
+    for user in User.objects.only('pk', 'username').iterator(chunk_size=BATCH_SIZE):
+        user.username_normalized = normalize_text(user.username)
+        batch.append(user)
+        if len(batch) >= BATCH_SIZE:
+            User.objects.bulk_update(batch, ['username_normalized'])
+            batch = []
+    User.objects.bulk_update(batch, ['username_normalized'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_alter_resetpassword_expires_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='username_normalized',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_username_normalized, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-19 01:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_user_username_normalized'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='emailoutbox',
+            name='kind',
+            field=models.CharField(choices=[('reset_password', 'reset_password'), ('chat_digest', 'chat_digest')], max_length=50),
+        ),
+    ]
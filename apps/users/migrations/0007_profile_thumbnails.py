@@ -0,0 +1,43 @@
+# Generated by Django 5.1.4 on 2026-10-19 02:36
+
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+
+from apps.users.thumbnails import get_thumbnail_name
+from config import settings
+
+BATCH_SIZE = 500
+
+
+def record_existing_thumbnails(apps, schema_editor):
+    # Thumbnails generated before they were recorded are looked up in the storage once
+    Profile = apps.get_model('users', 'Profile')
+    profiles = Profile.objects.exclude(image='').exclude(image__isnull=True).only('pk', 'image')
+    changed = []
+    for profile in profiles.iterator(chunk_size=BATCH_SIZE):
+        for size in settings.PROFILE_THUMBNAIL_SIZES:
+            thumbnail_name = get_thumbnail_name(profile.image.name, size)
+            if default_storage.exists(thumbnail_name):
+                profile.thumbnails[str(size)] = thumbnail_name
+        if profile.thumbnails:
+            changed.append(profile)
+        if len(changed) >= BATCH_SIZE:
+            Profile.objects.bulk_update(changed, ['thumbnails'])
+            changed = []
+    Profile.objects.bulk_update(changed, ['thumbnails'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_alter_emailoutbox_kind'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='thumbnails',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.RunPython(record_existing_thumbnails, migrations.RunPython.noop),
+    ]
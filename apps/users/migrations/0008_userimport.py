@@ -0,0 +1,34 @@
+# Generated by Django 5.1.4 on 2026-10-19 02:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_profile_thumbnails'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserImport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('file_name', models.CharField(max_length=255)),
+                ('path', models.CharField(editable=False, max_length=255, unique=True)),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')], default='pending', max_length=20)),
+                ('processed', models.PositiveIntegerField(default=0)),
+                ('created', models.PositiveIntegerField(default=0)),
+                ('conflicts', models.JSONField(blank=True, default=list)),
+                ('error', models.TextField(blank=True, default='')),
+                ('requested_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at'], name='users_useri_status_48fc97_idx')],
+            },
+        ),
+    ]
@@ -3,7 +3,10 @@ from functools import partial
 from django.contrib.auth.base_user import AbstractBaseUser
 from django.contrib.auth.models import PermissionsMixin
 from django.db import models
+from django.utils import timezone
 
+from apps.common.autocomplete import normalize_text
+from apps.common.models import Log
 from apps.common.utils import user_directory_path
 from apps.users.managers import MyUserManager
 from config import settings
@@ -15,6 +18,8 @@ class User(AbstractBaseUser, PermissionsMixin):
         verbose_name="email address", max_length=255, unique=True, null=False, blank=False
     )
     username = models.CharField(max_length=255, unique=True, null=False, blank=False)
+    # Lowercased, accent-free username for indexed prefix search, kept in sync on save
+    username_normalized = models.CharField(max_length=255, db_index=True, editable=False)
     is_staff = models.BooleanField(default=False)
     is_active = models.BooleanField(default=True)
 
@@ -25,12 +30,19 @@ class User(AbstractBaseUser, PermissionsMixin):
     def __str__(self):
         return self.email
 
+    def save(self, *args, **kwargs):
+        self.username_normalized = normalize_text(self.username)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "username" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "username_normalized"}
+        super().save(*args, **kwargs)
+
 
 class ResetPassword(models.Model):
     token = models.CharField(max_length=255, unique=True, null=False, blank=False)
     is_blacklisted = models.BooleanField(default=False)
     created_or_updated_at = models.DateTimeField(null=False, blank=False)
-    expires_at = models.DateTimeField(null=False, blank=False)
+    expires_at = models.DateTimeField(null=False, blank=False, db_index=True)
     user = models.OneToOneField(
         to=settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
@@ -50,6 +62,8 @@ class Profile(models.Model):
 
     user_directory_profile_path = partial(user_directory_path, folder_name="profile")
     image = models.ImageField(upload_to=user_directory_profile_path, null=True, blank=True)
+    # Size -> storage name of the thumbnails generated for `image`, see apps.users.thumbnails
+    thumbnails = models.JSONField(default=dict, blank=True, editable=False)
     phone_number = models.CharField(max_length=50, null=True, blank=True)
     user = models.OneToOneField(
         to=settings.AUTH_USER_MODEL,
@@ -68,3 +82,82 @@ class Profile(models.Model):
 
     def __str__(self):
         return str(self.role)
+
+
+class EmailOutbox(Log):
+    """
+    Emails waiting to be delivered by the `send_outbox_emails` worker, so API requests
+    never wait on SMTP.
+    """
+
+    class KindChoices(models.TextChoices):
+        RESET_PASSWORD = ("reset_password", "reset_password")
+        CHAT_DIGEST = ("chat_digest", "chat_digest")
+
+    class StatusChoices(models.TextChoices):
+        PENDING = ("pending", "pending")
+        SENT = ("sent", "sent")
+        FAILED = ("failed", "failed")
+
+    user = models.ForeignKey(
+        to=settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        null=False,
+        blank=False,
+        related_name="outbox_emails",
+    )
+    kind = models.CharField(max_length=50, choices=KindChoices.choices)
+    to = models.EmailField(max_length=255)
+    subject = models.CharField(max_length=255)
+    message = models.TextField()
+    status = models.CharField(
+        max_length=20, choices=StatusChoices.choices, default=StatusChoices.PENDING
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default="")
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "next_attempt_at"])]
+
+    def __str__(self):
+        return f"{self.kind} to {self.to} ({self.status})"
+
+
+class UserImport(Log):
+    """
+    A CSV file uploaded in the admin, imported by `manage.py import_users --queued`, which
+    keeps the counts up to date while it runs.
+    """
+
+    class StatusChoices(models.TextChoices):
+        PENDING = ("pending", "pending")
+        RUNNING = ("running", "running")
+        DONE = ("done", "done")
+        FAILED = ("failed", "failed")
+
+    requested_by = models.ForeignKey(
+        to=settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    file_name = models.CharField(max_length=255)
+    # Relative to USER_IMPORT_ROOT, deleted once the import has run
+    path = models.CharField(max_length=255, unique=True, editable=False)
+    status = models.CharField(
+        max_length=20, choices=StatusChoices.choices, default=StatusChoices.PENDING
+    )
+    processed = models.PositiveIntegerField(default=0)
+    created = models.PositiveIntegerField(default=0)
+    # [line, reason] of every skipped row
+    conflicts = models.JSONField(default=list, blank=True)
+    error = models.TextField(blank=True, default="")
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "created_at"])]
+
+    def __str__(self):
+        return self.file_name
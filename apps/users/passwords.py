@@ -0,0 +1,17 @@
+from django.contrib.auth.hashers import check_password, make_password
+
+from apps.common.pools import BoundedProcessPool
+from config import settings
+
+password_hasher_pool = BoundedProcessPool(
+    max_workers=settings.PASSWORD_HASHER_WORKERS,
+    max_pending=settings.PASSWORD_HASHER_MAX_PENDING,
+)
+
+
+async def make_password_async(password: str) -> str:
+    return await password_hasher_pool.run(make_password, password)
+
+
+async def check_password_async(password: str, encoded: str) -> bool:
+    return await password_hasher_pool.run(check_password, password, encoded)
@@ -1,9 +1,15 @@
+import hashlib
+import json
 from logging import exception
 
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
 from django.http import Http404
-from rest_framework_simplejwt.tokens import RefreshToken
 
+from apps.common.autocomplete import PrefixIndex, normalize_text
 from apps.users.models import ResetPassword, User
+from apps.users.tokens import RefreshToken
+from config import settings
 
 
 def get_user(*, email: str) -> User:
@@ -13,6 +19,13 @@ def get_user(*, email: str) -> User:
         raise Http404("No user with this email exists")
 
 
+async def aget_user(*, email: str) -> User:
+    try:
+        return await User.objects.aget(email=email)
+    except User.DoesNotExist:
+        raise Http404("No user with this email exists")
+
+
 def get_tokens_for_user(*, user):
     refresh = RefreshToken.for_user(user)
 
@@ -32,4 +45,77 @@ def get_user_from_id(user_id : int) -> User:
     try:
         return User.objects.get(id = user_id)
     except Exception as err:
-        print("error is : ",str(err))
\ No newline at end of file
+        print("error is : ",str(err))
+
+def get_user_cache_key(*, user_id) -> str:
+    # Bump USER_CACHE_VERSION when the User model changes so stale pickles are ignored
+    return f"users:user:v{settings.USER_CACHE_VERSION}:{user_id}"
+
+
+def get_cached_user(*, user_id) -> User | None:
+    """
+    Returns the user with `user_id` from the shared cache, loading it on a miss.
+    Entries are dropped whenever the user is saved or deleted, and expire after
+    `USER_CACHE_SECONDS` regardless, covering bulk updates that skip signals.
+    """
+    key = get_user_cache_key(user_id=user_id)
+    user = cache.get(key)
+    if user is None:
+        try:
+            user = User.objects.get(pk=user_id)
+        except (User.DoesNotExist, ValueError, TypeError):
+            return None
+        cache.set(key, user, settings.USER_CACHE_SECONDS)
+    return user
+
+
+def get_profile_cache_key(*, user_id: int) -> str:
+    return f"users:profile:{user_id}"
+
+
+def get_profile_response_cache(*, user: User, serializer_class) -> dict:
+    """
+    Returns the serialized profile of `user` with its ETag, serializing and caching it
+    on a miss. Entries are dropped whenever the user or the profile is saved. Neither of
+    them records when it changed, so clients revalidate with the ETag alone.
+    """
+    key = get_profile_cache_key(user_id=user.pk)
+    cached = cache.get(key)
+    if cached is None:
+        data = serializer_class(user.profile).data
+        encoded = json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder).encode()
+        cached = {
+            "data": data,
+            "etag": f'"{hashlib.md5(encoded).hexdigest()}"',
+        }
+        cache.set(key, cached, settings.PROFILE_CACHE_SECONDS)
+    return cached
+
+
+def _load_usernames(after_pk: int):
+    users = User.objects.filter(is_active=True, pk__gt=after_pk).order_by()
+    return users.values_list("pk", "username").iterator(chunk_size=5000)
+
+
+def _load_changed_usernames(pks: list[int]):
+    return User.objects.filter(is_active=True, pk__in=pks).values_list("pk", "username")
+
+
+user_autocomplete_index = PrefixIndex(
+    name="users",
+    load_rows=_load_usernames,
+    load_changed=_load_changed_usernames,
+    count_rows=User.objects.filter(is_active=True).count,
+    max_entries=settings.AUTOCOMPLETE_MAX_ENTRIES,
+)
+
+
+def search_users(*, prefix: str, limit: int) -> list[tuple[int, str]]:
+    """(id, username) of active users whose username starts with `prefix`."""
+    results = user_autocomplete_index.search(prefix, limit)
+    if results is None:
+        users = User.objects.filter(
+            is_active=True, username_normalized__startswith=normalize_text(prefix)
+        ).order_by("username_normalized", "pk")
+        results = list(users.values_list("pk", "username")[:limit])
+    return results
@@ -1,17 +1,43 @@
+import csv
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
 from datetime import timedelta
+from itertools import islice
+from pathlib import Path
+from typing import Callable, Iterable
 
+from django.core.cache import cache
+from django.contrib.auth.hashers import make_password
+from django.core.mail import EmailMessage, get_connection
+from django.db import IntegrityError, transaction
 from django.utils import timezone
 from rest_framework.exceptions import ValidationError
 from rest_framework_simplejwt.exceptions import TokenError
-from rest_framework_simplejwt.tokens import RefreshToken
 
+from apps.common.autocomplete import normalize_text
+from apps.common.pools import BoundedProcessPool
 from apps.core.exceptions import ApplicationError
-from apps.users.models import Profile, ResetPassword, User
+from apps.users.models import EmailOutbox, Profile, ResetPassword, User, UserImport
+from apps.users.passwords import check_password_async
+from apps.users.selectors import get_profile_cache_key, get_user_cache_key
+from apps.users.tokens import RefreshToken
+from config import settings
 
+logger = logging.getLogger(__name__)
 
-def user_create(*,username:str, email: str, password: str) -> User:
+RESET_PASSWORD_LINK_LIFETIME = timedelta(minutes=30)
+
+
+def user_create(
+    *, username: str, email: str, password: str, password_hashed: bool = False
+) -> User:
     user = User(email=email,username= username)
-    user.set_password(password)
+    if password_hashed:
+        user.password = password
+    else:
+        user.set_password(password)
     user.save()
     return user
 
@@ -20,11 +46,25 @@ def user_profile_create(*, user: User):
     Profile.objects.create(user=user)
 
 
+def user_register(*, username: str, email: str, password_hash: str) -> User:
+    with transaction.atomic():
+        user = user_create(
+            username=username, email=email, password=password_hash, password_hashed=True
+        )
+        user_profile_create(user=user)
+    return user
+
+
 def user_check_password(*, user: User, password: str):
     if not user.check_password(password):
         raise ValidationError({"password": "Incorrect password for this account"})
 
 
+async def user_check_password_async(*, user: User, password: str):
+    if not await check_password_async(password, user.password):
+        raise ValidationError({"password": "Incorrect password for this account"})
+
+
 def user_blacklist_refresh_token(*, refresh: RefreshToken):
     try:
         token = RefreshToken(refresh)
@@ -37,7 +77,7 @@ def user_reset_password_create_or_update(*, unique_identifier: str, user: User):
     defaults = {
         "token": unique_identifier,
         "created_or_updated_at": timezone.now(),
-        "expires_at": timezone.now() + timedelta(minutes=30),
+        "expires_at": timezone.now() + RESET_PASSWORD_LINK_LIFETIME,
         "user": user,
         "is_blacklisted": False,
     }
@@ -58,3 +98,307 @@ def user_reset_password_validation(*, reset_password: ResetPassword):
 def user_update_profile_role(*, user: User, role: str):
     user.profile.role = role
     user.profile.save()
+
+
+def user_profile_cache_invalidate(*, user_id: int):
+    cache.delete(get_profile_cache_key(user_id=user_id))
+
+
+def user_cache_invalidate(*, user_id: int):
+    cache.delete(get_user_cache_key(user_id=user_id))
+
+
+def email_outbox_enqueue(
+    *, user: User, kind: str, subject: str, message: str, dedup_window: timedelta
+) -> EmailOutbox:
+    """
+    Queues an email for the outbox worker. A pending email of the same kind queued for
+    the user within `dedup_window` is replaced instead, so repeated requests collapse
+    into one email carrying the latest content.
+    """
+    with transaction.atomic():
+        pending = (
+            EmailOutbox.objects.select_for_update()
+            .filter(
+                user=user,
+                kind=kind,
+                status=EmailOutbox.StatusChoices.PENDING,
+                created_at__gte=timezone.now() - dedup_window,
+            )
+            .first()
+        )
+        if pending is None:
+            return EmailOutbox.objects.create(
+                user=user, kind=kind, to=user.email, subject=subject, message=message
+            )
+        pending.to = user.email
+        pending.subject = subject
+        pending.message = message
+        pending.save(update_fields=["to", "subject", "message", "updated_at"])
+        return pending
+
+
+def _email_outbox_claim(*, batch_size: int) -> list[EmailOutbox]:
+    # Pushing next_attempt_at out hides the rows from other workers while they are sent,
+    # without holding row locks over SMTP; a worker that dies mid-batch leaves them to
+    # be retried once the claim runs out. The attempt counts from here for that reason.
+    now = timezone.now()
+    with transaction.atomic():
+        emails = list(
+            EmailOutbox.objects.select_for_update(skip_locked=True)
+            .filter(status=EmailOutbox.StatusChoices.PENDING, next_attempt_at__lte=now)
+            .order_by("next_attempt_at")[:batch_size]
+        )
+        for email in emails:
+            email.attempts += 1
+            email.next_attempt_at = now + timedelta(seconds=settings.EMAIL_OUTBOX_CLAIM_SECONDS)
+            email.updated_at = now
+        EmailOutbox.objects.bulk_update(emails, ["attempts", "next_attempt_at", "updated_at"])
+    return emails
+
+
+def _email_outbox_record_failure(*, email: EmailOutbox, error: Exception):
+    email.last_error = str(error)
+    if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        email.status = EmailOutbox.StatusChoices.FAILED
+    else:
+        backoff = settings.EMAIL_OUTBOX_RETRY_SECONDS * 2 ** (email.attempts - 1)
+        email.next_attempt_at = timezone.now() + timedelta(seconds=backoff)
+
+
+def email_outbox_send_batch(*, batch_size: int) -> tuple[int, int]:
+    """
+    Sends up to `batch_size` due emails over a single backend connection. The emails are
+    claimed in a short transaction and sent outside of it. Failed sends, including a
+    connection that can't be opened, which fails the whole batch, are retried with
+    exponential backoff until `EMAIL_OUTBOX_MAX_ATTEMPTS`.
+    Returns the number of sent and failed emails.
+    """
+    emails = _email_outbox_claim(batch_size=batch_size)
+    if not emails:
+        return 0, 0
+    sent = failed = 0
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as err:
+        logger.exception("Could not open the email connection for %s emails", len(emails))
+        for email in emails:
+            _email_outbox_record_failure(email=email, error=err)
+        failed = len(emails)
+    else:
+        try:
+            for email in emails:
+                try:
+                    EmailMessage(
+                        subject=email.subject,
+                        body=email.message,
+                        to=[email.to],
+                        connection=connection,
+                    ).send()
+                except Exception as err:
+                    failed += 1
+                    _email_outbox_record_failure(email=email, error=err)
+                else:
+                    sent += 1
+                    email.status = EmailOutbox.StatusChoices.SENT
+                    email.sent_at = timezone.now()
+                    email.last_error = ""
+        finally:
+            connection.close()
+    for email in emails:
+        email.updated_at = timezone.now()
+    EmailOutbox.objects.bulk_update(
+        emails, ["status", "next_attempt_at", "last_error", "sent_at", "updated_at"]
+    )
+    return sent, failed
+
+
+@dataclass
+class UserImportResult:
+    processed: int = 0
+    created: int = 0
+    conflicts: list[tuple[int, str]] = field(default_factory=list)
+    started_at: float = field(default_factory=time.perf_counter)
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    @property
+    def rate(self) -> float:
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+
+def _user_import_batch(*, batch, pool, result, seen_emails, seen_usernames):
+    candidates = []
+    for line, row in batch:
+        email = User.objects.normalize_email((row.get("email") or "").strip())
+        username = (row.get("username") or "").strip()
+        if not email or not username:
+            result.conflicts.append((line, "email and username are required"))
+        elif email.lower() in seen_emails:
+            result.conflicts.append((line, f"duplicate email {email}"))
+        elif username in seen_usernames:
+            result.conflicts.append((line, f"duplicate username {username}"))
+        else:
+            seen_emails.add(email.lower())
+            seen_usernames.add(username)
+            candidates.append((line, email, username, row.get("password") or None))
+
+    existing_emails = {
+        email.lower()
+        for email in User.objects.filter(
+            email__in=[email for _, email, _, _ in candidates]
+        ).values_list("email", flat=True)
+    }
+    existing_usernames = set(
+        User.objects.filter(
+            username__in=[username for _, _, username, _ in candidates]
+        ).values_list("username", flat=True)
+    )
+    new_users = []
+    for line, email, username, password in candidates:
+        if email.lower() in existing_emails:
+            result.conflicts.append((line, f"email {email} already exists"))
+        elif username in existing_usernames:
+            result.conflicts.append((line, f"username {username} already exists"))
+        else:
+            user = User(
+                email=email, username=username, username_normalized=normalize_text(username)
+            )
+            new_users.append((line, user, password))
+
+    # An empty password gets an unusable hash, same as create_user(password=None)
+    passwords = [password for _, _, password in new_users]
+    for (_, user, _), password_hash in zip(
+        new_users, pool.map(make_password, passwords, chunksize=32)
+    ):
+        user.password = password_hash
+
+    try:
+        with transaction.atomic():
+            users = User.objects.bulk_create([user for _, user, _ in new_users])
+            Profile.objects.bulk_create([Profile(user=user) for user in users])
+        result.created += len(users)
+    except IntegrityError:
+        # Someone created a conflicting user meanwhile, fall back to row by row
+        for line, user, _ in new_users:
+            try:
+                with transaction.atomic():
+                    user.save()
+                    user_profile_create(user=user)
+                result.created += 1
+            except IntegrityError as err:
+                result.conflicts.append((line, f"{user.email}: {err}"))
+    result.processed += len(batch)
+
+
+def user_bulk_import(
+    *,
+    rows: Iterable[dict],
+    batch_size: int = 1000,
+    workers: int = None,
+    on_progress: Callable[[UserImportResult], None] = None,
+) -> UserImportResult:
+    """
+    Creates users with their profiles from `rows` (dicts with email, username and an
+    optional password), e.g. a csv.DictReader. Rows are streamed in batches: passwords
+    are hashed across a process pool and each batch is inserted with bulk_create in one
+    transaction. Rows that conflict with existing users or earlier rows are reported in
+    `conflicts` as (line number, reason) and skipped.
+    """
+    result = UserImportResult()
+    pool = BoundedProcessPool(
+        max_workers=workers or settings.PASSWORD_HASHER_WORKERS, max_pending=batch_size
+    )
+    seen_emails, seen_usernames = set(), set()
+    # Line 1 is the CSV header
+    numbered_rows = enumerate(rows, start=2)
+    try:
+        while batch := list(islice(numbered_rows, batch_size)):
+            _user_import_batch(
+                batch=batch,
+                pool=pool,
+                result=result,
+                seen_emails=seen_emails,
+                seen_usernames=seen_usernames,
+            )
+            if on_progress is not None:
+                on_progress(result)
+    finally:
+        pool.shutdown()
+    result.conflicts.sort()
+    return result
+
+
+def get_user_import_path(relative_path: str) -> Path:
+    return Path(settings.USER_IMPORT_ROOT) / relative_path
+
+
+def user_import_queue(*, csv_file, requested_by: User = None) -> UserImport:
+    """
+    Stores an uploaded CSV file (see `user_bulk_import` for the columns) for
+    `user_import_run_next`, so the upload request doesn't wait for the import.
+    """
+    relative_path = f"{uuid.uuid4().hex}.csv"
+    path = get_user_import_path(relative_path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as file:
+        for chunk in csv_file.chunks():
+            file.write(chunk)
+    return UserImport.objects.create(
+        requested_by=requested_by, file_name=csv_file.name, path=relative_path
+    )
+
+
+def _user_import_claim() -> UserImport | None:
+    with transaction.atomic():
+        user_import = (
+            UserImport.objects.select_for_update(skip_locked=True)
+            .filter(status=UserImport.StatusChoices.PENDING)
+            .order_by("created_at")
+            .first()
+        )
+        if user_import is not None:
+            user_import.status = UserImport.StatusChoices.RUNNING
+            user_import.save(update_fields=["status", "updated_at"])
+    return user_import
+
+
+def user_import_run_next(*, batch_size: int = 1000, workers: int = None) -> UserImport | None:
+    """
+    Runs the oldest queued import, saving its counts after every batch so the admin shows
+    the progress, and deletes its file afterwards. An import whose worker died stays
+    RUNNING; set it back to PENDING to run it again.
+    Returns the import, or None if none was queued.
+    """
+    user_import = _user_import_claim()
+    if user_import is None:
+        return None
+
+    def on_progress(result: UserImportResult):
+        user_import.processed = result.processed
+        user_import.created = result.created
+        user_import.save(update_fields=["processed", "created", "updated_at"])
+
+    path = get_user_import_path(user_import.path)
+    try:
+        with open(path, newline="", encoding="utf-8") as file:
+            result = user_bulk_import(
+                rows=csv.DictReader(file),
+                batch_size=batch_size,
+                workers=workers,
+                on_progress=on_progress,
+            )
+    except Exception as err:
+        logger.exception("User import %s failed", user_import.pk)
+        user_import.status = UserImport.StatusChoices.FAILED
+        user_import.error = str(err)
+    else:
+        on_progress(result)
+        user_import.status = UserImport.StatusChoices.DONE
+        user_import.conflicts = result.conflicts
+        path.unlink()
+    user_import.save(update_fields=["status", "conflicts", "error", "updated_at"])
+    return user_import
@@ -0,0 +1,103 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+from apps.users.blacklist import blacklist_filter
+from apps.users.models import Profile, User
+from apps.users.selectors import user_autocomplete_index
+from apps.users.services import user_cache_invalidate, user_profile_cache_invalidate
+from apps.users.thumbnails import schedule_thumbnails
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def add_blacklisted_token_to_filter(sender, instance, created, **kwargs):
+    if created:
+        blacklist_filter.add(instance.token.jti)
+        transaction.on_commit(blacklist_filter.changed)
+
+
+def _get_image_name(profile):
+    # Read the raw attribute so a deferred image field doesn't trigger a query
+    value = profile.__dict__.get("image")
+    return getattr(value, "name", value)
+
+
+@receiver(post_init, sender=Profile)
+def remember_profile_image(sender, instance, **kwargs):
+    instance._loaded_image_name = _get_image_name(instance)
+
+
+@receiver(post_save, sender=Profile)
+def queue_profile_thumbnails(sender, instance, **kwargs):
+    name = _get_image_name(instance)
+    user_id = instance.user_id
+    if name and name != instance._loaded_image_name:
+        transaction.on_commit(lambda: schedule_thumbnails(name, user_id=user_id))
+    instance._loaded_image_name = name
+
+
+def _invalidate_now_and_on_commit(invalidate):
+    # Another process may re-cache the old row between now and the commit, so the entry
+    # is dropped again once the change is visible
+    invalidate()
+    transaction.on_commit(invalidate)
+
+
+@receiver([post_save, post_delete], sender=Profile)
+def invalidate_profile_cache_on_profile_change(sender, instance, **kwargs):
+    if instance.user_id is not None:
+        user_id = instance.user_id
+        _invalidate_now_and_on_commit(lambda: user_profile_cache_invalidate(user_id=user_id))
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_caches_on_user_change(sender, instance, **kwargs):
+    # Covers password changes and deactivation as well, both save the user
+    user_id = instance.pk
+
+    def invalidate():
+        user_cache_invalidate(user_id=user_id)
+        user_profile_cache_invalidate(user_id=user_id)
+
+    _invalidate_now_and_on_commit(invalidate)
+
+
+@receiver(post_init, sender=User)
+def remember_autocomplete_fields(sender, instance, **kwargs):
+    # Deferred fields are skipped so loading a partial user doesn't trigger a query
+    instance._loaded_autocomplete = (
+        instance.__dict__.get("username"), instance.__dict__.get("is_active")
+    )
+
+
+@receiver(post_save, sender=User)
+def update_user_autocomplete(sender, instance, created, **kwargs):
+    pk, username, is_active = instance.pk, instance.username, instance.is_active
+    loaded = instance._loaded_autocomplete
+    instance._loaded_autocomplete = (username, is_active)
+    if created:
+        if is_active:
+            transaction.on_commit(lambda: user_autocomplete_index.add(pk, username))
+    elif loaded != (username, is_active):
+
+        def apply():
+            if is_active:
+                user_autocomplete_index.add(pk, username)
+            else:
+                user_autocomplete_index.remove(pk)
+            # Other processes only pull new users by themselves
+            user_autocomplete_index.changed(pk)
+
+        transaction.on_commit(apply)
+
+
+@receiver(post_delete, sender=User)
+def remove_user_autocomplete(sender, instance, **kwargs):
+    pk = instance.pk
+
+    def apply():
+        user_autocomplete_index.remove(pk)
+        user_autocomplete_index.changed(pk)
+
+    transaction.on_commit(apply)
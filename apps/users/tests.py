@@ -0,0 +1,498 @@
+import tempfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
+
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.storage import default_storage
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image, JpegImagePlugin
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from apps.common.autocomplete import PrefixIndex, normalize_text
+from apps.core.queries import assert_max_queries
+from apps.users.blacklist import BlacklistFilter, BloomFilter
+from apps.users.models import EmailOutbox, Profile, ResetPassword, User, UserImport
+from apps.users.selectors import get_tokens_for_user
+from apps.users.services import (
+    email_outbox_enqueue,
+    email_outbox_send_batch,
+    user_create,
+    user_profile_create,
+)
+from apps.users.thumbnails import generate_thumbnails, get_thumbnail_urls
+from config import settings
+
+# Tests run without a Redis server
+LOCAL_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+# Query budgets measured on the current code. A change that makes one of these
+# endpoints run more queries per request has to raise its budget here, on purpose.
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"],
+)
+class UserApiQueryBudgetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = user_create(username="anna", email="anna@example.com", password="password")
+        user_profile_create(user=cls.user)
+        for number in range(20):
+            user_create(
+                username=f"anna{number}", email=f"anna{number}@example.com", password="password"
+            )
+
+    def setUp(self):
+        cache.clear()
+        access = get_tokens_for_user(user=self.user)["access"]
+        self.client.defaults["HTTP_AUTHORIZATION"] = f"Bearer {access}"
+
+    def test_profile(self):
+        with assert_max_queries(2, "profile"):
+            response = self.client.get(reverse("user-profile"))
+        self.assertEqual(response.status_code, 200)
+        # Served from the user and profile caches afterwards
+        with assert_max_queries(0, "cached profile"):
+            response = self.client.get(reverse("user-profile"))
+        self.assertEqual(response.status_code, 200)
+
+    def test_profile_change_invalidates_cached_response(self):
+        first = self.client.get(reverse("user-profile"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.profile.phone_number = "+15550100"
+            self.user.profile.save()
+        second = self.client.get(reverse("user-profile"))
+        self.assertNotEqual(first["ETag"], second["ETag"])
+        self.assertEqual(second.json()["description"]["phone_number"], "+15550100")
+
+    def test_profile_revalidates_with_the_etag(self):
+        first = self.client.get(reverse("user-profile"))
+        self.assertNotIn("Last-Modified", first)
+        response = self.client.get(reverse("user-profile"), HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(response.status_code, 304)
+        # A date alone can't tell whether the profile changed, so it isn't trusted
+        response = self.client.get(
+            reverse("user-profile"), HTTP_IF_MODIFIED_SINCE="Wed, 21 Oct 2099 07:28:00 GMT"
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_user_autocomplete(self):
+        with assert_max_queries(3, "user autocomplete"):
+            response = self.client.get(reverse("user-autocomplete"), {"q": "ann"})
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"],
+)
+class PrefixIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = user_create(username="anna", email="anna@example.com", password="password")
+
+    def setUp(self):
+        cache.clear()
+        users = User.objects.filter(is_active=True)
+        self.index = PrefixIndex(
+            name="test-users",
+            load_rows=lambda after_pk: users.filter(pk__gt=after_pk).values_list(
+                "pk", "username"
+            ),
+            load_changed=lambda pks: users.filter(pk__in=pks).values_list("pk", "username"),
+            count_rows=users.count,
+            max_entries=100,
+        )
+        # Test data lives in this thread's transaction, so tests run the reloads here
+        self.start_reload = self.enterContext(mock.patch.object(self.index, "_start_reload"))
+        self.assertEqual(self.index.search("ann", 10), [(self.user.pk, "anna")])
+
+    def sync(self):
+        self.index._synced_at = 0.0
+
+    def rename(self, user, username):
+        User.objects.filter(pk=user.pk).update(
+            username=username, username_normalized=normalize_text(username)
+        )
+
+    def test_new_rows_are_pulled(self):
+        other = user_create(username="annie", email="annie@example.com", password="password")
+        self.sync()
+        self.assertEqual(len(self.index.search("ann", 10)), 2)
+        self.assertIn((other.pk, "annie"), self.index.search("ann", 10))
+
+    def test_logged_changes_are_applied_without_a_reload(self):
+        other = user_create(username="annie", email="annie@example.com", password="password")
+        self.rename(self.user, "zoe")
+        User.objects.filter(pk=other.pk).update(is_active=False)
+        self.index.changed(self.user.pk)
+        self.index.changed(other.pk)
+        self.sync()
+        # Change log entries in one cache read, both rows in one query, plus new rows
+        with assert_max_queries(2, "logged changes"):
+            self.assertEqual(self.index.search("ann", 10), [])
+        self.assertEqual(self.index.search("zo", 10), [(self.user.pk, "zoe")])
+        self.start_reload.assert_not_called()
+
+    def test_lost_change_log_entry_reloads(self):
+        self.rename(self.user, "zoe")
+        self.index.changed(self.user.pk)
+        cache.delete(self.index._get_change_key(1))
+        self.sync()
+        # Possibly not written yet
+        self.assertEqual(self.index.search("ann", 10), [(self.user.pk, "anna")])
+        self.start_reload.assert_not_called()
+        self.sync()
+        self.index.search("ann", 10)
+        self.start_reload.assert_called_once()
+        self.index.reload()
+        self.assertEqual(self.index.search("zo", 10), [(self.user.pk, "zoe")])
+
+    def test_periodic_reload_runs_in_the_background(self):
+        self.rename(self.user, "zoe")
+        self.sync()
+        self.index._reloaded_at -= self.index.reload_seconds
+        # Not swapped in yet, searches go on with the current arrays
+        self.assertEqual(self.index.search("ann", 10), [(self.user.pk, "anna")])
+        self.start_reload.assert_called_once()
+        self.index.reload()
+        self.assertEqual(self.index.search("ann", 10), [])
+        self.assertEqual(self.index.search("zo", 10), [(self.user.pk, "zoe")])
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class PrefixIndexReloadThreadTests(SimpleTestCase):
+    def test_reload_thread_swaps_the_arrays_in(self):
+        rows = [(1, "anna")]
+        index = PrefixIndex(
+            name="test-thread",
+            load_rows=lambda after_pk: [row for row in rows if row[0] > after_pk],
+            load_changed=lambda pks: [row for row in rows if row[0] in pks],
+            count_rows=lambda: len(rows),
+            max_entries=100,
+        )
+        self.assertEqual(index.search("ann", 10), [(1, "anna")])
+        rows[0] = (1, "zoe")
+        index._synced_at = 0.0
+        index._reloaded_at -= index.reload_seconds
+        self.assertEqual(index.search("ann", 10), [(1, "anna")])
+        index._reload_thread.join(timeout=5)
+        self.assertEqual(index.search("zo", 10), [(1, "zoe")])
+
+
+class BloomFilterTests(SimpleTestCase):
+    def test_added_keys_are_found(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        keys = [f"jti-{number}" for number in range(1000)]
+        for key in keys:
+            bloom.add(key)
+        self.assertTrue(all(key in bloom for key in keys))
+        self.assertEqual(bloom.count, 1000)
+
+    def test_false_positive_rate_stays_near_target(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        for number in range(1000):
+            bloom.add(f"jti-{number}")
+        false_positives = sum(f"other-{number}" in bloom for number in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"],
+)
+class BlacklistFilterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = user_create(username="anna", email="anna@example.com", password="password")
+
+    def blacklist_new_token(self):
+        get_tokens_for_user(user=self.user)
+        token = OutstandingToken.objects.latest("id")
+        # Bypasses this process's filter, like a logout handled by another worker
+        BlacklistedToken.objects.bulk_create([BlacklistedToken(token=token)])
+        return token.jti
+
+    def setUp(self):
+        cache.clear()
+
+    def test_token_blacklisted_elsewhere_is_refused_after_the_version_bump(self):
+        blacklist_filter = BlacklistFilter(sync_seconds=0)
+        self.assertFalse(blacklist_filter.is_blacklisted("unknown"))
+        jti = self.blacklist_new_token()
+        # What the other worker's post_save handler does on commit
+        BlacklistFilter(sync_seconds=0).changed()
+        self.assertTrue(blacklist_filter.is_blacklisted(jti))
+
+    def test_rows_written_without_signals_are_pulled_after_max_age(self):
+        blacklist_filter = BlacklistFilter(sync_seconds=0)
+        self.assertFalse(blacklist_filter.is_blacklisted("unknown"))
+        jti = self.blacklist_new_token()
+        self.assertFalse(blacklist_filter.might_contain(jti))
+        blacklist_filter.max_age = 0
+        self.assertTrue(blacklist_filter.is_blacklisted(jti))
+
+    def test_unknown_token_is_answered_from_memory(self):
+        self.blacklist_new_token()
+        for sync_seconds in (60, 0):
+            blacklist_filter = BlacklistFilter(sync_seconds=sync_seconds)
+            blacklist_filter.might_contain("warm-up")
+            # A due version check reads the cache, never the database
+            with assert_max_queries(0, "unknown token"):
+                self.assertFalse(blacklist_filter.is_blacklisted("unknown"))
+
+
+class UnreachableEmailBackend(BaseEmailBackend):
+    def open(self):
+        raise ConnectionRefusedError("SMTP server unreachable")
+
+
+class RejectingEmailBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        raise ValueError("Recipient rejected")
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"],
+)
+class EmailOutboxTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = user_create(username="anna", email="anna@example.com", password="password")
+
+    def enqueue(self, subject="Reset your password"):
+        return email_outbox_enqueue(
+            user=self.user,
+            kind=EmailOutbox.KindChoices.RESET_PASSWORD,
+            subject=subject,
+            message="Follow the link",
+            dedup_window=timedelta(minutes=5),
+        )
+
+    def make_due(self, email):
+        EmailOutbox.objects.filter(pk=email.pk).update(next_attempt_at=timezone.now())
+
+    def test_sends_pending_emails(self):
+        email = self.enqueue()
+        self.assertEqual(email_outbox_send_batch(batch_size=10), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["anna@example.com"])
+        email.refresh_from_db()
+        self.assertEqual(email.status, EmailOutbox.StatusChoices.SENT)
+        self.assertEqual(email.attempts, 1)
+        # Nothing left to send
+        self.assertEqual(email_outbox_send_batch(batch_size=10), (0, 0))
+
+    def test_repeated_requests_collapse_into_one_email(self):
+        first = self.enqueue(subject="first")
+        second = self.enqueue(subject="second")
+        self.assertEqual(first.pk, second.pk)
+        email_outbox_send_batch(batch_size=10)
+        self.assertEqual([message.subject for message in mail.outbox], ["second"])
+
+    @override_settings(EMAIL_BACKEND="apps.users.tests.UnreachableEmailBackend")
+    def test_unreachable_server_fails_the_batch_with_backoff(self):
+        email = self.enqueue()
+        started = timezone.now()
+        with self.assertLogs("apps.users.services", "ERROR"):
+            self.assertEqual(email_outbox_send_batch(batch_size=10), (0, 1))
+        email.refresh_from_db()
+        self.assertEqual(email.status, EmailOutbox.StatusChoices.PENDING)
+        self.assertEqual(email.attempts, 1)
+        self.assertIn("unreachable", email.last_error)
+        retry_in = (email.next_attempt_at - started).total_seconds()
+        self.assertAlmostEqual(retry_in, settings.EMAIL_OUTBOX_RETRY_SECONDS, delta=5)
+        # Not due yet
+        self.assertEqual(email_outbox_send_batch(batch_size=10), (0, 0))
+
+    @override_settings(EMAIL_BACKEND="apps.users.tests.RejectingEmailBackend")
+    def test_backoff_doubles_until_the_attempt_limit(self):
+        email = self.enqueue()
+        delays = []
+        for _ in range(settings.EMAIL_OUTBOX_MAX_ATTEMPTS):
+            started = timezone.now()
+            self.assertEqual(email_outbox_send_batch(batch_size=10), (0, 1))
+            email.refresh_from_db()
+            delays.append(round((email.next_attempt_at - started).total_seconds()))
+            self.make_due(email)
+        self.assertEqual(email.status, EmailOutbox.StatusChoices.FAILED)
+        self.assertEqual(email.attempts, settings.EMAIL_OUTBOX_MAX_ATTEMPTS)
+        retry = settings.EMAIL_OUTBOX_RETRY_SECONDS
+        self.assertEqual(delays[:2], [retry, retry * 2])
+        self.assertEqual(email_outbox_send_batch(batch_size=10), (0, 0))
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"],
+)
+class PurgeResetPasswordsTests(TestCase):
+    def create_reset_password(self, username, *, expires_in, is_blacklisted=False):
+        user = user_create(
+            username=username, email=f"{username}@example.com", password="password"
+        )
+        now = timezone.now()
+        return ResetPassword.objects.create(
+            user=user,
+            token=f"token-{username}",
+            created_or_updated_at=now,
+            expires_at=now + expires_in,
+            is_blacklisted=is_blacklisted,
+        )
+
+    def test_deletes_expired_and_used_tokens(self):
+        self.create_reset_password("expired", expires_in=-timedelta(minutes=1))
+        self.create_reset_password(
+            "expired_used", expires_in=-timedelta(minutes=1), is_blacklisted=True
+        )
+        self.create_reset_password("used", expires_in=timedelta(minutes=10), is_blacklisted=True)
+        fresh = self.create_reset_password("fresh", expires_in=timedelta(minutes=10))
+        out = StringIO()
+        # One row per batch, so the loop runs more than once
+        call_command("purge_reset_passwords", batch_size=1, stdout=out)
+        self.assertIn("Purged 3 reset password tokens", out.getvalue())
+        self.assertQuerySetEqual(ResetPassword.objects.all(), [fresh])
+        self.assertEqual(User.objects.count(), 4)
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"],
+)
+class ProfileThumbnailTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = user_create(username="anna", email="anna@example.com", password="password")
+        user_profile_create(user=cls.user)
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def save_image(self, size=(1200, 800)):
+        buffer = BytesIO()
+        Image.new("RGB", size, "red").save(buffer, "JPEG")
+        return default_storage.save("user_1/profile/avatar.jpg", ContentFile(buffer.getvalue()))
+
+    def test_generates_every_size_from_a_reduced_decode(self):
+        name = self.save_image()
+        Profile.objects.filter(user=self.user).update(image=name)
+        draft = JpegImagePlugin.JpegImageFile.draft
+        with mock.patch.object(
+            JpegImagePlugin.JpegImageFile, "draft", autospec=True, side_effect=draft
+        ) as draft_mock:
+            names = generate_thumbnails(name, self.user.pk)
+        largest = max(settings.PROFILE_THUMBNAIL_SIZES)
+        draft_mock.assert_called_once_with(mock.ANY, "RGB", (largest, largest))
+        self.assertEqual(set(names), {str(size) for size in settings.PROFILE_THUMBNAIL_SIZES})
+        for size, thumbnail_name in names.items():
+            with default_storage.open(thumbnail_name) as file, Image.open(file) as thumbnail:
+                self.assertEqual(thumbnail.format, settings.PROFILE_THUMBNAIL_FORMAT)
+                self.assertEqual(thumbnail.size, (int(size), int(size)))
+        self.assertEqual(Profile.objects.get(user=self.user).thumbnails, names)
+
+    def test_replaced_image_does_not_get_the_old_thumbnails(self):
+        name = self.save_image()
+        Profile.objects.filter(user=self.user).update(image="user_1/profile/other.jpg")
+        generate_thumbnails(name, self.user.pk)
+        self.assertEqual(Profile.objects.get(user=self.user).thumbnails, {})
+
+    def test_urls_come_from_the_profile_without_asking_the_storage(self):
+        name = self.save_image()
+        profile = Profile.objects.get(user=self.user)
+        profile.image = name
+        with mock.patch("apps.users.signals.schedule_thumbnails"):
+            profile.save()
+        original = settings.BASE_BACKEND_URL + profile.image.url
+        with mock.patch.object(default_storage, "exists") as exists:
+            # Not generated yet, every size falls back to the original
+            self.assertEqual(set(get_thumbnail_urls(profile).values()), {original})
+        exists.assert_not_called()
+        generate_thumbnails(name, self.user.pk)
+        profile.refresh_from_db()
+        with mock.patch.object(default_storage, "exists") as exists:
+            urls = get_thumbnail_urls(profile)
+        exists.assert_not_called()
+        self.assertEqual(
+            urls["64"], settings.BASE_BACKEND_URL + "/media/user_1/profile/avatar_64.webp"
+        )
+
+    def test_new_image_queues_thumbnails_after_commit(self):
+        profile = Profile.objects.get(user=self.user)
+        with mock.patch("apps.users.signals.schedule_thumbnails") as schedule:
+            with self.captureOnCommitCallbacks(execute=True):
+                profile.image = "user_1/profile/avatar.jpg"
+                profile.save()
+                schedule.assert_not_called()
+            schedule.assert_called_once_with("user_1/profile/avatar.jpg", user_id=self.user.pk)
+            # Saving other fields leaves the thumbnails alone
+            with self.captureOnCommitCallbacks(execute=True):
+                profile.phone_number = "123"
+                profile.save()
+            schedule.assert_called_once()
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"],
+)
+class QueuedUserImportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser("admin@example.com", "password")
+        user_create(username="anna", email="anna@example.com", password="password")
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(mock.patch.object(settings, "USER_IMPORT_ROOT", directory.name))
+        self.client.force_login(self.admin)
+
+    def test_upload_is_queued_and_imported_by_the_command(self):
+        csv_file = SimpleUploadedFile(
+            "users.csv",
+            b"email,username,password\n"
+            b"bob@example.com,bob,secret\n"
+            b"anna@example.com,anna2,secret\n"
+            b"carl@example.com,carl,\n",
+        )
+        response = self.client.post(reverse("admin:users_user_import_csv"), {"csv_file": csv_file})
+        user_import = UserImport.objects.get()
+        self.assertRedirects(
+            response, reverse("admin:users_userimport_change", args=[user_import.pk])
+        )
+        # Nothing is imported within the request
+        self.assertEqual(user_import.status, UserImport.StatusChoices.PENDING)
+        self.assertFalse(User.objects.filter(username="bob").exists())
+
+        out = StringIO()
+        call_command("import_users", queued=True, workers=1, stdout=out)
+        self.assertIn("users.csv: done, imported 2 of 3 rows, 1 conflicts", out.getvalue())
+        user_import.refresh_from_db()
+        self.assertEqual(user_import.status, UserImport.StatusChoices.DONE)
+        self.assertEqual((user_import.processed, user_import.created), (3, 2))
+        self.assertEqual(user_import.conflicts, [[3, "email anna@example.com already exists"]])
+        # Hashed in the pool's processes, which don't see the test's PASSWORD_HASHERS
+        self.assertTrue(User.objects.get(username="bob").has_usable_password())
+        self.assertFalse(User.objects.get(username="carl").has_usable_password())
+        # The file held passwords
+        self.assertFalse(Path(settings.USER_IMPORT_ROOT, user_import.path).exists())
+
+        response = self.client.get(
+            reverse("admin:users_userimport_change", args=[user_import.pk])
+        )
+        self.assertContains(response, "email anna@example.com already exists")
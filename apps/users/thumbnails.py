@@ -0,0 +1,105 @@
+import logging
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from apps.common.pools import BoundedProcessPool
+from apps.common.utils import get_image_url_if_exists
+from apps.users.services import user_profile_cache_invalidate
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+thumbnail_pool = BoundedProcessPool(
+    max_workers=settings.PROFILE_THUMBNAIL_WORKERS,
+    max_pending=settings.PROFILE_THUMBNAIL_MAX_PENDING,
+)
+
+
+def get_thumbnail_name(name: str, size: int) -> str:
+    # user_1/profile/avatar.jpg -> user_1/profile/avatar_64.webp
+    root, _ = os.path.splitext(name)
+    return f"{root}_{size}.{settings.PROFILE_THUMBNAIL_FORMAT.lower()}"
+
+
+def generate_thumbnails(name: str, user_id: int) -> dict[str, str]:
+    """
+    Writes a square thumbnail for every size in `PROFILE_THUMBNAIL_SIZES` next to the
+    original image and records them on the profile, unless its image was replaced
+    meanwhile. Runs in the thumbnail process pool.
+    """
+    from apps.users.models import Profile
+
+    largest = max(settings.PROFILE_THUMBNAIL_SIZES)
+    with default_storage.open(name) as file, Image.open(file) as image:
+        # JPEGs are decoded straight at a reduced scale, still at least `largest` wide
+        image.draft("RGB", (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        if settings.PROFILE_THUMBNAIL_FORMAT == "JPEG":
+            image = image.convert("RGB")
+
+        side = min(image.size)
+        left = (image.width - side) // 2
+        top = (image.height - side) // 2
+        square = (left, top, left + side, top + side)
+
+        names = {}
+        for size in settings.PROFILE_THUMBNAIL_SIZES:
+            thumbnail = image.resize(
+                (size, size), Image.Resampling.LANCZOS, box=square, reducing_gap=3.0
+            )
+            buffer = BytesIO()
+            thumbnail.save(buffer, settings.PROFILE_THUMBNAIL_FORMAT, quality=85)
+            thumbnail_name = get_thumbnail_name(name, size)
+            if default_storage.exists(thumbnail_name):
+                default_storage.delete(thumbnail_name)
+            names[str(size)] = default_storage.save(
+                thumbnail_name, ContentFile(buffer.getvalue())
+            )
+    # A queryset update, so the post_save handlers don't queue the thumbnails again
+    Profile.objects.filter(user_id=user_id, image=name).update(thumbnails=names)
+    return names
+
+
+def schedule_thumbnails(name: str, *, user_id: int):
+    """
+    Queues thumbnail generation without waiting for it. Until it finishes, the profile
+    API falls back to the original image.
+    """
+    def on_done(future):
+        if future.exception() is not None:
+            logger.error("Thumbnail generation failed", exc_info=future.exception())
+        else:
+            # Cached profile responses still point at the original image
+            user_profile_cache_invalidate(user_id=user_id)
+
+    try:
+        future = thumbnail_pool.submit(generate_thumbnails, name, user_id)
+    except Exception:
+        logger.exception("Could not queue thumbnails for %s", name)
+        return
+    future.add_done_callback(on_done)
+
+
+def get_thumbnail_urls(profile) -> dict[str, str]:
+    """
+    URLs of the thumbnails recorded on `profile`, without asking the storage. Sizes not
+    generated yet for the current image point at the original.
+    """
+    if not profile.image:
+        return {}
+    original = get_image_url_if_exists(profile.image)
+    urls = {}
+    for size in settings.PROFILE_THUMBNAIL_SIZES:
+        thumbnail_name = profile.thumbnails.get(str(size))
+        # Left over from a previous image until the new thumbnails are recorded
+        if thumbnail_name != get_thumbnail_name(profile.image.name, size):
+            urls[str(size)] = original
+        else:
+            urls[str(size)] = settings.BASE_BACKEND_URL + default_storage.url(thumbnail_name)
+    return urls
@@ -0,0 +1,20 @@
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt import serializers, tokens
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+from apps.users.blacklist import blacklist_filter
+
+
+class RefreshToken(tokens.RefreshToken):
+    def check_blacklist(self):
+        """
+        Same as simplejwt's check, but only tokens that hit the in-memory blacklist
+        filter are looked up in the database.
+        """
+        if blacklist_filter.is_blacklisted(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_("Token is blacklisted"))
+
+
+class TokenRefreshSerializer(serializers.TokenRefreshSerializer):
+    token_class = RefreshToken
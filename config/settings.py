@@ -9,6 +9,7 @@ https://docs.djangoproject.com/en/5.1/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
+import os
 from datetime import timedelta
 from pathlib import Path
 
@@ -16,6 +17,7 @@ from pathlib import Path
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 BASE_BACKEND_URL = "127.0.0.1:8000"
+BASE_FRONTEND_URL = "http://127.0.0.1:3000"
 
 
 # Quick-start development settings - unsuitable for production
@@ -33,22 +35,26 @@ ALLOWED_HOSTS = []
 # Application definition
 
 INSTALLED_APPS = [
+    "daphne",
     "django.contrib.admin",
     "django.contrib.auth",
     "django.contrib.contenttypes",
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "apps.core",
     "apps.users",
     "apps.chat",
 'rest_framework',
     'channels',
-    'daphne',
     "rest_framework_simplejwt",
     "rest_framework_simplejwt.token_blacklist",
 ]
 
 MIDDLEWARE = [
+    "apps.core.middleware.QueryInstrumentationMiddleware",
+    "apps.core.middleware.ProfilingMiddleware",
+    "apps.core.middleware.DatabasePinningMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -89,6 +95,42 @@ DATABASES = {
     }
 }
 
+# Read replicas
+# Aliases from DATABASES that serve chat history, search, room-list and export reads.
+# Auth and every write always go to "default". To try it locally, add a read-only
+# connection to the same SQLite file and list it here:
+#
+#   DATABASES["replica"] = {
+#       "ENGINE": "django.db.backends.sqlite3",
+#       "NAME": BASE_DIR / "db.sqlite3",
+#       "OPTIONS": {"init_command": "PRAGMA query_only = 1;"},
+#       "TEST": {"MIRROR": "default"},
+#   }
+#   DATABASE_REPLICAS = ["replica"]
+
+DATABASE_REPLICAS = []
+DATABASE_REPLICA_MODELS = ["chat.chatroom", "chat.message"]
+# Seconds a request or socket keeps reading from the primary after it wrote.
+DATABASE_PIN_SECONDS = 5
+DATABASE_ROUTERS = ["apps.core.routers.PrimaryReplicaRouter"]
+
+# Per-request and per-WebSocket-event query recording. Counts and timings are logged at
+# debug level and an X-Query-Count header is added to responses; a query run
+# REPEAT_THRESHOLD times from the same line in one request is logged as a likely N+1.
+QUERY_INSTRUMENTATION = DEBUG
+QUERY_REPEAT_THRESHOLD = 5
+
+# Opt-in profiling. Requests and WebSocket connections presenting a token from
+# `manage.py profiling_token` (valid TOKEN_MAX_AGE seconds) in an X-Profile header or a
+# `_profile` query parameter are profiled, as is a random SAMPLE_RATE share (0-1) of all
+# requests and WebSocket events. Async code is stack-sampled every SAMPLING_INTERVAL
+# seconds. The newest MAX_FILES traces are kept in DIR, listed in DIR/index.jsonl.
+PROFILING_SAMPLE_RATE = 0
+PROFILING_TOKEN_MAX_AGE = 3600
+PROFILING_SAMPLING_INTERVAL = 0.001
+PROFILING_DIR = BASE_DIR / "profiles"
+PROFILING_MAX_FILES = 500
+
 AUTH_USER_MODEL = "users.User"
 
 # Password validation
@@ -109,6 +151,15 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing runs in a process pool so login and registration don't block the
+# event loop. Requests beyond MAX_PENDING queued hashes are answered with a 503.
+PASSWORD_HASHER_WORKERS = os.cpu_count() or 1
+PASSWORD_HASHER_MAX_PENDING = PASSWORD_HASHER_WORKERS * 8
+
+# CSV files uploaded in the admin wait in USER_IMPORT_ROOT (not served publicly, they hold
+# passwords) until `manage.py import_users --queued` imports and deletes them.
+USER_IMPORT_ROOT = BASE_DIR / "imports"
+
 AUTHENTICATION_BACKENDS = [
     "apps.core.authentication.CustomAuthBackend",
     "django.contrib.auth.backends.ModelBackend",
@@ -116,7 +167,7 @@ AUTHENTICATION_BACKENDS = [
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "apps.core.authentication.CachedJWTAuthentication",
     ),
     "EXCEPTION_HANDLER": "apps.core.exception_handlers.custom_exception_handler",
 }
@@ -125,8 +176,26 @@ SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=1440),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=7),
     "ROTATE_REFRESH_TOKENS": False,
+    "TOKEN_REFRESH_SERIALIZER": "apps.users.tokens.TokenRefreshSerializer",
 }
 
+# Refresh-token blacklist checks go through an in-process bloom filter with this
+# false-positive rate. Tokens blacklisted by another process are picked up within
+# SYNC_SECONDS.
+BLACKLIST_FILTER_ERROR_RATE = 0.01
+BLACKLIST_FILTER_SYNC_SECONDS = 1
+
+# Email
+# Emails are queued in the EmailOutbox table and delivered by `manage.py send_outbox_emails`.
+# Use "django.core.mail.backends.locmem.EmailBackend" or the filebased backend locally.
+EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
+EMAIL_OUTBOX_BATCH_SIZE = 100
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5
+# Delay before the first retry, doubled on every further attempt.
+EMAIL_OUTBOX_RETRY_SECONDS = 30
+# Emails a worker took but never reported on (it died mid-batch) are retried after this.
+EMAIL_OUTBOX_CLAIM_SECONDS = 300
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
 
@@ -144,17 +213,102 @@ USE_TZ = True
 
 STATIC_URL = "static/"
 
+MEDIA_URL = "/media/"
+MEDIA_ROOT = BASE_DIR / "media"
+
+# Profile images get square thumbnails in these sizes, generated in a background
+# process pool and stored next to the original.
+PROFILE_THUMBNAIL_SIZES = (32, 64, 128, 256)
+PROFILE_THUMBNAIL_FORMAT = "WEBP"
+PROFILE_THUMBNAIL_WORKERS = 2
+PROFILE_THUMBNAIL_MAX_PENDING = 256
+
+# Redis server shared by every process: the cache below and the channel layer.
+REDIS_HOST = ("127.0.0.1", 6379)
+
+# The cache must be shared by all processes: user and profile caches are invalidated,
+# presence is tracked and per-process indexes are told to reload through it. A
+# per-process backend such as LocMemCache only works with a single worker.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": f"redis://{REDIS_HOST[0]}:{REDIS_HOST[1]}/1",
+    },
+}
+
+# Users looked up by HTTP and WebSocket authentication are cached across requests.
+USER_CACHE_SECONDS = 60
+USER_CACHE_VERSION = 1
+
+# Serialized profile responses are cached per user until the user or profile changes,
+# and for at most PROFILE_CACHE_SECONDS, which bounds staleness after bulk updates that
+# bypass model signals.
+PROFILE_CACHE_SECONDS = 10 * 60
+
+# Username autocomplete is served from an in-memory index of up to MAX_ENTRIES names;
+# above that it queries the normalized, indexed column.
+AUTOCOMPLETE_MAX_ENTRIES = 2_000_000
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 ASGI_APPLICATION = 'config.asgi.application'
+
+# WebSocket admission control: at most CONCURRENCY handshakes run at once per process,
+# up to QUEUE_SIZE more wait QUEUE_TIMEOUT seconds, the rest are closed with a
+# retry-after hint between the two RETRY_AFTER bounds (plus jitter).
+WS_HANDSHAKE_CONCURRENCY = 64
+WS_HANDSHAKE_QUEUE_SIZE = 1024
+WS_HANDSHAKE_QUEUE_TIMEOUT = 5
+WS_RETRY_AFTER_SECONDS = (1, 30)
+
+# WebSocket keepalive: clients are pinged every PING_INTERVAL seconds and closed when
+# nothing (a pong or any other frame) arrived for IDLE_TIMEOUT seconds.
+WS_PING_INTERVAL = 20
+WS_IDLE_TIMEOUT = 60
+
+# Chat message bodies of at least THRESHOLD bytes are stored zlib-compressed (0-9 LEVEL).
+CHAT_MESSAGE_COMPRESSION_THRESHOLD = 1024
+CHAT_MESSAGE_COMPRESSION_LEVEL = 6
+
+# Recently saved client_msg_ids remembered per process for deduplicating retried sends:
+# up to CACHE_SIZE ids for each of the CACHE_SENDERS most recent senders.
+CHAT_CLIENT_MSG_ID_CACHE_SENDERS = 10000
+CHAT_CLIENT_MSG_ID_CACHE_SIZE = 64
+
+# Rooms whose @mention matcher each process keeps built.
+CHAT_MENTION_MATCHER_CACHE_SIZE = 1000
+
+# Reaction counts shown on messages are written in batches every FLUSH_MILLISECONDS.
+CHAT_REACTION_FLUSH_MILLISECONDS = 250
+
+# New messages for offline room members are counted per room and written every
+# FLUSH_SECONDS. `manage.py send_offline_digests` emails each such user at most once per
+# DIGEST_INTERVAL_SECONDS, through the email outbox.
+CHAT_OFFLINE_INBOX_FLUSH_SECONDS = 1
+CHAT_DIGEST_INTERVAL_SECONDS = 900
+CHAT_DIGEST_BATCH_SIZE = 500
+
+# Chat attachments are uploaded in chunks of at most MAX_CHUNK_SIZE bytes, up to MAX_SIZE
+# bytes per file, into ATTACHMENT_ROOT (not served publicly, downloads check room
+# membership). Each process keeps the running checksum of HASHER_CACHE_SIZE uploads.
+# `manage.py purge_stale_attachments` deletes uploads unfinished after EXPIRY_HOURS.
+ATTACHMENT_ROOT = BASE_DIR / "attachments"
+ATTACHMENT_MAX_SIZE = 1024 * 1024 * 1024
+ATTACHMENT_MAX_CHUNK_SIZE = 8 * 1024 * 1024
+ATTACHMENT_HASHER_CACHE_SIZE = 1000
+ATTACHMENT_UPLOAD_EXPIRY_HOURS = 24
+
+# Group sends in flight at once while an announcement fans out to its rooms.
+CHAT_ANNOUNCEMENT_CONCURRENCY = 100
+
 CHANNEL_LAYERS = {
     'default': {
         'BACKEND': 'channels_redis.core.RedisChannelLayer',
         'CONFIG': {
-            "hosts": [('127.0.0.1', 6379)],
+            "hosts": [REDIS_HOST],
             "timeout": 300,
         },
     },
@@ -0,0 +1,233 @@
+"""
+Pre-forking supervisor for the ASGI application.
+
+Loads Django and builds the ASGI application once, binds the listening socket, then
+forks daphne workers that all accept on that socket. Workers share the preloaded
+modules copy-on-write, are restarted when they crash or after serving --max-requests
+connections, and drain gracefully on SIGTERM.
+
+    python -m config.supervisor --bind 0.0.0.0 --port 8000 --workers 4
+"""
+import argparse
+import gc
+import logging
+import os
+import random
+import signal
+import socket
+import sys
+import time
+
+logger = logging.getLogger("config.supervisor")
+
+
+def _reinstall_reactor():
+    """
+    Importing daphne (via INSTALLED_APPS) installed a Twisted reactor on an event loop
+    created in the parent; its selector is shared by every forked child. Each worker
+    gets a fresh loop and reactor, the same way daphne's own test server does it.
+    """
+    import asyncio
+
+    from twisted.internet import asyncioreactor
+
+    sys.modules.pop("twisted.internet.reactor", None)
+    sys.modules.pop("daphne.server", None)
+    event_loop = asyncio.new_event_loop()
+    asyncioreactor.install(event_loop)
+    asyncio.set_event_loop(event_loop)
+
+
+class RequestLimiter:
+    """ASGI wrapper that calls `on_limit` once `limit` connections have been served."""
+
+    def __init__(self, application, *, limit, on_limit):
+        self.application = application
+        self.limit = limit
+        self.on_limit = on_limit
+        self.served = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] in ("http", "websocket"):
+            self.served += 1
+            if self.served == self.limit:
+                self.on_limit()
+        return await self.application(scope, receive, send)
+
+
+def run_worker(*, application, listen_socket, max_requests, drain_timeout):
+    _reinstall_reactor()
+
+    import asyncio
+
+    from daphne.server import Server
+    from twisted.internet import reactor
+
+    class WorkerServer(Server):
+        draining = False
+
+        def listen_success(self, port):
+            self.ports = [*getattr(self, "ports", []), port]
+            super().listen_success(port)
+
+        def drain(self):
+            """
+            Stops accepting connections, waits for open ones to finish, then writes out
+            the write-behind buffers (reaction counts, offline inboxes) before stopping.
+            """
+            if self.draining:
+                return
+            self.draining = True
+            logger.info("Worker %s draining", os.getpid())
+            for port in getattr(self, "ports", []):
+                port.stopListening()
+            deadline = time.monotonic() + drain_timeout
+
+            def check():
+                if not self.connections or time.monotonic() >= deadline:
+                    flush_buffers()
+                else:
+                    reactor.callLater(0.5, check)
+
+            def flush_buffers():
+                from apps.common.buffers import flush_all
+
+                flush = asyncio.ensure_future(flush_all(), loop=reactor._asyncioEventloop)
+                flush.add_done_callback(lambda _: self.stop())
+
+            check()
+
+    server = None
+    if max_requests:
+        application = RequestLimiter(
+            application, limit=max_requests, on_limit=lambda: reactor.callLater(0, server.drain)
+        )
+    server = WorkerServer(
+        application=application,
+        # daphne's fd endpoint only adopts IPv4 sockets
+        endpoints=[f"fd:fileno={listen_socket.fileno()}"],
+        signal_handlers=False,
+    )
+    reactor._asyncioEventloop.add_signal_handler(signal.SIGTERM, server.drain)
+    reactor._asyncioEventloop.add_signal_handler(signal.SIGINT, server.drain)
+    server.run()
+
+
+class Supervisor:
+    # A worker crashing sooner than this after starting is restarted with a delay
+    min_worker_lifetime = 5
+
+    def __init__(self, *, application, listen_socket, options):
+        self.application = application
+        self.listen_socket = listen_socket
+        self.options = options
+        self.workers = {}
+        self.shutting_down = False
+
+    def spawn_worker(self):
+        max_requests = self.options.max_requests
+        if max_requests:
+            # Jitter keeps workers from all restarting at the same moment
+            max_requests += random.randint(0, self.options.max_requests_jitter)
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            exit_code = 0
+            try:
+                run_worker(
+                    application=self.application,
+                    listen_socket=self.listen_socket,
+                    max_requests=max_requests,
+                    drain_timeout=self.options.drain_timeout,
+                )
+            except BaseException:
+                logger.exception("Worker %s failed", os.getpid())
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        self.workers[pid] = time.monotonic()
+        logger.info("Started worker %s", pid)
+
+    def stop(self, signum, frame):
+        if self.shutting_down:
+            return
+        self.shutting_down = True
+        logger.info("Shutting down %s workers", len(self.workers))
+        for pid in self.workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for _ in range(self.options.workers):
+            self.spawn_worker()
+        kill_deadline = None
+        while self.workers:
+            if self.shutting_down and kill_deadline is None:
+                kill_deadline = time.monotonic() + self.options.drain_timeout + 5
+            if kill_deadline is not None and time.monotonic() >= kill_deadline:
+                logger.warning("Killing %s workers that did not drain in time", len(self.workers))
+                for pid in self.workers:
+                    os.kill(pid, signal.SIGKILL)
+                kill_deadline = float("inf")
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                time.sleep(0.2)
+                continue
+            started_at = self.workers.pop(pid, None)
+            if started_at is None:
+                continue
+            exit_code = os.waitstatus_to_exitcode(status)
+            logger.info("Worker %s exited with status %s", pid, exit_code)
+            if not self.shutting_down:
+                if exit_code != 0 and time.monotonic() - started_at < self.min_worker_lifetime:
+                    time.sleep(1)
+                self.spawn_worker()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--bind", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--max-requests",
+        type=int,
+        default=0,
+        help="Restart a worker after it served this many connections, 0 disables",
+    )
+    parser.add_argument("--max-requests-jitter", type=int, default=0)
+    parser.add_argument(
+        "--drain-timeout",
+        type=float,
+        default=30,
+        help="Seconds a worker waits for open connections before stopping",
+    )
+    parser.add_argument("--backlog", type=int, default=2048)
+    options = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(process)d] %(message)s")
+
+    listen_socket = socket.create_server((options.bind, options.port), backlog=options.backlog)
+    listen_socket.set_inheritable(True)
+
+    # Django setup and the ASGI router are built once here and shared by all workers
+    from config.asgi import application
+    from django.db import connections
+
+    connections.close_all()
+    # Keep the preloaded objects out of the collector so it doesn't dirty shared pages
+    gc.freeze()
+
+    logger.info("Listening on %s:%s", options.bind, options.port)
+    Supervisor(application=application, listen_socket=listen_socket, options=options).run()
+
+
+if __name__ == "__main__":
+    main()